@@ -2,15 +2,19 @@
 Adversarial Expert LLM Agent - Tác nhân chuyên gia đối kháng trong hệ thống MCTS
 """
 
-import json
+import asyncio
 import re
 import logging
-from typing import Dict, List, Optional, Any, Set
-from dataclasses import dataclass
+from typing import Dict, List, Optional, Any, Set, Tuple
+from dataclasses import dataclass, field, asdict, replace
 from enum import Enum
 
 from .base_agent import BaseAgent, AgentInput, AgentOutput
+from backend.core.llm_client import LLMResponse
 from backend.config import MCTSConfig, ADVERSARIAL_ROLE_MAPPING
+from backend.core.idea_model import Idea
+from backend.core.prompt_assembly import AssembledPrompt, assemble_prompt
+from backend.core.structured_output import worst_status
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +34,7 @@ class AdversarialAttackTask:
     active_roles: List[AdversarialRole]
     attack_intensity: str = "aggressive"  # "mild", "moderate", "aggressive"
     iteration: int = 1
+    ideas: List[Idea] = field(default_factory=list)  # Ý tưởng đã parse (content_type "ideas")
 
 @dataclass
 class VulnerabilityAssessment:
@@ -40,6 +45,7 @@ class VulnerabilityAssessment:
     evidence: List[str]
     potential_impact: str
     mitigation_suggestions: List[str]
+    role: str = ""  # Vai trò phát hiện (khi tấn công theo từng vai trò)
 
 class AdversarialExpertAgent(BaseAgent):
     """
@@ -88,44 +94,249 @@ class AdversarialExpertAgent(BaseAgent):
         # Set active roles
         self.active_roles = set(task.active_roles)
         
-        # Tạo prompt tấn công
-        attack_prompt = self._build_adversarial_attack_prompt(task, agent_input)
+        if self.config.per_idea_review and task.content_type == "ideas" and task.ideas:
+            return await self._process_per_idea_attack(agent_input)
         
-        # Gọi LLM với temperature cao để khuyến khích aggressive thinking
-        temperature = self._get_temperature_by_intensity(task.attack_intensity)
+        llm_response, vulnerabilities, structured_status, role_stats = await self._attack(
+            task, agent_input, use_conversation_history=task.iteration > 1
+        )
+        
+        if not llm_response.success:
+            return self._create_agent_output(
+                content="",
+                success=False,
+                agent_input=agent_input,
+                error=llm_response.error
+            )
+        
+        # Post-process output
+        processed_output = await self.post_process_output(llm_response, agent_input)
+        
+        metadata = {
+            "content_type": task.content_type,
+            "active_roles": [role.value for role in task.active_roles],
+            "attack_intensity": task.attack_intensity,
+            "vulnerabilities_found": len(vulnerabilities),
+            "vulnerabilities": vulnerabilities,
+            "token_usage": llm_response.usage
+        }
+        if structured_status:
+            metadata["structured_output"] = structured_status
+        if role_stats:
+            metadata["role_attacks"] = role_stats
+        
+        return self._create_agent_output(
+            content=processed_output,
+            success=True,
+            agent_input=agent_input,
+            metadata=metadata
+        )
+    
+    async def _attack(self,
+                      task: AdversarialAttackTask,
+                      agent_input: AgentInput,
+                      max_tokens: Optional[int] = None,
+                      use_conversation_history: bool = True,
+                      instruction: str = "") -> Tuple[LLMResponse, List[VulnerabilityAssessment], Optional[str], Dict[str, Any]]:
+        """Tấn công nội dung của task: một call cho tất cả vai trò, hoặc mỗi vai trò một call song song
+        khi adversarial_role_fanout bật. Trả về (response, vulnerabilities, trạng thái structured output,
+        thống kê theo vai trò)."""
+        if self.config.adversarial_role_fanout and len(task.active_roles) > 1:
+            return await self._attack_by_role(task, agent_input, max_tokens, use_conversation_history, instruction)
+        
+        llm_response, vulnerabilities, structured_status = await self._single_attack(
+            task, agent_input, max_tokens, use_conversation_history, True, instruction
+        )
+        return llm_response, vulnerabilities, structured_status, {}
+    
+    async def _single_attack(self,
+                             task: AdversarialAttackTask,
+                             agent_input: AgentInput,
+                             max_tokens: Optional[int],
+                             use_conversation_history: bool,
+                             record_history: bool,
+                             instruction: str = "") -> Tuple[LLMResponse, List[VulnerabilityAssessment], Optional[str]]:
+        """Một call LLM tấn công với các vai trò trong task; content của response đã là markdown"""
+        response_format = self._structured_response_format(task.content_type)
+        attack_prompt = self._with_structured_instructions(
+            self._build_adversarial_attack_prompt(task, agent_input).with_dynamic(instruction), task.content_type
+        )
         
+        # Gọi LLM với temperature cao để khuyến khích aggressive thinking
         llm_response = await self._make_llm_call(
             user_message=attack_prompt,
-            temperature=temperature,
-            use_conversation_history=task.iteration > 1
+            temperature=self._get_temperature_by_intensity(task.attack_intensity),
+            max_tokens=max_tokens,
+            use_conversation_history=use_conversation_history,
+            record_history=record_history,
+            response_format=response_format
         )
         
         if not llm_response.success:
+            return llm_response, [], None
+        
+        content, vulnerabilities, structured_status = await self._parse_attack_response(
+            llm_response.content, task.content_type, response_format is not None
+        )
+        return replace(llm_response, content=content), vulnerabilities, structured_status
+    
+    async def _attack_by_role(self,
+                              task: AdversarialAttackTask,
+                              agent_input: AgentInput,
+                              max_tokens: Optional[int],
+                              use_conversation_history: bool,
+                              instruction: str) -> Tuple[LLMResponse, List[VulnerabilityAssessment], Optional[str], Dict[str, Any]]:
+        """Mỗi vai trò một call ngắn chạy song song (max_tokens theo vai trò), gộp vulnerabilities
+        và markdown theo thứ tự vai trò. History chỉ ghi một lượt cho kết quả đã gộp.
+        Trạng thái structured output là trạng thái tệ nhất của các vai trò (từng vai trò trong role_stats)."""
+        
+        def role_budget(role: AdversarialRole) -> int:
+            budget = self.config.adversarial_role_max_tokens.get(role.value, self.config.adversarial_role_default_max_tokens)
+            return min(budget, max_tokens) if max_tokens else budget
+        
+        results = await asyncio.gather(*(
+            self._single_attack(
+                replace(task, active_roles=[role]),
+                agent_input,
+                role_budget(role),
+                use_conversation_history,
+                False,
+                instruction + f"\n\nChỉ tấn công với vai trò {self.role_mapping.get(role.value, role.value)}; "
+                "các vai trò khác được thực hiện riêng."
+            )
+            for role in task.active_roles
+        ))
+        
+        sections, vulnerabilities, role_stats, errors = [], [], {}, []
+        for role, (response, role_vulnerabilities, role_status) in zip(task.active_roles, results):
+            role_stats[role.value] = {
+                "success": response.success,
+                "max_tokens": role_budget(role),
+                "vulnerabilities": len(role_vulnerabilities),
+                "completion_tokens": (response.usage or {}).get("completion_tokens", 0)
+            }
+            if role_status:
+                role_stats[role.value]["structured_output"] = role_status
+            if not response.success:
+                errors.append(f"{role.value}: {response.error}")
+                continue
+            
+            for vulnerability in role_vulnerabilities:
+                vulnerability.role = role.value
+            vulnerabilities.extend(role_vulnerabilities)
+            sections.append(f"# VAI TRÒ: {self.role_mapping.get(role.value, role.value).upper()}\n\n{response.content}")
+        
+        if not sections:
+            return LLMResponse(
+                content="", usage={}, model=self.config.llm.model, success=False, error="; ".join(errors)
+            ), [], None, role_stats
+        
+        if errors:
+            logger.warning(f"AE role attacks failed: {'; '.join(errors)}")
+        
+        content = "\n\n".join(sections)
+        if use_conversation_history:
+            self._record_turn(self._build_adversarial_attack_prompt(task, agent_input), content)
+        
+        usage = self._sum_token_usage(response.usage for response, _, _ in results if response.success)
+        structured_status = worst_status([status for response, _, status in results if response.success])
+        return LLMResponse(content=content, usage=usage, model=self.config.llm.model, success=True), \
+            vulnerabilities, structured_status, role_stats
+    
+    async def _parse_attack_response(self,
+                                     content: str,
+                                     content_type: str,
+                                     structured_enabled: bool) -> Tuple[str, List[VulnerabilityAssessment], Optional[str]]:
+        """Parse vulnerabilities: JSON nếu structured output bật, regex trên text nếu không.
+        Trả về (markdown, vulnerabilities, trạng thái structured output)."""
+        structured = self._parse_structured_output(content, content_type) if structured_enabled else None
+        
+        if structured and structured.data and "vulnerabilities" in structured.data:
+            vulnerabilities = [
+                VulnerabilityAssessment(
+                    category=item["category"],
+                    severity=item["severity"],
+                    description=item["description"],
+                    evidence=item.get("evidence", []),
+                    potential_impact=item.get("potential_impact", ""),
+                    mitigation_suggestions=item.get("mitigation_suggestions", [])
+                )
+                for item in structured.data["vulnerabilities"][:10]
+            ]
+            return self._render_structured_output(structured.data, vulnerabilities), vulnerabilities, structured.status
+        
+        return content, await self._parse_vulnerabilities(content), structured.status if structured else None
+    
+    async def _process_per_idea_attack(self, agent_input: AgentInput) -> AgentOutput:
+        """Tấn công từng ý tưởng trong call riêng (song song), gộp vulnerabilities cho SA.
+        Ý tưởng không đổi nội dung dùng lại kết quả của vòng trước."""
+        task: AdversarialAttackTask = agent_input.data
+        
+        async def review(idea: Idea) -> Optional[Dict[str, Any]]:
+            llm_response, vulnerabilities, status, role_stats = await self._attack(
+                replace(task, content_to_attack=idea.text),
+                agent_input,
+                max_tokens=self.config.per_idea_review_max_tokens,
+                use_conversation_history=False,
+                instruction=f"\n\nChỉ tấn công ý tưởng trên (ý tưởng {idea.position + 1}/{len(task.ideas)} của vòng này), "
+                            "tập trung vào các điểm yếu chí mạng nhất."
+            )
+            if not llm_response.success:
+                logger.warning(f"AE attack failed for idea {idea.id}: {llm_response.error}")
+                return None
+            
+            return {"content": llm_response.content, "vulnerabilities": [asdict(v) for v in vulnerabilities],
+                    "structured_output": status, "role_attacks": role_stats, "token_usage": llm_response.usage}
+        
+        # Cùng nội dung nhưng khác vai trò/cường độ tấn công thì không dùng lại kết quả
+        scope = f"{task.content_type}:{task.attack_intensity}:{','.join(role.value for role in task.active_roles)}"
+        reviews = await self._review_ideas(task.ideas, review, scope=scope)
+        completed = [(idea, result, reused) for idea, result, reused in reviews if result]
+        
+        if not completed:
             return self._create_agent_output(
                 content="",
                 success=False,
                 agent_input=agent_input,
-                error=llm_response.error
+                error="Per-idea attack failed for all ideas"
             )
         
-        # Parse vulnerabilities
-        vulnerabilities = await self._parse_vulnerabilities(llm_response.content)
+        sections = []
+        for idea, result, reused in reviews:
+            note = " _(không đổi so với vòng trước, dùng lại kết quả tấn công)_" if reused else ""
+            body = result["content"] if result else "_Không tấn công được ý tưởng này._"
+            sections.append(f"# Ý TƯỞNG {idea.position + 1}: {idea.name}{note}\n\n{body}")
+        
+        vulnerabilities = [
+            VulnerabilityAssessment(**item) for _, result, _ in completed for item in result["vulnerabilities"]
+        ]
         
-        # Post-process output
+        llm_response = LLMResponse(content="\n\n".join(sections), usage={}, model=self.config.llm.model, success=True)
         processed_output = await self.post_process_output(llm_response, agent_input)
         
+        metadata = {
+            "content_type": task.content_type,
+            "active_roles": [role.value for role in task.active_roles],
+            "attack_intensity": task.attack_intensity,
+            "vulnerabilities_found": len(vulnerabilities),
+            "vulnerabilities": vulnerabilities,
+            "vulnerabilities_by_idea": {
+                idea.id: len(result["vulnerabilities"]) for idea, result, _ in completed
+            },
+            "idea_reviews": self._idea_review_summary(reviews),
+            "token_usage": self._sum_token_usage(
+                result.get("token_usage") for _, result, reused in completed if not reused
+            )
+        }
+        structured_status = worst_status([result.get("structured_output") for _, result, _ in completed])
+        if structured_status:
+            metadata["structured_output"] = structured_status
+        
         return self._create_agent_output(
             content=processed_output,
             success=True,
             agent_input=agent_input,
-            metadata={
-                "content_type": task.content_type,
-                "active_roles": [role.value for role in task.active_roles],
-                "attack_intensity": task.attack_intensity,
-                "vulnerabilities_found": len(vulnerabilities),
-                "vulnerabilities": vulnerabilities,
-                "token_usage": llm_response.usage
-            }
+            metadata=metadata
         )
     
     async def _process_raw_content(self, agent_input: AgentInput) -> AgentOutput:
@@ -190,28 +401,25 @@ class AdversarialExpertAgent(BaseAgent):
     
     def _build_adversarial_attack_prompt(self, 
                                        task: AdversarialAttackTask,
-                                       agent_input: AgentInput) -> str:
-        """Xây dựng prompt cho cuộc tấn công đối kháng"""
-        
-        # Build roles section
-        roles_section = self._build_roles_section(task.active_roles, task.attack_intensity)
+                                       agent_input: AgentInput) -> AssembledPrompt:
+        """Xây dựng prompt cho cuộc tấn công đối kháng (vai trò/kịch bản cố định trước, nội dung của vòng sau)"""
         
-        # Build attack scenarios
-        scenarios_section = self._build_attack_scenarios(task.content_type)
+        # Vai trò và kịch bản không phụ thuộc nội dung: render một lần cho mỗi tổ hợp
+        roles_section = self._static_section(
+            f"roles:{task.attack_intensity}:{','.join(role.value for role in task.active_roles)}",
+            lambda: self._build_roles_section(task.active_roles, task.attack_intensity)
+        )
+        scenarios_section = self._static_section(
+            f"scenarios:{task.content_type}",
+            lambda: self._build_attack_scenarios(task.content_type)
+        )
         
-        prompt = f"""
-# NHIỆM VỤ TẤN CÔNG ĐỐI KHÁNG - VÒNG {task.iteration}
-
-## NỘI DUNG CẦN TẤN CÔNG
+        instructions = f"""
+# NHIỆM VỤ TẤN CÔNG ĐỐI KHÁNG
 
 **Loại nội dung:** {task.content_type.upper()}
 **Mức độ tấn công:** {task.attack_intensity.upper()}
 
-**Nội dung:**
-```
-{task.content_to_attack}
-```
-
 ## VAI TRÒ ĐANG KÍCH HOẠT
 
 {roles_section}
@@ -222,8 +430,6 @@ class AdversarialExpertAgent(BaseAgent):
 
 ## YÊU CẦU CỤ THỂ
 
-{"### ĐÂY LÀ VÒNG TẤN CÔNG SỐ " + str(task.iteration) + " - HÃY TẤN CÔNG SÂU HƠN VÀ TÌM RA CÁC LỖ HỔNG TINH VI" if task.iteration > 1 else ""}
-
 Thực hiện cuộc tấn công đối kháng **{task.attack_intensity.upper()}** theo đúng format trong system prompt.
 
 **Nhiệm vụ chính:**
@@ -244,14 +450,33 @@ Thực hiện cuộc tấn công đối kháng **{task.attack_intensity.upper()}
 - Scenarios phải realistic và có thể xảy ra
 - Focus vào actionable weaknesses
 - Maintain professional tone dù aggressive
+"""
+        
+        budget = self._prompt_budget(use_history=task.iteration > 1)
+        (content_to_attack,), context_text = self._fit_prompt_inputs(
+            budget,
+            fixed=[instructions],
+            inputs=[task.content_to_attack],
+            context=agent_input.context
+        )
+        
+        inputs = f"""
+## VÒNG {task.iteration}
+{"### ĐÂY LÀ VÒNG TẤN CÔNG SỐ " + str(task.iteration) + " - HÃY TẤN CÔNG SÂU HƠN VÀ TÌM RA CÁC LỖ HỔNG TINH VI" if task.iteration > 1 else ""}
+
+## NỘI DUNG CẦN TẤN CÔNG
+
+```
+{content_to_attack}
+```
 
 ## NGỮ CẢNH BỔ SUNG
-{json.dumps(agent_input.context, ensure_ascii=False, indent=2) if agent_input.context else "Không có ngữ cảnh bổ sung"}
+{context_text or "Không có ngữ cảnh bổ sung"}
 
 🔥 BẮT ĐẦU CUỘC TẤN CÔNG NGAY BÂY GIỜ! 🔥
 """
         
-        return prompt.strip()
+        return assemble_prompt(static=[instructions], dynamic=[inputs])
     
     def _build_roles_section(self, active_roles: List[AdversarialRole], intensity: str) -> str:
         """Xây dựng section mô tả các vai trò"""
@@ -423,6 +648,32 @@ Thực hiện cuộc tấn công đối kháng **{task.attack_intensity.upper()}
             logger.warning(f"Error parsing vulnerabilities: {str(e)}")
             return []
     
+    def _render_structured_output(self,
+                                  data: Dict[str, Any],
+                                  vulnerabilities: List[VulnerabilityAssessment]) -> str:
+        """Markdown từ structured output"""
+        lines = []
+        
+        if data.get("role_attacks"):
+            lines.append("## TẤN CÔNG THEO VAI TRÒ")
+            for attack in data["role_attacks"]:
+                lines += ["", f"### {self.role_mapping.get(attack['role'], attack['role'])}"]
+                lines += [f"- {item}" for item in attack.get("attacks", [])]
+            lines.append("")
+        
+        lines.append("## ĐIỂM YẾU")
+        for vulnerability in vulnerabilities:
+            lines += ["", f"### [{vulnerability.severity.upper()}] {vulnerability.category}: {vulnerability.description}"]
+            lines += [f"- {item}" for item in vulnerability.evidence]
+            if vulnerability.potential_impact:
+                lines.append(f"**Impact:** {vulnerability.potential_impact}")
+            if vulnerability.mitigation_suggestions:
+                lines.append("**Mitigation:**")
+                lines += [f"- {item}" for item in vulnerability.mitigation_suggestions]
+        
+        lines += ["", "## KẾT LUẬN", data.get("overall_verdict", "")]
+        return "\n".join(lines).strip()
+    
     async def validate_input(self, agent_input: AgentInput) -> bool:
         """Validate input cho Adversarial Expert Agent"""
         
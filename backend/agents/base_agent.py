@@ -3,17 +3,36 @@ Base Agent class cho tất cả các LLM agents trong hệ thống MCTS
 """
 
 import asyncio
+import json
 import logging
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Any, Union
+from typing import Dict, List, Optional, Any, Union, Callable, Awaitable, Tuple, Iterable
 from datetime import datetime
 
 from backend.core.llm_client import LLMClient, LLMMessage, LLMResponse, PromptLoader
+from backend.core.history_manager import ConversationHistoryManager
+from backend.core.feedback_compressor import FeedbackCompressor
+from backend.core.token_estimator import (
+    TokenBudget, estimate_tokens, estimate_messages_tokens, context_limit, safety_margin, MESSAGE_OVERHEAD_TOKENS
+)
+from backend.core.structured_output import (
+    StructuredResult, get_schema, build_response_format, format_instructions, parse_structured,
+    STATUS_VALID, STATUS_REPAIRED, STATUS_FAILED
+)
+from backend.core.idea_model import Idea
+from backend.core.context_renderer import render_context, get_profile
+from backend.core.prompt_assembly import AssembledPrompt, prompt_text, static_prefix_chars
 from backend.config import MCTSConfig
 
 logger = logging.getLogger(__name__)
 
+# Số đánh giá theo ý tưởng giữ trong cache của mỗi agent (cũ nhất bị bỏ trước)
+IDEA_REVIEW_CACHE_MAX = 100
+
+# Token chừa cho ngữ cảnh khi các input chính (dữ liệu, nội dung, phản hồi) dùng hết budget
+CONTEXT_RESERVE_TOKENS = 1000
+
 @dataclass
 class AgentInput:
     """Input data cho agent"""
@@ -52,14 +71,42 @@ class BaseAgent(ABC):
         if not self.system_prompt:
             logger.warning(f"No system prompt loaded for agent type: {agent_type}")
         
-        # Conversation history
+        # Conversation history (giới hạn theo token budget riêng của agent)
         self.conversation_history: List[LLMMessage] = []
+        self.history_manager = ConversationHistoryManager(
+            token_budget=config.history_token_budgets.get(agent_type, config.history_token_budget),
+            keep_last_turns=config.history_keep_turns
+        )
+        
+        # Streaming: handler(agent_type, delta) nhận token khi LLM đang sinh
+        self.stream_handler: Optional[Callable[[str, str, int], Any]] = None
         
         # Performance tracking
         self.call_count = 0
+        self.success_count = 0
         self.total_tokens = 0
         self.success_rate = 0.0
         
+        # Structured output: số lần parse JSON hợp lệ ngay / phải sửa / thất bại (fallback regex)
+        self.structured_stats = {STATUS_VALID: 0, STATUS_REPAIRED: 0, STATUS_FAILED: 0}
+        
+        # Đánh giá theo từng ý tưởng: "{scope}:{body_hash}" -> kết quả (dict JSON, lưu cùng checkpoint)
+        self.idea_review_cache: Dict[str, Dict[str, Any]] = {}
+        self.idea_review_stats = {"reviewed": 0, "reused": 0}
+        
+        # Cắt input theo token budget trước khi gửi: số segment bị cắt và số token đã bỏ
+        self.prompt_budget_stats = {"prompts": 0, "truncated_segments": 0, "trimmed_tokens": 0}
+        self.context_render_stats = {"renders": 0, "json_tokens": 0, "rendered_tokens": 0}
+        
+        # Nén extractive phản hồi của agent khác trước khi đưa vào prompt (cache theo hash nội dung)
+        self.feedback_compressor = FeedbackCompressor(
+            target_ratio=config.feedback_compression_ratio,
+            min_tokens=config.feedback_compression_min_tokens
+        )
+        
+        # Segment tĩnh của prompt đã render (không phụ thuộc input), dùng lại giữa các call
+        self._static_sections: Dict[str, str] = {}
+        
     @abstractmethod
     async def process(self, agent_input: AgentInput) -> AgentOutput:
         """
@@ -68,42 +115,74 @@ class BaseAgent(ABC):
         pass
     
     async def _make_llm_call(self, 
-                           user_message: str,
+                           user_message: Union[str, AssembledPrompt],
                            temperature: Optional[float] = None,
                            max_tokens: Optional[int] = None,
-                           use_conversation_history: bool = True) -> LLMResponse:
+                           use_conversation_history: bool = True,
+                           use_cache: bool = True,
+                           record_history: bool = True,
+                           response_format: Optional[Dict[str, Any]] = None) -> LLMResponse:
         """
         Protected method để thực hiện LLM call với error handling
+        
+        record_history=False vẫn dùng history làm ngữ cảnh nhưng không ghi lượt mới vào
+        (dùng cho các call chạy song song như best-of-N, lượt được chọn ghi sau bằng _record_turn).
+        AssembledPrompt được gửi dưới dạng text, phần tĩnh đầu prompt được đánh dấu cho prompt caching.
         """
+        cache_prefix_chars = static_prefix_chars(user_message)
+        user_message = prompt_text(user_message)
+        
         try:
             self.call_count += 1
+            stream_id = self.call_count
+            on_token = (lambda delta: self._emit_token(delta, stream_id)) if self.stream_handler else None
             
             if use_conversation_history and self.conversation_history:
+                # Compact history cũ để history + message mới nằm trong token budget
+                self.conversation_history = self.history_manager.compact(
+                    self.conversation_history,
+                    reserve_tokens=estimate_tokens(user_message),
+                    token_budget=self._prompt_ceiling(max_tokens)
+                )
+                
                 # Continue existing conversation
                 response = await self.llm_client.continue_conversation(
                     conversation_history=self.conversation_history,
                     new_message=user_message,
                     temperature=temperature,
-                    max_tokens=max_tokens
+                    max_tokens=max_tokens,
+                    on_token=on_token,
+                    use_cache=use_cache,
+                    response_format=response_format,
+                    cache_prefix_chars=cache_prefix_chars
                 )
+                
+                if response.success and record_history:
+                    self.conversation_history.append(
+                        LLMMessage(role="user", content=user_message)
+                    )
             else:
                 # Start new conversation
                 response = await self.llm_client.single_prompt(
                     prompt=user_message,
                     system_message=self.system_prompt,
                     temperature=temperature,
-                    max_tokens=max_tokens
+                    max_tokens=max_tokens,
+                    on_token=on_token,
+                    use_cache=use_cache,
+                    response_format=response_format,
+                    cache_prefix_chars=cache_prefix_chars
                 )
                 
                 # Initialize conversation history
-                if use_conversation_history:
+                if use_conversation_history and record_history:
                     self.conversation_history = [
                         LLMMessage(role="system", content=self.system_prompt),
                         LLMMessage(role="user", content=user_message)
                     ]
             
             # Update conversation history if successful
-            if response.success and use_conversation_history:
+            if response.success and use_conversation_history and record_history:
                 self.conversation_history.append(
                     LLMMessage(role="assistant", content=response.content)
                 )
@@ -113,13 +192,15 @@ class BaseAgent(ABC):
                 self.total_tokens += response.usage.get("total_tokens", 0)
             
             # Update success rate
-            successes = sum(1 for i in range(self.call_count) if i == self.call_count - 1 and response.success)
-            self.success_rate = successes / self.call_count if self.call_count > 0 else 0
+            if response.success:
+                self.success_count += 1
+            self.success_rate = self.success_count / self.call_count
             
             return response
             
         except Exception as e:
             logger.error(f"Error in LLM call for {self.agent_type}: {str(e)}")
+            self.success_rate = self.success_count / self.call_count
             return LLMResponse(
                 content="",
                 usage={},
@@ -128,6 +209,213 @@ class BaseAgent(ABC):
                 error=str(e)
             )
     
+    def _prompt_ceiling(self, max_tokens: Optional[int] = None) -> int:
+        """Số token tối đa cho prompt (system + history + message) của một call"""
+        limit = context_limit(self.config.llm.model, self.config.llm.context_window)
+        ceiling = limit - (max_tokens or self.config.llm.max_tokens) - safety_margin(limit)
+        if self.config.max_prompt_tokens > 0:
+            ceiling = min(ceiling, self.config.max_prompt_tokens)
+        return ceiling
+    
+    def _prompt_budget(self, use_history: bool = False, max_tokens: Optional[int] = None) -> TokenBudget:
+        """
+        Token budget cho user message sắp build: trần prompt trừ system prompt và phần chừa cho history.
+        
+        History được chừa tối đa 1/4 trần; phần vượt được compact trong _make_llm_call.
+        """
+        ceiling = self._prompt_ceiling(max_tokens)
+        total = ceiling - estimate_tokens(self.system_prompt) - 2 * MESSAGE_OVERHEAD_TOKENS
+        
+        if use_history and len(self.conversation_history) > 1:
+            history_tokens = estimate_messages_tokens(self.conversation_history[1:])
+            total -= min(history_tokens, ceiling // 4)
+        
+        return TokenBudget(total)
+    
+    def _fit_prompt_inputs(self,
+                           budget: TokenBudget,
+                           fixed: Iterable[str],
+                           inputs: List[str],
+                           context: Optional[Dict[str, Any]] = None) -> Tuple[List[str], str]:
+        """
+        Cắt input của prompt theo thứ tự ưu tiên: phần cố định giữ nguyên, các input chính chia nhau
+        chỗ trống (input ngắn giữ nguyên), ngữ cảnh nhận phần còn lại.
+        
+        Ngữ cảnh được render gọn theo profile của agent (context_renderer), bỏ phần đã có trong prompt.
+        """
+        fixed = list(fixed)
+        budget.take(*fixed)
+        
+        profile = get_profile(self.agent_type)
+        full_context = render_context(context or {}, profile, seen_text="\n".join(fixed + inputs))
+        inputs = budget.fit_many(inputs, reserve=min(estimate_tokens(full_context), CONTEXT_RESERVE_TOKENS))
+        
+        context_text = full_context
+        if estimate_tokens(full_context) > budget.remaining:
+            context_text = render_context(
+                context or {}, profile, max_tokens=budget.remaining, seen_text="\n".join(fixed + inputs)
+            )
+            budget.truncated_segments += 1
+            budget.trimmed_tokens += estimate_tokens(full_context) - estimate_tokens(context_text)
+        budget.take(context_text)
+        
+        self._record_prompt_budget(budget)
+        self._record_context_render(context, context_text)
+        return inputs, context_text
+    
+    def _record_context_render(self, context: Optional[Dict[str, Any]], rendered: str):
+        """So sánh token của ngữ cảnh đã render với JSON indent=2 (cách render cũ)"""
+        if not context:
+            return
+        self.context_render_stats["renders"] += 1
+        self.context_render_stats["json_tokens"] += estimate_tokens(
+            json.dumps(context, ensure_ascii=False, indent=2, default=str)
+        )
+        self.context_render_stats["rendered_tokens"] += estimate_tokens(rendered)
+    
+    def _record_prompt_budget(self, budget: TokenBudget):
+        """Cộng thống kê cắt input của một prompt đã build"""
+        self.prompt_budget_stats["prompts"] += 1
+        self.prompt_budget_stats["truncated_segments"] += budget.truncated_segments
+        self.prompt_budget_stats["trimmed_tokens"] += budget.trimmed_tokens
+        if budget.truncated_segments:
+            logger.info(f"{self.agent_type}: trimmed {budget.trimmed_tokens} tokens from "
+                        f"{budget.truncated_segments} prompt segments to fit {budget.total} token budget")
+    
+    def _structured_response_format(self, phase: str) -> Optional[Dict[str, Any]]:
+        """response_format cho call chính của agent, None nếu structured output tắt"""
+        if not self.config.structured_output:
+            return None
+        
+        return build_response_format(
+            self.agent_type, get_schema(self.agent_type, phase), self.config.structured_output_mode
+        )
+    
+    def _with_structured_instructions(self,
+                                      prompt: Union[str, AssembledPrompt],
+                                      phase: str) -> Union[str, AssembledPrompt]:
+        """Gắn schema vào prompt khi structured output bật (vào phần tĩnh nếu là AssembledPrompt)"""
+        if not self.config.structured_output:
+            return prompt
+        if isinstance(prompt, AssembledPrompt):
+            return prompt.with_static(format_instructions(self.agent_type, phase))
+        return prompt + format_instructions(self.agent_type, phase)
+    
+    def _static_section(self, key: str, build: Callable[[], str]) -> str:
+        """Render một segment tĩnh của prompt một lần rồi dùng lại"""
+        section = self._static_sections.get(key)
+        if section is None:
+            section = self._static_sections[key] = build()
+        return section
+    
+    def _parse_structured_output(self, content: str, phase: str) -> StructuredResult:
+        """Parse output JSON theo schema của agent và cập nhật thống kê"""
+        result = parse_structured(content, get_schema(self.agent_type, phase))
+        self.structured_stats[result.status] += 1
+        
+        if result.status == STATUS_FAILED:
+            logger.warning(f"{self.agent_type}: structured output invalid ({'; '.join(result.errors[:3])}), falling back to text parser")
+        elif result.errors:
+            logger.info(f"{self.agent_type}: structured output repaired ({len(result.errors)} issues)")
+        
+        return result
+    
+    async def _review_ideas(self,
+                            ideas: List[Idea],
+                            review: Callable[[Idea], Awaitable[Optional[Dict[str, Any]]]],
+                            scope: str) -> List[Tuple[Idea, Optional[Dict[str, Any]], bool]]:
+        """
+        Chạy review cho từng ý tưởng song song, trả về (idea, kết quả, dùng lại từ cache) theo thứ tự.
+        
+        Ý tưởng có nội dung không đổi (cùng body_hash trong cùng scope, kể cả khi đổi vị trí)
+        dùng lại kết quả đã cache mà không gọi LLM; kết quả None (call lỗi) không được cache.
+        """
+        keys = [f"{scope}:{idea.body_hash}" for idea in ideas]
+        pending = {key: idea for idea, key in zip(ideas, keys) if key not in self.idea_review_cache}
+        
+        results = await asyncio.gather(*(review(idea) for idea in pending.values()))
+        fresh = dict(zip(pending, results))
+        for key, result in fresh.items():
+            if result is not None:
+                self.idea_review_cache[key] = result
+        
+        reviews = [
+            (idea, fresh[key] if key in fresh else self.idea_review_cache[key], key not in fresh)
+            for idea, key in zip(ideas, keys)
+        ]
+        
+        while len(self.idea_review_cache) > IDEA_REVIEW_CACHE_MAX:
+            self.idea_review_cache.pop(next(iter(self.idea_review_cache)))
+        
+        self.idea_review_stats["reviewed"] += len(pending)
+        self.idea_review_stats["reused"] += len(ideas) - len(pending)
+        
+        return reviews
+    
+    @staticmethod
+    def _idea_review_summary(reviews: List[Tuple[Idea, Optional[Dict[str, Any]], bool]]) -> Dict[str, int]:
+        """Số ý tưởng được đánh giá mới / dùng lại / lỗi trong một lần per-idea review"""
+        return {
+            "ideas": len(reviews),
+            "reviewed": sum(1 for _, result, reused in reviews if result and not reused),
+            "reused": sum(1 for _, result, reused in reviews if reused),
+            "failed": sum(1 for _, result, _ in reviews if not result)
+        }
+    
+    @staticmethod
+    def _sum_token_usage(usages: Iterable[Optional[Dict[str, Any]]]) -> Dict[str, int]:
+        """Cộng token usage của nhiều call"""
+        total: Dict[str, int] = {}
+        for usage in usages:
+            for key, value in (usage or {}).items():
+                if isinstance(value, int):
+                    total[key] = total.get(key, 0) + value
+        return total
+    
+    def _record_turn(self, user_message: Union[str, AssembledPrompt], assistant_content: str):
+        """Ghi một lượt user/assistant vào history"""
+        if not self.conversation_history:
+            self.conversation_history = [LLMMessage(role="system", content=self.system_prompt)]
+        
+        self.conversation_history.append(LLMMessage(role="user", content=prompt_text(user_message)))
+        self.conversation_history.append(LLMMessage(role="assistant", content=assistant_content))
+    
+    def set_stream_handler(self, handler: Optional[Callable[[str, str, int], Any]]):
+        """Bật (hoặc tắt với None) streaming token cho agent, handler(agent_type, delta, stream_id)"""
+        self.stream_handler = handler
+    
+    def _emit_token(self, delta: str, stream_id: int):
+        """Chuyển token từ LLM stream tới stream handler, stream_id phân biệt các call chạy song song"""
+        try:
+            self.stream_handler(self.agent_type, delta, stream_id)
+        except Exception as e:
+            logger.warning(f"Stream handler error for {self.agent_type}: {str(e)}")
+    
+    def export_state(self) -> Dict[str, Any]:
+        """Lấy state có thể serialize của agent (dùng cho checkpoint)"""
+        return {
+            "conversation_history": [
+                {"role": msg.role, "content": msg.content} for msg in self.conversation_history
+            ],
+            "call_count": self.call_count,
+            "success_count": self.success_count,
+            "total_tokens": self.total_tokens,
+            "success_rate": self.success_rate,
+            "idea_review_cache": self.idea_review_cache
+        }
+    
+    def restore_state(self, state: Dict[str, Any]):
+        """Khôi phục state từ checkpoint"""
+        self.conversation_history = [
+            LLMMessage(role=msg["role"], content=msg["content"])
+            for msg in state.get("conversation_history", [])
+        ]
+        self.call_count = state.get("call_count", self.call_count)
+        self.success_count = state.get("success_count", self.success_count)
+        self.total_tokens = state.get("total_tokens", self.total_tokens)
+        self.success_rate = state.get("success_rate", self.success_rate)
+        self.idea_review_cache = dict(state.get("idea_review_cache", self.idea_review_cache))
+    
     def reset_conversation(self):
         """Reset conversation history"""
         self.conversation_history = []
@@ -138,9 +426,17 @@ class BaseAgent(ABC):
         return {
             "agent_type": self.agent_type,
             "call_count": self.call_count,
+            "failed_calls": self.call_count - self.success_count,
             "total_tokens": self.total_tokens,
             "success_rate": self.success_rate,
-            "avg_tokens_per_call": self.total_tokens / max(self.call_count, 1)
+            "avg_tokens_per_call": self.total_tokens / max(self.call_count, 1),
+            "history_compactions": self.history_manager.compactions,
+            "history_tokens_saved": self.history_manager.tokens_saved,
+            "structured_output": dict(self.structured_stats),
+            "idea_reviews": dict(self.idea_review_stats),
+            "prompt_budget": dict(self.prompt_budget_stats),
+            "context_render": dict(self.context_render_stats),
+            "feedback_compression": self.feedback_compressor.get_stats()
         }
     
     def _create_agent_output(self, 
@@ -207,21 +503,19 @@ class AgentOrchestrator:
     Orchestrator để quản lý multiple agents
     """
     
-    def __init__(self, config: MCTSConfig):
+    def __init__(self, config: MCTSConfig, llm_client: Optional[LLMClient] = None):
         self.config = config
         self.agents: Dict[str, BaseAgent] = {}
-        self.llm_client: Optional[LLMClient] = None
+        # LLM client dùng chung được inject từ owner; orchestrator không tự mở session riêng
+        self.llm_client: Optional[LLMClient] = llm_client
     
     async def __aenter__(self):
         """Async context manager entry"""
-        self.llm_client = LLMClient(self.config.llm)
-        await self.llm_client.start_session()
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """Async context manager exit"""
-        if self.llm_client:
-            await self.llm_client.close_session()
+        self.agents.clear()
     
     def register_agent(self, agent: BaseAgent):
         """Đăng ký agent với orchestrator"""
@@ -2,14 +2,16 @@
 Critical Thinking LLM Agent - Tác nhân tư duy phản biện trong hệ thống MCTS
 """
 
-import json
 import re
 import logging
 from typing import Dict, List, Optional, Any, Tuple
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
 
 from .base_agent import BaseAgent, AgentInput, AgentOutput
+from backend.core.llm_client import LLMResponse
 from backend.config import MCTSConfig, EVALUATION_CRITERIA
+from backend.core.idea_model import Idea
+from backend.core.prompt_assembly import AssembledPrompt, assemble_prompt
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +22,7 @@ class CriticalAnalysisTask:
     content_type: str  # "analysis" hoặc "ideas"  
     focus_areas: List[str]
     iteration: int = 1
+    ideas: List[Idea] = field(default_factory=list)  # Ý tưởng đã parse (content_type "ideas")
 
 @dataclass
 class CriticalScore:
@@ -77,14 +80,21 @@ class CriticalThinkingAgent(BaseAgent):
         # Xác định tiêu chí đánh giá
         criteria = self._get_evaluation_criteria(task.content_type)
         
+        if self.config.per_idea_review and task.content_type == "ideas" and task.ideas:
+            return await self._process_per_idea_analysis(agent_input, criteria)
+        
         # Tạo prompt phân tích phản biện
-        analysis_prompt = self._build_critical_analysis_prompt(task, criteria, agent_input)
+        response_format = self._structured_response_format(task.content_type)
+        analysis_prompt = self._with_structured_instructions(
+            self._build_critical_analysis_prompt(task, criteria, agent_input), task.content_type
+        )
         
         # Gọi LLM với temperature thấp để đảm bảo tính chính xác
         llm_response = await self._make_llm_call(
             user_message=analysis_prompt,
             temperature=0.2,  # Rất thấp để đảm bảo đánh giá khách quan
-            use_conversation_history=task.iteration > 1
+            use_conversation_history=task.iteration > 1,
+            response_format=response_format
         )
         
         if not llm_response.success:
@@ -95,14 +105,114 @@ class CriticalThinkingAgent(BaseAgent):
                 error=llm_response.error
             )
         
-        # Parse và structured output
-        structured_analysis = await self._parse_critical_analysis(
-            llm_response.content, criteria
+        content, structured_analysis, structured_status = await self._parse_analysis_response(
+            llm_response.content, task.content_type, criteria, response_format is not None
         )
+        llm_response = replace(llm_response, content=content)
         
         # Post-process output
         processed_output = await self.post_process_output(llm_response, agent_input)
         
+        metadata = {
+            "content_type": task.content_type,
+            "criteria_count": len(criteria),
+            "focus_areas": task.focus_areas,
+            "structured_scores": structured_analysis,
+            "token_usage": llm_response.usage
+        }
+        if structured_status:
+            metadata["structured_output"] = structured_status
+        
+        return self._create_agent_output(
+            content=processed_output,
+            success=True,
+            agent_input=agent_input,
+            metadata=metadata
+        )
+    
+    async def _parse_analysis_response(self,
+                                       content: str,
+                                       content_type: str,
+                                       criteria: List[str],
+                                       structured_enabled: bool) -> Tuple[str, Dict[str, Any], Optional[str]]:
+        """Parse output: JSON nếu structured output bật, regex trên text nếu không.
+        Trả về (markdown, structured analysis, trạng thái structured output)."""
+        structured = self._parse_structured_output(content, content_type) if structured_enabled else None
+        
+        if structured and structured.data and structured.data.get("criteria"):
+            return (self._render_structured_output(structured.data, criteria),
+                    self._analysis_from_structured(structured.data, criteria),
+                    structured.status)
+        
+        return content, await self._parse_critical_analysis(content, criteria), structured.status if structured else None
+    
+    async def _process_per_idea_analysis(self, agent_input: AgentInput, criteria: List[str]) -> AgentOutput:
+        """Đánh giá phản biện từng ý tưởng trong call riêng (song song), gộp lại cho SA.
+        Ý tưởng không đổi nội dung dùng lại đánh giá của vòng trước."""
+        task: CriticalAnalysisTask = agent_input.data
+        response_format = self._structured_response_format(task.content_type)
+        
+        async def review(idea: Idea) -> Optional[Dict[str, Any]]:
+            idea_task = replace(task, content_to_analyze=idea.text)
+            prompt = self._build_critical_analysis_prompt(idea_task, criteria, agent_input).with_dynamic(
+                f"Chỉ đánh giá ý tưởng trên (ý tưởng {idea.position + 1}/{len(task.ideas)} của vòng này), "
+                "ngắn gọn và tập trung vào các điểm yếu quan trọng nhất."
+            )
+            llm_response = await self._make_llm_call(
+                user_message=self._with_structured_instructions(prompt, task.content_type),
+                temperature=0.2,
+                max_tokens=self.config.per_idea_review_max_tokens,
+                use_conversation_history=False,
+                response_format=response_format
+            )
+            if not llm_response.success:
+                logger.warning(f"CT review failed for idea {idea.id}: {llm_response.error}")
+                return None
+            
+            content, analysis, status = await self._parse_analysis_response(
+                llm_response.content, task.content_type, criteria, response_format is not None
+            )
+            return {"content": content, "analysis": analysis, "structured_output": status,
+                    "token_usage": llm_response.usage}
+        
+        scope = f"{task.content_type}:{','.join(task.focus_areas)}"
+        reviews = await self._review_ideas(task.ideas, review, scope=scope)
+        completed = [(idea, result, reused) for idea, result, reused in reviews if result]
+        
+        if not completed:
+            return self._create_agent_output(
+                content="",
+                success=False,
+                agent_input=agent_input,
+                error="Per-idea review failed for all ideas"
+            )
+        
+        # Gộp: mỗi ý tưởng một section, điểm theo tiêu chí là trung bình các ý tưởng
+        sections = []
+        for idea, result, reused in reviews:
+            note = " _(không đổi so với vòng trước, dùng lại đánh giá)_" if reused else ""
+            body = result["content"] if result else "_Không đánh giá được ý tưởng này._"
+            sections.append(f"# Ý TƯỞNG {idea.position + 1}: {idea.name}{note}\n\n{body}")
+        
+        analyses = [result["analysis"] for _, result, _ in completed]
+        criteria_scores = {}
+        for criterion in criteria:
+            scores = [a["criteria_scores"][criterion] for a in analyses if criterion in a["criteria_scores"]]
+            if scores:
+                criteria_scores[criterion] = round(sum(scores) / len(scores), 2)
+        
+        structured_analysis = {
+            "overall_score": sum(criteria_scores.values()) / len(criteria_scores) if criteria_scores else 0.0,
+            "criteria_scores": criteria_scores,
+            "critical_issues": [item for a in analyses for item in a["critical_issues"]],
+            "improvement_suggestions": [item for a in analyses for item in a["improvement_suggestions"]],
+            "questions_raised": [item for a in analyses for item in a["questions_raised"]],
+            "by_idea": {idea.id: result["analysis"] for idea, result, _ in completed}
+        }
+        
+        llm_response = LLMResponse(content="\n\n".join(sections), usage={}, model=self.config.llm.model, success=True)
+        processed_output = await self.post_process_output(llm_response, agent_input)
+        
         return self._create_agent_output(
             content=processed_output,
             success=True,
@@ -112,7 +222,10 @@ class CriticalThinkingAgent(BaseAgent):
                 "criteria_count": len(criteria),
                 "focus_areas": task.focus_areas,
                 "structured_scores": structured_analysis,
-                "token_usage": llm_response.usage
+                "idea_reviews": self._idea_review_summary(reviews),
+                "token_usage": self._sum_token_usage(
+                    result.get("token_usage") for _, result, reused in completed if not reused
+                )
             }
         )
     
@@ -163,23 +276,19 @@ class CriticalThinkingAgent(BaseAgent):
     def _build_critical_analysis_prompt(self, 
                                        task: CriticalAnalysisTask,
                                        criteria: List[str], 
-                                       agent_input: AgentInput) -> str:
-        """Xây dựng prompt cho phân tích phản biện"""
+                                       agent_input: AgentInput) -> AssembledPrompt:
+        """Xây dựng prompt cho phân tích phản biện (tiêu chí/nguyên tắc cố định trước, nội dung của vòng sau)"""
         
-        criteria_details = self._get_criteria_details(criteria, task.content_type)
+        criteria_details = self._static_section(
+            f"criteria:{task.content_type}:{','.join(criteria)}",
+            lambda: self._get_criteria_details(criteria, task.content_type)
+        )
         
-        prompt = f"""
-# NHIỆM VỤ PHÂN TÍCH PHẢN BIỆN - VÒNG {task.iteration}
-
-## NỘI DUNG CẦN ĐÁNH GIÁ
+        instructions = f"""
+# NHIỆM VỤ PHÂN TÍCH PHẢN BIỆN
 
 **Loại nội dung:** {task.content_type.upper()}
 
-**Nội dung:**
-```
-{task.content_to_analyze}
-```
-
 ## TIÊU CHÍ ĐÁNH GIÁ
 
 {criteria_details}
@@ -189,8 +298,6 @@ class CriticalThinkingAgent(BaseAgent):
 
 ## YÊU CẦU CỤ THỂ
 
-{"### ĐÂY LÀ VÒNG ĐÁNH GIÁ SỐ " + str(task.iteration) + " - HÃY PHÂN TÍCH SÂU HƠN DỰA TRÊN CẢI THIỆN TRƯỚC" if task.iteration > 1 else ""}
-
 Hãy thực hiện đánh giá phản biện NGHIÊM NGẶT theo đúng format đã quy định trong system prompt.
 
 **Nguyên tắc đánh giá:**
@@ -205,14 +312,33 @@ Hãy thực hiện đánh giá phản biện NGHIÊM NGẶT theo đúng format 
 - Chỉ ra cả điểm mạnh và điểm yếu
 - Đặt câu hỏi phản biện sâu sắc
 - Đề xuất cải thiện có thể thực hiện được
+"""
+        
+        budget = self._prompt_budget(use_history=task.iteration > 1)
+        (content_to_analyze,), context_text = self._fit_prompt_inputs(
+            budget,
+            fixed=[instructions],
+            inputs=[task.content_to_analyze],
+            context=agent_input.context
+        )
+        
+        inputs = f"""
+## VÒNG {task.iteration}
+{"### ĐÂY LÀ VÒNG ĐÁNH GIÁ SỐ " + str(task.iteration) + " - HÃY PHÂN TÍCH SÂU HƠN DỰA TRÊN CẢI THIỆN TRƯỚC" if task.iteration > 1 else ""}
+
+## NỘI DUNG CẦN ĐÁNH GIÁ
+
+```
+{content_to_analyze}
+```
 
 ## NGỮ CẢNH BỔ SUNG
-{json.dumps(agent_input.context, ensure_ascii=False, indent=2) if agent_input.context else "Không có ngữ cảnh bổ sung"}
+{context_text or "Không có ngữ cảnh bổ sung"}
 
 Bắt đầu đánh giá phản biện ngay bây giờ:
 """
         
-        return prompt.strip()
+        return assemble_prompt(static=[instructions], dynamic=[inputs])
     
     def _get_criteria_details(self, criteria: List[str], content_type: str) -> str:
         """Lấy chi tiết các tiêu chí đánh giá"""
@@ -309,6 +435,44 @@ Bắt đầu đánh giá phản biện ngay bây giờ:
         
         return structured
     
+    def _analysis_from_structured(self, data: Dict[str, Any], criteria: List[str]) -> Dict[str, Any]:
+        """Cùng cấu trúc với _parse_critical_analysis, đọc từ structured output"""
+        criteria_scores = {
+            criterion: data["criteria"][criterion]["score"]
+            for criterion in criteria
+            if "score" in data["criteria"].get(criterion, {})
+        }
+        
+        return {
+            "overall_score": sum(criteria_scores.values()) / len(criteria_scores) if criteria_scores else 0.0,
+            "criteria_scores": criteria_scores,
+            "critical_issues": data.get("critical_issues", []),
+            "improvement_suggestions": data.get("improvement_suggestions", []),
+            "questions_raised": data.get("questions_raised", [])
+        }
+    
+    def _render_structured_output(self, data: Dict[str, Any], criteria: List[str]) -> str:
+        """Markdown từ structured output (điểm dạng "criterion: x/10" như output tự do)"""
+        lines = ["## ĐÁNH GIÁ TỔNG QUAN", data.get("overall_assessment", ""), "", "## ĐÁNH GIÁ THEO TIÊU CHÍ"]
+        
+        for criterion in criteria:
+            entry = data["criteria"].get(criterion)
+            if not entry or "score" not in entry:
+                continue
+            lines += ["", f"### {criterion}: {entry['score']}/10", entry.get("reasoning", "")]
+            for label, key in (("Điểm mạnh", "strengths"), ("Điểm yếu", "weaknesses"), ("Đề xuất", "suggestions")):
+                if entry.get(key):
+                    lines.append(f"**{label}:**")
+                    lines += [f"- {item}" for item in entry[key]]
+        
+        for title, key in (("VẤN ĐỀ NGHIÊM TRỌNG", "critical_issues"),
+                           ("ĐỀ XUẤT CẢI THIỆN", "improvement_suggestions"),
+                           ("CÂU HỎI PHẢN BIỆN", "questions_raised")):
+            if data.get(key):
+                lines += ["", f"## {title}"] + [f"- {item}" for item in data[key]]
+        
+        return "\n".join(lines).strip()
+    
     async def validate_input(self, agent_input: AgentInput) -> bool:
         """Validate input cho Critical Thinking Agent"""
         
@@ -2,13 +2,15 @@
 Primary LLM Agent - Tác nhân thực thi chính trong hệ thống MCTS
 """
 
-import json
+import asyncio
 import logging
 from typing import Dict, List, Optional, Any
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 
 from .base_agent import BaseAgent, AgentInput, AgentOutput
 from backend.config import MCTSConfig
+from backend.core.idea_model import parse_ideas, ideas_to_dicts
+from backend.core.prompt_assembly import AssembledPrompt, assemble_prompt
 
 logger = logging.getLogger(__name__)
 
@@ -77,13 +79,17 @@ class PrimaryAgent(BaseAgent):
         self.current_phase = "analysis"
         
         # Tạo prompt cho phân tích
-        analysis_prompt = self._build_analysis_prompt(task, agent_input)
+        response_format = self._structured_response_format("analysis")
+        analysis_prompt = self._with_structured_instructions(
+            self._build_analysis_prompt(task, agent_input), "analysis"
+        )
         
         # Gọi LLM với temperature thấp hơn cho phân tích
         llm_response = await self._make_llm_call(
             user_message=analysis_prompt,
             temperature=0.3,  # Thấp hơn để đảm bảo tính chính xác
-            use_conversation_history=task.iteration > 1
+            use_conversation_history=task.iteration > 1,
+            response_format=response_format
         )
         
         if not llm_response.success:
@@ -94,6 +100,12 @@ class PrimaryAgent(BaseAgent):
                 error=llm_response.error
             )
         
+        # Structured output: render JSON thành markdown cho các agent khác và báo cáo
+        if response_format:
+            structured = self._parse_structured_output(llm_response.content, "analysis")
+            if structured.data:
+                llm_response = replace(llm_response, content=self._render_structured_analysis(structured.data))
+        
         # Post-process analysis results
         processed_output = await self.post_process_output(llm_response, agent_input)
         self.analysis_results = processed_output
@@ -113,20 +125,35 @@ class PrimaryAgent(BaseAgent):
     async def _process_idea_generation_task(self, agent_input: AgentInput) -> AgentOutput:
         """Xử lý task tạo ý tưởng"""
         task: IdeaGenerationTask = agent_input.data
-        self.current_phase = "idea_generation"
-        
-        # Adaptive temperature (annealing) theo vòng lặp để tăng đa dạng ban đầu và hội tụ dần
+        return await self._generate_ideas(agent_input, self._idea_temperature(task.iteration))
+    
+    def _idea_temperature(self, iteration: int) -> float:
+        """Adaptive temperature (annealing) theo vòng lặp để tăng đa dạng ban đầu và hội tụ dần"""
         base_temp = 0.85
-        anneal = max(0.4, base_temp - 0.08 * (task.iteration - 1))
+        return max(0.4, base_temp - 0.08 * (iteration - 1))
+    
+    async def _generate_ideas(self,
+                              agent_input: AgentInput,
+                              temperature: float,
+                              record_history: bool = True) -> AgentOutput:
+        """Một lần gọi LLM tạo ý tưởng với temperature cho trước"""
+        task: IdeaGenerationTask = agent_input.data
+        self.current_phase = "idea_generation"
 
         # Tạo prompt cho việc tạo ý tưởng
-        idea_prompt = self._build_idea_generation_prompt(task, agent_input)
+        response_format = self._structured_response_format("ideas")
+        idea_prompt = self._with_structured_instructions(
+            self._build_idea_generation_prompt(task, agent_input), "ideas"
+        )
         
         # Gọi LLM với temperature cao hơn cho creativity
         llm_response = await self._make_llm_call(
             user_message=idea_prompt,
-            temperature=anneal,  # Cao hơn lúc đầu, giảm dần để hội tụ
-            use_conversation_history=task.iteration > 1
+            temperature=temperature,  # Cao hơn lúc đầu, giảm dần để hội tụ
+            use_conversation_history=task.iteration > 1,
+            use_cache=not self.config.llm_cache_bypass_ideas,
+            record_history=record_history,
+            response_format=response_format
         )
         
         if not llm_response.success:
@@ -137,6 +164,26 @@ class PrimaryAgent(BaseAgent):
                 error=llm_response.error
             )
         
+        metadata = {
+            "phase": "idea_generation",
+            "target_count": task.target_count,
+            "has_ct_feedback": task.feedback_from_ct is not None,
+            "has_ae_feedback": task.feedback_from_ae is not None,
+            "temperature": round(temperature, 3),
+            "style_variant": agent_input.context.get("style_variant") or "",
+            "token_usage": llm_response.usage
+        }
+        
+        # Structured output: render JSON thành markdown cùng format để đi chung một parser
+        if response_format:
+            structured = self._parse_structured_output(llm_response.content, "ideas")
+            metadata["structured_output"] = structured.status
+            if structured.data and structured.data.get("ideas"):
+                llm_response = replace(llm_response, content=self._render_structured_ideas(structured.data))
+        
+        # Parse ý tưởng một lần; các bước sau (index, ESV, novelty, đánh giá, session) dùng lại bản ghi này
+        metadata["ideas"] = ideas_to_dicts(parse_ideas(llm_response.content))
+        
         # Post-process idea generation results
         processed_output = await self.post_process_output(llm_response, agent_input)
         
@@ -144,14 +191,58 @@ class PrimaryAgent(BaseAgent):
             content=processed_output,
             success=True,
             agent_input=agent_input,
-            metadata={
-                "phase": "idea_generation",
-                "target_count": task.target_count,
-                "has_ct_feedback": task.feedback_from_ct is not None,
-                "has_ae_feedback": task.feedback_from_ae is not None,
-                "token_usage": llm_response.usage
-            }
+            metadata=metadata
+        )
+    
+    async def generate_idea_candidates(self,
+                                       agent_input: AgentInput,
+                                       n: int,
+                                       temperature_spread: float,
+                                       style_variants: List[str]) -> List[AgentOutput]:
+        """
+        Best-of-N: chạy song song N lần tạo ý tưởng với temperature trải quanh mức annealing
+        và các style variant khác nhau.
+        
+        Các candidate không được ghi vào conversation history; gọi commit_idea_candidate
+        với candidate được chọn.
+        """
+        task: IdeaGenerationTask = agent_input.data
+        base_temp = self._idea_temperature(task.iteration)
+        
+        candidate_inputs = []
+        for k in range(n):
+            # Trải đều temperature trong [base - spread, base + spread]
+            offset = (2 * k / (n - 1) - 1) * temperature_spread if n > 1 else 0.0
+            temperature = min(1.2, max(0.2, base_temp + offset))
+            
+            # Candidate đầu giữ style gốc (nếu có), các candidate sau xoay vòng style variants
+            context = dict(agent_input.context)
+            if k > 0 and style_variants:
+                context["style_variant"] = style_variants[(k - 1) % len(style_variants)]
+            
+            candidate_inputs.append((replace(agent_input, context=context), temperature))
+        
+        return await asyncio.gather(*[
+            self._generate_ideas(candidate_input, temperature, record_history=False)
+            for candidate_input, temperature in candidate_inputs
+        ])
+    
+    def commit_idea_candidate(self, agent_input: AgentInput, candidate: AgentOutput):
+        """Ghi candidate được chọn vào conversation history như một lượt tạo ý tưởng bình thường"""
+        task: IdeaGenerationTask = agent_input.data
+        
+        # Vòng đầu không dùng history (giống _generate_ideas với use_conversation_history=False)
+        if task.iteration <= 1:
+            return
+        
+        context = dict(agent_input.context)
+        if candidate.metadata.get("style_variant"):
+            context["style_variant"] = candidate.metadata["style_variant"]
+        
+        prompt = self._with_structured_instructions(
+            self._build_idea_generation_prompt(task, replace(agent_input, context=context)), "ideas"
         )
+        self._record_turn(prompt, candidate.content)
     
     async def _process_raw_data(self, agent_input: AgentInput) -> AgentOutput:
         """Xử lý raw data - fallback method"""
@@ -175,26 +266,31 @@ class PrimaryAgent(BaseAgent):
         
         return await self._process_analysis_task(new_input)
     
-    def _build_analysis_prompt(self, task: AnalysisTask, agent_input: AgentInput) -> str:
-        """Xây dựng prompt cho phân tích"""
-        
-        # Chuẩn bị thông tin về data sources
-        sources_info = []
-        for i, source in enumerate(task.data_sources):
-            source_type = source.get("type", "unknown")
-            source_desc = source.get("description", "Không có mô tả")
-            content_preview = str(source.get("content", ""))[:500]  # Preview 500 chars
-            
-            sources_info.append(f"""
-### Nguồn {i+1}: {source_type.upper()}
-**Mô tả:** {source_desc}
-**Nội dung (preview):**
-{content_preview}{'...' if len(str(source.get("content", ""))) > 500 else ''}
-""")
-        
-        # Xây dựng prompt chính
-        prompt = f"""
-# NHIỆM VỤ PHÂN TÍCH DỮ LIỆU - VÒNG {task.iteration}
+    def _build_analysis_prompt(self, task: AnalysisTask, agent_input: AgentInput) -> AssembledPrompt:
+        """
+        Xây dựng prompt cho phân tích (hướng dẫn cố định trước, dữ liệu của vòng sau).
+        
+        Nội dung các nguồn dữ liệu chia nhau token budget còn lại (nguồn ngắn giữ nguyên, nguồn dài
+        bị cắt); ngữ cảnh ưu tiên thấp hơn và được cắt trước.
+        """
+        budget = self._prompt_budget(use_history=task.iteration > 1)
+        
+        instructions = """
+# NHIỆM VỤ PHÂN TÍCH DỮ LIỆU
+
+Hãy thực hiện phân tích tổng hợp theo đúng format đã quy định trong system prompt của bạn.
+
+**Chú ý đặc biệt:**
+1. Phát hiện các xu hướng nổi bật và pain points thực sự của người dùng
+2. Tìm ra những điểm giao thoa hoặc mâu thuẫn giữa các nguồn dữ liệu
+3. Đưa ra những insight sâu sắc, không chỉ tóm tắt bề mặt
+4. Cung cấp bằng chứng cụ thể cho mỗi kết luận
+5. Đề xuất hướng phân tích cho vòng tiếp theo (nếu cần)
+"""
+        
+        header = f"""
+## VÒNG {task.iteration}
+{"### ĐÂY LÀ VÒNG LẶP SỐ " + str(task.iteration) + " - HÃY CẢI THIỆN PHÂN TÍCH DỰA TRÊN PHẢN HỒI TRƯỚC" if task.iteration > 1 else ""}
 
 ## THÔNG TIN ĐẦU VÀO
 
@@ -206,63 +302,54 @@ class PrimaryAgent(BaseAgent):
 {chr(10).join(f"- {area}" for area in task.focus_areas)}
 
 ### Dữ liệu cần phân tích:
-{''.join(sources_info)}
-
-## YÊU CẦU CỤ THỂ
-
-{"### ĐÂY LÀ VÒNG LẶP SỐ " + str(task.iteration) + " - HÃY CẢI THIỆN PHÂN TÍCH DỰA TRÊN PHẢN HỒI TRƯỚC" if task.iteration > 1 else ""}
-
-Hãy thực hiện phân tích tổng hợp theo đúng format đã quy định trong system prompt của bạn.
-
-**Chú ý đặc biệt:**
-1. Phát hiện các xu hướng nổi bật và pain points thực sự của người dùng
-2. Tìm ra những điểm giao thoa hoặc mâu thuẫn giữa các nguồn dữ liệu
-3. Đưa ra những insight sâu sắc, không chỉ tóm tắt bề mặt
-4. Cung cấp bằng chứng cụ thể cho mỗi kết luận
-5. Đề xuất hướng phân tích cho vòng tiếp theo (nếu cần)
-
+"""
+        source_headers = [
+            f"""
+### Nguồn {i+1}: {source.get("type", "unknown").upper()}
+**Mô tả:** {source.get("description", "Không có mô tả")}
+**Nội dung:**
+"""
+            for i, source in enumerate(task.data_sources)
+        ]
+        footer = "\n## NGỮ CẢNH BỔ SUNG\n\n\nBắt đầu phân tích ngay bây giờ:"
+        
+        contents, context_text = self._fit_prompt_inputs(
+            budget,
+            fixed=[instructions, header, footer, *source_headers],
+            inputs=[str(source.get("content", "")) for source in task.data_sources],
+            context=agent_input.context
+        )
+        
+        sources_info = "".join(
+            f"{source_header}{content}\n" for source_header, content in zip(source_headers, contents)
+        )
+        
+        inputs = f"""{header}{sources_info}
 ## NGỮ CẢNH BỔ SUNG
-{json.dumps(agent_input.context, ensure_ascii=False, indent=2) if agent_input.context else "Không có ngữ cảnh bổ sung"}
+{context_text or "Không có ngữ cảnh bổ sung"}
 
 Bắt đầu phân tích ngay bây giờ:
 """
         
-        return prompt.strip()
+        return assemble_prompt(static=[instructions], dynamic=[inputs])
     
-    def _build_idea_generation_prompt(self, task: IdeaGenerationTask, agent_input: AgentInput) -> str:
-        """Xây dựng prompt cho tạo ý tưởng"""
+    def _build_idea_generation_prompt(self, task: IdeaGenerationTask, agent_input: AgentInput) -> AssembledPrompt:
+        """
+        Xây dựng prompt cho tạo ý tưởng (hướng dẫn cố định trước, phân tích/phản hồi của vòng sau).
         
-        feedback_section = ""
-        if task.feedback_from_ct or task.feedback_from_ae:
-            feedback_section = f"""
-## PHẢN HỒI CẦN XỬ LÝ
-
-{"### Phản hồi từ CT-LLM (Tư duy Phản biện):" if task.feedback_from_ct else ""}
-{task.feedback_from_ct if task.feedback_from_ct else ""}
-
-{"### Phản hồi từ AE-LLM (Chuyên gia Đối kháng):" if task.feedback_from_ae else ""}
-{task.feedback_from_ae if task.feedback_from_ae else ""}
-
-**Yêu cầu:** Hãy giải quyết tất cả các thách thức và cải thiện ý tưởng dựa trên phản hồi trên.
-"""
+        Phản hồi CT/AE được nén extractive rồi chia token budget cùng phân tích; ngữ cảnh được cắt trước.
+        """
         
         # Diversity guidance từ orchestrator/SA nếu có
         diversity_guidance = agent_input.context.get("diversity_guidance") or ""
         style_variant = agent_input.context.get("style_variant") or ""
 
-        prompt = f"""
-# NHIỆM VỤ TẠO Ý TƯỞNG STARTUP - VÒNG {task.iteration}
-
-## CƠ SỞ PHÂN TÍCH
-{task.analysis_results}
-
-{feedback_section}
+        instructions = f"""
+# NHIỆM VỤ TẠO Ý TƯỞNG STARTUP
 
 ## YÊU CẦU CỤ THỂ
 
-{"### ĐÂY LÀ VÒNG CẢI THIỆN SỐ " + str(task.iteration) + " - HÃY PHÁT TRIỂN VÀ GIA CỐ CÁC Ý TƯỞNG" if task.iteration > 1 else ""}
-
-Dựa trên phân tích trên, hãy tạo ra **{task.target_count} ý tưởng startup** chất lượng cao theo đúng format trong system prompt.
+Dựa trên phân tích được cung cấp, hãy tạo ra **{task.target_count} ý tưởng startup** chất lượng cao theo đúng format trong system prompt.
 
 **Tiêu chí ưu tiên:**
 1. **Tính khả thi cao** - Có thể triển khai với tài nguyên hạn chế
@@ -276,19 +363,97 @@ Dựa trên phân tích trên, hãy tạo ra **{task.target_count} ý tưởng s
 - Ước tính đầu tư và timeline realistic  
 - Phân tích rủi ro và mitigation strategies
 - Competitive analysis cụ thể với tên competitors
- - {diversity_guidance}
- - RÀ SOÁT TRÙNG LẶP: Không lặp lại target audience, business model và tech stack giữa các ý tưởng trừ khi có lý do rõ ràng. Gắn nhãn [UNIQUE] cho điểm khác biệt chính của từng ý tưởng.
+- RÀ SOÁT TRÙNG LẶP: Không lặp lại target audience, business model và tech stack giữa các ý tưởng trừ khi có lý do rõ ràng. Gắn nhãn [UNIQUE] cho điểm khác biệt chính của từng ý tưởng.
+"""
+        
+        # Phản hồi CT/AE của vòng trước được nén extractive (điểm số, cờ đỏ, action items) trước khi chia budget
+        feedback_from_ct = self.feedback_compressor.compress(task.feedback_from_ct or "")
+        feedback_from_ae = self.feedback_compressor.compress(task.feedback_from_ae or "")
+        
+        budget = self._prompt_budget(use_history=task.iteration > 1)
+        (analysis_results, feedback_from_ct, feedback_from_ae), context_text = self._fit_prompt_inputs(
+            budget,
+            fixed=[instructions, diversity_guidance, style_variant],
+            inputs=[task.analysis_results, feedback_from_ct, feedback_from_ae],
+            context=agent_input.context
+        )
+        
+        feedback_section = ""
+        if feedback_from_ct or feedback_from_ae:
+            feedback_section = f"""
+## PHẢN HỒI CẦN XỬ LÝ
+
+{"### Phản hồi từ CT-LLM (Tư duy Phản biện):" if feedback_from_ct else ""}
+{feedback_from_ct}
+
+{"### Phản hồi từ AE-LLM (Chuyên gia Đối kháng):" if feedback_from_ae else ""}
+{feedback_from_ae}
+
+**Yêu cầu:** Hãy giải quyết tất cả các thách thức và cải thiện ý tưởng dựa trên phản hồi trên.
+"""
+        
+        inputs = f"""
+## VÒNG {task.iteration}
+{"### ĐÂY LÀ VÒNG CẢI THIỆN SỐ " + str(task.iteration) + " - HÃY PHÁT TRIỂN VÀ GIA CỐ CÁC Ý TƯỞNG" if task.iteration > 1 else ""}
+
+## CƠ SỞ PHÂN TÍCH
+{analysis_results}
+
+{feedback_section}
+
+{"## ĐỊNH HƯỚNG ĐA DẠNG" + chr(10) + diversity_guidance if diversity_guidance else ""}
 
 ## PHONG CÁCH TRIỂN KHAI (VARIANT)
 {style_variant if style_variant else "Không có yêu cầu phong cách riêng. Tạo danh mục ý tưởng cân bằng giữa kỹ thuật và thị trường."}
 
 ## NGỮ CẢNH BỔ SUNG
-{json.dumps(agent_input.context, ensure_ascii=False, indent=2) if agent_input.context else "Không có ngữ cảnh bổ sung"}
+{context_text or "Không có ngữ cảnh bổ sung"}
 
 Bắt đầu tạo ý tưởng ngay bây giờ:
 """
         
-        return prompt.strip()
+        return assemble_prompt(static=[instructions], dynamic=[inputs])
+    
+    def _render_structured_analysis(self, data: Dict[str, Any]) -> str:
+        """Markdown từ structured output của task phân tích"""
+        lines = ["## TÓM TẮT", data.get("summary", "")]
+        
+        for title, key in (("XU HƯỚNG NỔI BẬT", "trends"), ("PAIN POINTS", "pain_points")):
+            lines += ["", f"## {title}"]
+            for i, finding in enumerate(data.get(key, []), 1):
+                lines += ["", f"### {i}. {finding['title']}", finding["description"]]
+                lines += [f"- Bằng chứng: {item}" for item in finding.get("evidence", [])]
+        
+        for title, key in (("CƠ HỘI", "opportunities"), ("MÂU THUẪN GIỮA CÁC NGUỒN", "contradictions"),
+                           ("HƯỚNG PHÂN TÍCH TIẾP THEO", "next_focus")):
+            if data.get(key):
+                lines += ["", f"## {title}"] + [f"- {item}" for item in data[key]]
+        
+        return "\n".join(lines).strip()
+    
+    def _render_structured_ideas(self, data: Dict[str, Any]) -> str:
+        """Markdown từ structured output của task tạo ý tưởng (heading/nhãn giống format trong system prompt)"""
+        lines = []
+        
+        for i, idea in enumerate(data["ideas"], 1):
+            lines += [f"#### {i}. {idea.get('name', 'Idea')}", ""]
+            for label, key in (("Target Market", "target_audience"), ("Vấn đề", "problem"),
+                               ("Solution", "solution"), ("Business Model", "business_model"),
+                               ("Lợi thế cạnh tranh", "competitive_advantage"),
+                               ("Đầu tư ban đầu", "initial_investment"), ("Timeline", "timeline"),
+                               ("[UNIQUE]", "unique_point")):
+                if idea.get(key):
+                    lines.append(f"**{label}:** {idea[key]}")
+            for label, key in (("Đối thủ", "competitors"), ("Rủi ro", "risks"), ("Roadmap", "roadmap")):
+                if idea.get(key):
+                    lines.append(f"**{label}:**")
+                    lines += [f"- {item}" for item in idea[key]]
+            lines.append("")
+        
+        if data.get("summary"):
+            lines += ["## TỔNG KẾT", data["summary"]]
+        
+        return "\n".join(lines).strip()
     
     async def validate_input(self, agent_input: AgentInput) -> bool:
         """Validate input cho Primary Agent"""
@@ -2,19 +2,24 @@
 Synthesis & Assessment LLM Agent - Tác nhân tổng hợp và đánh giá trong hệ thống MCTS
 """
 
-import json
 import re
 import logging
 from typing import Dict, List, Optional, Any, Tuple
-from dataclasses import dataclass
+from dataclasses import dataclass, field, asdict, replace
 from datetime import datetime
 
 from .base_agent import BaseAgent, AgentInput, AgentOutput
-from backend.config import MCTSConfig, AgentWeights, EVALUATION_CRITERIA
-from backend.core.scoring_system import create_scores_from_text, ScoreType
+from backend.config import MCTSConfig, AgentWeights, EVALUATION_CRITERIA, CRITERIA_NAME_MAPPING
+from backend.core.scoring_system import create_scores_from_text, extract_scores_from_text, ScoreType
+from backend.core.idea_model import Idea
+from backend.core.prompt_assembly import AssembledPrompt, assemble_prompt
+from backend.core.token_estimator import estimate_tokens
 
 logger = logging.getLogger(__name__)
 
+# Budget của bản trích xuất mỗi output trong section input = số token của ngần này ký tự đầu
+INPUT_DIGEST_CHARS = 500
+
 @dataclass
 class SynthesisTask:
     """Task cho việc tổng hợp và đánh giá"""
@@ -24,6 +29,7 @@ class SynthesisTask:
     esv_results: Optional[Dict[str, Any]] = None
     phase: str = "analysis"  # "analysis" hoặc "ideas"
     iteration: int = 1
+    ideas: List[Idea] = field(default_factory=list)  # Ý tưởng đã parse (phase "ideas")
 
 @dataclass
 class LoopDecision:
@@ -95,13 +101,17 @@ class SynthesisAssessmentAgent(BaseAgent):
         task: SynthesisTask = agent_input.data
         
         # Tạo prompt tổng hợp
-        synthesis_prompt = self._build_synthesis_prompt(task, agent_input)
+        response_format = self._structured_response_format(task.phase)
+        synthesis_prompt = self._with_structured_instructions(
+            self._build_synthesis_prompt(task, agent_input), task.phase
+        )
         
         # Gọi LLM với temperature thấp để đảm bảo objectivity
         llm_response = await self._make_llm_call(
             user_message=synthesis_prompt,
             temperature=0.1,  # Rất thấp để đảm bảo consistent decision making
-            use_conversation_history=task.iteration > 1
+            use_conversation_history=task.iteration > 1,
+            response_format=response_format
         )
         
         if not llm_response.success:
@@ -112,10 +122,21 @@ class SynthesisAssessmentAgent(BaseAgent):
                 error=llm_response.error
             )
         
-        # Parse quality scores và metrics
-        quality_scores = await self._parse_quality_scores(
-            llm_response.content, task.phase
-        )
+        # Parse quality scores và metrics: JSON nếu structured output bật, bảng điểm trong text nếu không
+        structured = self._parse_structured_output(llm_response.content, task.phase) if response_format else None
+        structured_data = structured.data if structured and structured.data and structured.data.get("scores") else None
+        
+        if structured_data:
+            quality_scores = self._quality_scores_from_structured(
+                structured_data["scores"], task.phase, llm_response.content
+            )
+            llm_response = replace(
+                llm_response, content=self._render_structured_output(structured_data, quality_scores)
+            )
+        else:
+            quality_scores = await self._parse_quality_scores(
+                llm_response.content, task.phase
+            )
         
         # Calculate overall score
         overall_score = self._calculate_overall_score(quality_scores)
@@ -125,6 +146,12 @@ class SynthesisAssessmentAgent(BaseAgent):
             task, overall_score, quality_scores, agent_input
         )
         
+        # Chỉ dẫn cụ thể của LLM bổ sung cho chỉ dẫn sinh từ điểm số
+        if structured_data and loop_decision.next_round_instructions:
+            loop_decision.next_round_instructions["primary_llm"]["specific_improvements"].extend(
+                structured_data.get("next_round_instructions", [])
+            )
+        
         # Update tracking
         self.iteration_scores.append(overall_score)
         self.iteration_decisions.append(loop_decision)
@@ -132,18 +159,22 @@ class SynthesisAssessmentAgent(BaseAgent):
         # Post-process output
         processed_output = await self.post_process_output(llm_response, agent_input)
         
+        metadata = {
+            "phase": task.phase,
+            "overall_score": overall_score,
+            "quality_scores": [score.__dict__ for score in quality_scores],
+            "loop_decision": loop_decision.__dict__,
+            "esv_activated": task.esv_results is not None,
+            "token_usage": llm_response.usage
+        }
+        if structured:
+            metadata["structured_output"] = structured.status
+        
         return self._create_agent_output(
             content=processed_output,
             success=True,
             agent_input=agent_input,
-            metadata={
-                "phase": task.phase,
-                "overall_score": overall_score,
-                "quality_scores": [score.__dict__ for score in quality_scores],
-                "loop_decision": loop_decision.__dict__,
-                "esv_activated": task.esv_results is not None,
-                "token_usage": llm_response.usage
-            }
+            metadata=metadata
         )
     
     async def _process_raw_content(self, agent_input: AgentInput) -> AgentOutput:
@@ -169,20 +200,14 @@ class SynthesisAssessmentAgent(BaseAgent):
     
     def _build_synthesis_prompt(self, 
                                task: SynthesisTask,
-                               agent_input: AgentInput) -> str:
-        """Xây dựng prompt cho tổng hợp và đánh giá"""
+                               agent_input: AgentInput) -> AssembledPrompt:
+        """Xây dựng prompt cho tổng hợp và đánh giá (framework/logic cố định trước, input của vòng sau)"""
         
         # Build input analysis section
         input_analysis = self._build_input_analysis_section(task)
         
-        # Build scoring framework
-        scoring_framework = self._build_scoring_framework(task.phase)
-        
         # Build ESV results section
         esv_section = self._build_esv_section(task.esv_results) if task.esv_results else ""
-        
-        # Build decision logic
-        decision_logic = self._build_decision_logic_section()
 
         # Diversity analysis (nếu có)
         diversity_context = ""
@@ -199,8 +224,21 @@ class SynthesisAssessmentAgent(BaseAgent):
 - Duplicates: {len(idea_diversity.get('duplicates', []))}
 """
         
-        prompt = f"""
-# NHIỆM VỤ TỔNG HỢP & ĐÁNH GIÁ - VÒNG {task.iteration}
+        # Framework điểm số, logic quyết định, trọng số và ngưỡng chỉ phụ thuộc phase và config
+        instructions = self._static_section(f"instructions:{task.phase}", lambda: self._build_synthesis_instructions(task.phase))
+        
+        # Preview input của các agent đã ngắn: chỉ ngữ cảnh cần cắt theo budget
+        budget = self._prompt_budget(use_history=task.iteration > 1)
+        _, context_text = self._fit_prompt_inputs(
+            budget,
+            fixed=[instructions, input_analysis, esv_section, diversity_context],
+            inputs=[],
+            context=agent_input.context
+        )
+        
+        inputs = f"""
+## VÒNG {task.iteration}
+{"### ĐÂY LÀ VÒNG ĐÁNH GIÁ SỐ " + str(task.iteration) + " - HÃY SO SÁNH VỚI CÁC VÒNG TRƯỚC VÀ TÍNH IMPROVEMENT RATE" if task.iteration > 1 else ""}
 
 ## THÔNG TIN ĐẦU VÀO
 
@@ -212,18 +250,30 @@ class SynthesisAssessmentAgent(BaseAgent):
 
 {diversity_context}
 
+## NGỮ CẢNH BỔ SUNG
+{context_text or "Không có ngữ cảnh bổ sung"}
+
+Bắt đầu tổng hợp và đánh giá ngay bây giờ:
+"""
+        
+        return assemble_prompt(static=[instructions], dynamic=[inputs])
+    
+    def _build_synthesis_instructions(self, phase: str) -> str:
+        """Phần tĩnh của prompt tổng hợp: framework điểm số, logic quyết định, trọng số, ngưỡng"""
+        
+        return f"""
+# NHIỆM VỤ TỔNG HỢP & ĐÁNH GIÁ
+
 ## FRAMEWORK ĐIỂM SỐ
 
-{scoring_framework}
+{self._build_scoring_framework(phase)}
 
 ## LOGIC QUYẾT ĐỊNH
 
-{decision_logic}
+{self._build_decision_logic_section()}
 
 ## YÊU CẦU CỤ THỂ
 
-{"### ĐÂY LÀ VÒNG ĐÁNH GIÁ SỐ " + str(task.iteration) + " - HÃY SO SÁNH VỚI CÁC VÒNG TRƯỚC VÀ TÍNH IMPROVEMENT RATE" if task.iteration > 1 else ""}
-
 Thực hiện tổng hợp và đánh giá TOÀN DIỆN theo đúng format trong system prompt.
 
 **Nhiệm vụ chính:**
@@ -248,17 +298,10 @@ Thực hiện tổng hợp và đánh giá TOÀN DIỆN theo đúng format trong
 - Consider user experience và feedback
 - Focus on actionable outcomes
 - Maintain high standards nhưng realistic
-
-## NGỮ CẢNH BỔ SUNG
-{json.dumps(agent_input.context, ensure_ascii=False, indent=2) if agent_input.context else "Không có ngữ cảnh bổ sung"}
-
-Bắt đầu tổng hợp và đánh giá ngay bây giờ:
 """
-        
-        return prompt.strip()
     
     def _build_input_analysis_section(self, task: SynthesisTask) -> str:
-        """Xây dựng section phân tích input"""
+        """Xây dựng section phân tích input (mỗi output được nén extractive, cùng budget với preview 500 ký tự cũ)"""
         
         sections = []
         
@@ -266,8 +309,8 @@ Bắt đầu tổng hợp và đánh giá ngay bây giờ:
         sections.append(f"""
 ### 📄 OUTPUT TỪ PRIMARY LLM
 **Độ dài:** {len(task.primary_output)} ký tự
-**Preview:**
-{task.primary_output[:500]}{'...' if len(task.primary_output) > 500 else ''}
+**Trích xuất chính:**
+{self._digest(task.primary_output)}
 """)
         
         # CT feedback
@@ -275,8 +318,8 @@ Bắt đầu tổng hợp và đánh giá ngay bây giờ:
             sections.append(f"""
 ### 🧠 PHẢN HỒI TỪ CT-LLM
 **Độ dài:** {len(task.ct_feedback)} ký tự
-**Preview:**
-{task.ct_feedback[:500]}{'...' if len(task.ct_feedback) > 500 else ''}
+**Trích xuất chính:**
+{self._digest(task.ct_feedback)}
 """)
         else:
             sections.append("### 🧠 PHẢN HỒI TỪ CT-LLM: Không có")
@@ -286,14 +329,20 @@ Bắt đầu tổng hợp và đánh giá ngay bây giờ:
             sections.append(f"""
 ### ⚔️ PHẢN HỒI TỪ AE-LLM (Chuyên gia Đối kháng)
 **Độ dài:** {len(task.ae_feedback)} ký tự  
-**Preview:**
-{task.ae_feedback[:500]}{'...' if len(task.ae_feedback) > 500 else ''}
+**Trích xuất chính:**
+{self._digest(task.ae_feedback)}
 """)
         else:
             sections.append("### ⚔️ PHẢN HỒI TỪ AE-LLM: Không có")
         
         return "\n".join(sections)
     
+    def _digest(self, text: str) -> str:
+        """Các câu/dòng chứa điểm số, cờ đỏ, con số, action items trong số token của INPUT_DIGEST_CHARS ký tự đầu"""
+        return self.feedback_compressor.compress(
+            text, target_ratio=0, max_tokens=estimate_tokens(text[:INPUT_DIGEST_CHARS])
+        )
+    
     def _build_esv_section(self, esv_results: Dict[str, Any]) -> str:
         """Xây dựng section ESV results"""
         
@@ -438,6 +487,66 @@ Red_Flag = ANY individual score < {self.red_flag_threshold}
         
         return scores
     
+    def _quality_scores_from_structured(self,
+                                        scores: Dict[str, Any],
+                                        phase: str,
+                                        raw_content: str) -> List[QualityScore]:
+        """
+        QualityScore từ trường "scores" của structured output (đã kiểm tra theo schema).
+        Tiêu chí JSON bỏ sót được lấy từ bảng điểm/text trong raw output nếu có; chỉ tiêu chí
+        không có ở đâu mới nhận 5.0 và được cảnh báo
+        """
+        criteria = EVALUATION_CRITERIA.get(phase, EVALUATION_CRITERIA["analysis"])
+        missing = [criterion for criterion in criteria if "score" not in scores.get(criterion, {})]
+        text_scores = extract_scores_from_text(raw_content, ScoreType(phase)) if missing else {}
+        
+        recovered = [criterion for criterion in missing if criterion in text_scores]
+        if recovered:
+            logger.info(f"Structured output missing scores for {recovered}, recovered from text")
+        defaulted = [criterion for criterion in missing if criterion not in text_scores]
+        if defaulted:
+            logger.warning(f"Structured output missing scores for {defaulted}, using default 5.0")
+        
+        quality_scores = []
+        for criterion in criteria:
+            entry = scores.get(criterion, {})
+            if "score" in entry:
+                raw_score, reasoning = entry["score"], entry.get("reasoning") or "Score from structured output"
+            elif criterion in text_scores:
+                raw_score, reasoning = text_scores[criterion], "Missing from structured output, score parsed from text"
+            else:
+                raw_score, reasoning = 5.0, "Missing from structured output and text, default score"
+            weight = getattr(self.weights, criterion, 1.0)
+            
+            quality_scores.append(QualityScore(
+                criterion=criterion,
+                raw_score=raw_score,
+                weight=weight,
+                weighted_score=raw_score * weight,
+                red_flag=raw_score < self.red_flag_threshold,
+                reasoning=reasoning
+            ))
+        
+        return quality_scores
+    
+    def _render_structured_output(self, data: Dict[str, Any], quality_scores: List[QualityScore]) -> str:
+        """Markdown từ structured output; bảng điểm giữ đúng format mà create_scores_from_text đọc được"""
+        display_names = {field_name: name for name, field_name in CRITERIA_NAME_MAPPING.items()}
+        
+        lines = ["## TỔNG HỢP", data.get("summary", ""), "", "## BẢNG ĐIỂM", "",
+                 "| Tiêu chí | Raw Score | Trọng số | Lý do |", "|---|---|---|---|"]
+        for score in quality_scores:
+            name = display_names.get(score.criterion, score.criterion).capitalize()
+            reasoning = score.reasoning.replace("|", "/").replace("\n", " ")
+            lines.append(f"| {name} | {score.raw_score} | {score.weight} | {reasoning} |")
+        
+        for title, key in (("ĐIỂM MẠNH", "strengths"), ("ĐIỂM YẾU", "weaknesses"),
+                           ("MÂU THUẪN GIỮA CÁC AGENT", "conflicts"), ("CHỈ DẪN VÒNG TIẾP THEO", "next_round_instructions")):
+            if data.get(key):
+                lines += ["", f"## {title}"] + [f"- {item}" for item in data[key]]
+        
+        return "\n".join(lines).strip()
+    
     def _calculate_overall_score(self, quality_scores: List[QualityScore]) -> float:
         """Tính toán điểm tổng thể"""
         
@@ -684,6 +793,19 @@ Synthesis_Mode: Comprehensive_Assessment
             "quality_achieved": self.iteration_scores[-1] >= self.quality_threshold if self.iteration_scores else False
         }
     
+    def export_state(self) -> Dict[str, Any]:
+        """State của agent kèm điểm số và quyết định qua các vòng"""
+        state = super().export_state()
+        state["iteration_scores"] = list(self.iteration_scores)
+        state["iteration_decisions"] = [asdict(d) for d in self.iteration_decisions]
+        return state
+    
+    def restore_state(self, state: Dict[str, Any]):
+        """Khôi phục state từ checkpoint"""
+        super().restore_state(state)
+        self.iteration_scores = list(state.get("iteration_scores", []))
+        self.iteration_decisions = [LoopDecision(**d) for d in state.get("iteration_decisions", [])]
+    
     def reset_tracking(self):
         """Reset tracking metrics"""
         self.iteration_scores = []
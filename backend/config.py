@@ -18,6 +18,34 @@ class LLMConfig:
     max_tokens: int = 4000
     temperature: float = 0.7
     timeout: int = 60
+    
+    # Context window (token) của model; 0 = tra theo tên model (token_estimator.MODEL_CONTEXT_LIMITS).
+    # max_tokens của mỗi request được co lại cho vừa; prompt không còn chỗ cho min_output_tokens bị từ chối trước khi gửi
+    context_window: int = 0
+    min_output_tokens: int = 256
+    
+    # Giới hạn của provider, dùng chung cho mọi agent/session trong một process (0 = học từ rate-limit headers);
+    # batch runner chia requests/tokens per minute đều cho các worker process
+    requests_per_minute: int = 60
+    tokens_per_minute: int = 0
+    max_concurrent_requests: int = 8
+    
+    # Gộp các request giống hệt nhau đang bay (chỉ với call cho phép dùng cache và temperature
+    # <= coalesce_max_temperature; call sampling ở temperature cao là các mẫu độc lập nên không gộp)
+    coalesce_requests: bool = True
+    coalesce_max_temperature: float = 0.2
+    
+    # Hint prompt caching gửi kèm request (tùy endpoint OpenAI-compatible hỗ trợ):
+    # "none", "prompt_cache_key" (OpenAI) hoặc "cache_control" (Anthropic/LiteLLM, content parts ephemeral)
+    prompt_cache_hints: str = "none"
+
+@dataclass
+class HTTPPoolConfig:
+    """Cấu hình connection pool HTTP dùng chung giữa các components"""
+    connector_limit: int = 100  # Tổng số connection đồng thời
+    limit_per_host: int = 20  # Số connection tối đa tới một host
+    keepalive_timeout: float = 30.0  # Giữ connection rảnh để tái sử dụng (giây)
+    dns_cache_ttl: int = 300  # TTL cache DNS (giây)
 
 @dataclass
 class AgentWeights:
@@ -37,6 +65,9 @@ class MCTSConfig:
     # Cấu hình LLM
     llm: LLMConfig = field(default_factory=LLMConfig)
     
+    # Connection pool HTTP dùng chung (LLM + ESV)
+    http: HTTPPoolConfig = field(default_factory=HTTPPoolConfig)
+    
     # Cấu hình vòng lặp
     max_analysis_loops: int = 3
     max_idea_loops: int = 4
@@ -51,16 +82,100 @@ class MCTSConfig:
     
     # Vai trò AE-LLM (ít nhất 2)
     adversarial_roles: List[str] = field(default_factory=lambda: ["VC", "Kỹ_sư", "Đối_thủ", "Marketing", "Pháp_lý"])
-    
+
+    # AE tấn công theo từng vai trò: mỗi vai trò một call ngắn chạy song song thay vì một call cho cả 5 vai trò
+    adversarial_role_fanout: bool = False
+    adversarial_role_default_max_tokens: int = 1000
+    adversarial_role_max_tokens: Dict[str, int] = field(default_factory=dict)  # Override theo vai trò (vd. {"VC": 1500})
+
     # Cấu hình ESV
     enable_external_validation: bool = True
     search_timeout: int = 30
     
+    # Cache kết quả ESV trên đĩa (SQLite trong output_dir), dùng chung giữa các lần chạy và process
+    enable_esv_cache: bool = True
+    esv_cache_ttls: Dict[str, int] = field(default_factory=dict)  # Override TTL theo query_type (giây)
+    esv_cache_negative_ttl: int = 3600  # TTL cho kết quả rỗng
+    esv_cache_stale_ttl: int = 24 * 3600  # Cửa sổ trả kết quả cũ trong khi làm mới ở nền
+    esv_cache_max_entries: int = 20000
+    esv_cache_max_mb: int = 64
+    
+    # Keywords cho ESV queries: IDF tính từ output các session đã lưu trong output_dir
+    esv_keyword_idf: bool = True
+    
+    # Kiểm tra novelty tại chỗ (index trên kết quả ESV đã lấy + sản phẩm đã biết) trước khi search
+    enable_novelty_index: bool = True
+    novelty_check_ttl: int = 7 * 24 * 3600  # Dùng lại kết quả kiểm tra tên ý tưởng trong khoảng này
+    novelty_known_products: List[str] = field(default_factory=list)
+    
+    # Timeout (giây) cho mỗi nhánh CT/AE/ESV chạy song song trong một vòng lặp
+    review_branch_timeout: int = 600
+    
+    # Đánh giá theo từng ý tưởng: CT/AE gọi LLM riêng cho mỗi ý tưởng (song song, output ngắn hơn);
+    # ý tưởng không đổi nội dung so với vòng trước dùng lại đánh giá đã cache thay vì gọi lại
+    per_idea_review: bool = False
+    per_idea_review_max_tokens: int = 1500
+    
+    # Cache response LLM trên đĩa (SQLite trong output_dir)
+    enable_llm_cache: bool = False
+    llm_cache_mode: str = "read_write"  # "read_write" hoặc "cache_only" (test, không gọi API)
+    llm_cache_ttl: int = 7 * 24 * 3600  # giây
+    llm_cache_max_entries: int = 10000
+    llm_cache_bypass_ideas: bool = False  # Không cache các call tạo ý tưởng (temperature cao)
+    
+    # Structured output: SA/CT/AE/Primary yêu cầu LLM trả JSON theo schema (response_format) thay vì
+    # markdown tự do; điểm số đọc từ JSON, output lỗi được sửa rồi mới fallback sang parser regex
+    structured_output: bool = False
+    structured_output_mode: str = "json_schema"  # "json_schema" hoặc "json_object" (provider không hỗ trợ schema)
+    
+    # Trần token cho mỗi prompt (system + history + message, 0 = chỉ giới hạn bởi context window).
+    # Nguồn dữ liệu, nội dung và ngữ cảnh JSON được cắt theo thứ tự ưu tiên để vừa trần này
+    max_prompt_tokens: int = 32000
+    
+    # Nén trích xuất (không gọi LLM) phản hồi CT/AE gửi cho Primary ở vòng sau: giữ điểm số, cờ đỏ,
+    # con số và action items còn khoảng tỉ lệ token này (0 = gửi nguyên văn); text ngắn hơn min_tokens giữ nguyên
+    feedback_compression_ratio: float = 0.35
+    feedback_compression_min_tokens: int = 300
+    
+    # Token budget cho conversation history của mỗi agent (các lượt cũ được rút gọn thành digest)
+    history_token_budget: int = 24000
+    history_keep_turns: int = 2
+    history_token_budgets: Dict[str, int] = field(default_factory=dict)  # Override theo agent_type
+    
+    # Best-of-N: tạo song song N bộ ý tưởng (1 = tắt) rồi chọn bộ tốt nhất bằng chấm điểm local
+    idea_best_of_n: int = 1
+    idea_temperature_spread: float = 0.15  # Độ lệch temperature tối đa quanh mức annealing
+    idea_style_variants: List[str] = field(default_factory=lambda: [
+        "Ưu tiên ý tưởng deep-tech, lợi thế cạnh tranh dựa trên công nghệ khó sao chép.",
+        "Ưu tiên ý tưởng go-to-market nhanh, vốn thấp, có doanh thu sớm.",
+        "Ưu tiên ý tưởng cho phân khúc ngách ít được phục vụ, mô hình kinh doanh khác biệt."
+    ])
+    
+    # Chỉ mục MinHash/LSH của mọi ý tưởng đã tạo (SQLite trong output_dir), phát hiện ý tưởng
+    # lặp lại từ các session trước trước khi chạy CT/AE/SA
+    enable_idea_index: bool = True
+    idea_duplicate_threshold: float = 0.6  # Jaccard ước lượng để coi là gần trùng
+    idea_duplicate_reject_ratio: float = 0.5  # Tỉ lệ ý tưởng gần trùng để yêu cầu Primary tạo lại
+    idea_duplicate_max_regenerations: int = 1  # 0 = chỉ báo cáo, không tạo lại
+    
+    # Checkpoint: ghi journal sau mỗi bước agent để resume khi process bị dừng giữa chừng
+    enable_checkpointing: bool = True
+    
+    # Tracing: span cho phase/loop/agent/HTTP/ESV, ghi trace.jsonl (+ Chrome trace) trong thư mục session
+    enable_tracing: bool = True
+    trace_chrome_export: bool = True
+    
     # Logging
     log_level: str = "INFO"
     save_intermediate_results: bool = True
     output_dir: str = "results"
     
+    # Định dạng lưu kết quả session: "blobs" (session.json nhỏ + text nén content-addressed dùng chung
+    # trong output_dir/blobs) hoặc "json" (session_summary.json + final_deliverables.json đầy đủ như cũ)
+    session_storage: str = "blobs"
+    session_blob_codec: str = "auto"  # "auto" (zstd nếu cài zstandard, ngược lại gzip), "zst" hoặc "gz"
+    session_blob_min_chars: int = 512  # String ngắn hơn được giữ nguyên trong session.json
+    
     def __post_init__(self):
         """Xác thực cấu hình sau khi khởi tạo"""
         if len(self.adversarial_roles) < 2:
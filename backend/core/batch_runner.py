@@ -0,0 +1,387 @@
+"""
+Batch Runner - Chạy nhiều MCTS sessions từ file JSONL trên process pool
+Giới hạn tổng số LLM request đang bay giữa tất cả processes, ghi kết quả ngay khi
+mỗi session hoàn thành và resume từ manifest khi chạy lại
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field, asdict, replace
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Callable
+
+from backend.config import MCTSConfig
+
+logger = logging.getLogger(__name__)
+
+# Trạng thái job trong manifest
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+@dataclass
+class BatchJob:
+    """Một dòng trong file JSONL: prompt + data sources + focus areas"""
+    job_id: str
+    prompt: str = ""
+    data_sources: List[Dict[str, Any]] = field(default_factory=list)
+    focus_areas: List[str] = field(default_factory=list)
+    timeframe: Optional[Dict[str, str]] = None
+
+@dataclass
+class BatchJobResult:
+    """Kết quả của một job, được ghi vào manifest"""
+    job_id: str
+    status: str
+    session_id: str = ""
+    output_dir: str = ""
+    duration: float = 0.0
+    total_tokens: int = 0
+    error: Optional[str] = None
+    finished_at: str = ""
+
+class ProcessSemaphoreLimiter:
+    """
+    Async context manager bọc multiprocessing.Semaphore.
+
+    Acquire bằng polling non-blocking để không chặn event loop và không rò rỉ
+    permit khi task bị cancel. Worker bị kill (OOM, SIGKILL) khi đang giữ permit thì permit
+    bị mất; BatchRunner tạo semaphore mới cùng pool mới sau mỗi lần pool bị hỏng.
+    """
+
+    def __init__(self, semaphore, poll_interval: float = 0.05):
+        self._semaphore = semaphore
+        self.poll_interval = poll_interval
+
+    async def __aenter__(self):
+        while not self._semaphore.acquire(False):
+            await asyncio.sleep(self.poll_interval)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._semaphore.release()
+
+class BatchManifest:
+    """
+    Manifest append-only (JSONL) của các job đã chạy; dùng để resume khi restart.
+
+    Chỉ process chính ghi manifest nên không cần khóa giữa các process.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+
+        manifest_dir = os.path.dirname(path)
+        if manifest_dir:
+            os.makedirs(manifest_dir, exist_ok=True)
+
+        self._load()
+
+    def _load(self):
+        """Đọc manifest; entry sau ghi đè entry trước của cùng job"""
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Dòng cuối có thể bị cắt dở nếu process bị kill giữa chừng
+                    logger.warning(f"Skipping corrupt manifest line in {self.path}")
+                    continue
+                self.entries[entry["job_id"]] = entry
+
+    def is_completed(self, job_id: str) -> bool:
+        return self.entries.get(job_id, {}).get("status") == JOB_COMPLETED
+
+    def record(self, result: BatchJobResult):
+        """Append kết quả job và flush ngay xuống đĩa"""
+        entry = asdict(result)
+        self.entries[result.job_id] = entry
+
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+def _make_job_id(raw: Dict[str, Any]) -> str:
+    """ID ổn định theo nội dung job để resume không phụ thuộc thứ tự dòng"""
+    material = json.dumps(raw, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return f"job_{hashlib.sha256(material.encode('utf-8')).hexdigest()[:12]}"
+
+def _load_data_source(source: Any, base_dir: str) -> Dict[str, Any]:
+    """Data source có thể là dict inline hoặc đường dẫn tới file JSON"""
+    if isinstance(source, dict):
+        return source
+
+    path = source if os.path.isabs(source) else os.path.join(base_dir, source)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def load_batch_jobs(jobs_file: str) -> List[BatchJob]:
+    """
+    Đọc file JSONL, mỗi dòng có dạng:
+    {"id": "...", "prompt": "...", "data_sources": [...], "focus_areas": [...], "timeframe": {...}}
+
+    Chỉ cần ít nhất một trong "prompt" hoặc "data_sources".
+    """
+    base_dir = os.path.dirname(os.path.abspath(jobs_file))
+    jobs: List[BatchJob] = []
+    seen_ids = set()
+
+    with open(jobs_file, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            try:
+                raw = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{jobs_file}:{line_no}: JSON không hợp lệ ({str(e)})")
+
+            if not raw.get("prompt") and not raw.get("data_sources"):
+                raise ValueError(f"{jobs_file}:{line_no}: cần 'prompt' hoặc 'data_sources'")
+
+            job_id = str(raw.get("id") or _make_job_id(raw))
+            if job_id in seen_ids:
+                logger.warning(f"Duplicate batch job {job_id} at line {line_no}, skipping")
+                continue
+            seen_ids.add(job_id)
+
+            jobs.append(BatchJob(
+                job_id=job_id,
+                prompt=raw.get("prompt", ""),
+                data_sources=[_load_data_source(s, base_dir) for s in raw.get("data_sources", [])],
+                focus_areas=raw.get("focus_areas", []),
+                timeframe=raw.get("timeframe")
+            ))
+
+    return jobs
+
+# Limiter dùng chung trong mỗi worker process, được set bởi _init_worker
+_worker_limiter: Optional[ProcessSemaphoreLimiter] = None
+
+def _init_worker(semaphore):
+    """Initializer của process pool: gắn semaphore toàn cục vào worker"""
+    global _worker_limiter
+    _worker_limiter = ProcessSemaphoreLimiter(semaphore)
+
+def worker_config(config: MCTSConfig, workers: int) -> MCTSConfig:
+    """
+    Config cho mỗi worker: requests/tokens per minute của provider được chia đều cho các worker.
+
+    Governor (AdaptiveRateLimiter) chỉ dùng chung trong một event loop, nên nếu không chia
+    N worker sẽ cùng gửi N lần giới hạn tới provider. 0 (học từ rate-limit headers) giữ nguyên.
+    """
+    workers = max(1, workers)
+    if workers == 1:
+        return config
+
+    llm = replace(
+        config.llm,
+        requests_per_minute=max(1, config.llm.requests_per_minute // workers) if config.llm.requests_per_minute else 0,
+        tokens_per_minute=max(1, config.llm.tokens_per_minute // workers) if config.llm.tokens_per_minute else 0
+    )
+    return replace(config, llm=llm)
+
+async def _run_job_async(job: BatchJob, config: MCTSConfig) -> BatchJobResult:
+    """Chạy một MCTS session đầy đủ và ghi báo cáo Markdown"""
+    from backend.core.mcts_orchestrator import MCTSOrchestrator
+    from backend.core.reporting import generate_full_report_md
+
+    data_sources = list(job.data_sources)
+    if job.prompt:
+        data_sources.insert(0, {
+            "type": "user_prompt",
+            "description": "Input tự do của người dùng",
+            "content": job.prompt
+        })
+
+    today = datetime.now().strftime('%Y-%m-%d')
+    timeframe = job.timeframe or {"start": today, "end": today}
+    session_id = f"mcts_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{job.job_id}"
+
+    start = time.monotonic()
+
+    async with MCTSOrchestrator(config, llm_limiter=_worker_limiter) as orchestrator:
+        session = await orchestrator.run_full_analysis(
+            data_sources=data_sources,
+            timeframe=timeframe,
+            focus_areas=job.focus_areas,
+            session_id=session_id
+        )
+
+        base_output_dir = f"{config.output_dir}/{session.session_id}"
+        os.makedirs(base_output_dir, exist_ok=True)
+        with open(f"{base_output_dir}/final_report.md", 'w', encoding='utf-8') as f:
+            f.write(generate_full_report_md(session, base_output_dir))
+
+        total_tokens = sum(
+            agent.total_tokens
+            for agent in (orchestrator.primary_agent, orchestrator.ct_agent,
+                          orchestrator.ae_agent, orchestrator.sa_agent)
+            if agent
+        )
+
+    return BatchJobResult(
+        job_id=job.job_id,
+        status=JOB_COMPLETED,
+        session_id=session.session_id,
+        output_dir=base_output_dir,
+        duration=round(time.monotonic() - start, 2),
+        total_tokens=total_tokens,
+        finished_at=datetime.now().isoformat()
+    )
+
+def run_job_in_worker(job: BatchJob, config: MCTSConfig) -> BatchJobResult:
+    """Entry point trong worker process; lỗi được trả về dưới dạng result thay vì raise"""
+    start = time.monotonic()
+    try:
+        return asyncio.run(_run_job_async(job, config))
+    except Exception as e:
+        logger.error(f"Batch job {job.job_id} failed: {str(e)}", exc_info=True)
+        return BatchJobResult(
+            job_id=job.job_id,
+            status=JOB_FAILED,
+            duration=round(time.monotonic() - start, 2),
+            error=str(e),
+            finished_at=datetime.now().isoformat()
+        )
+
+class BatchRunner:
+    """
+    Điều phối batch: lọc job đã xong theo manifest, phân phối lên process pool,
+    ghi manifest khi từng job hoàn thành và tổng hợp throughput
+    """
+
+    def __init__(self,
+                 config: MCTSConfig,
+                 manifest_path: str,
+                 workers: int = 2,
+                 max_inflight_llm: int = 8,
+                 max_pool_restarts: int = 1):
+        self.config = config
+        self.manifest = BatchManifest(manifest_path)
+        self.workers = max(1, workers)
+        self.max_inflight_llm = max(1, max_inflight_llm)
+        self.max_pool_restarts = max(0, max_pool_restarts)
+
+    async def run(self,
+                  jobs: List[BatchJob],
+                  on_result: Optional[Callable[[BatchJobResult], Any]] = None) -> Dict[str, Any]:
+        """Chạy các job chưa hoàn thành; trả về thống kê throughput"""
+        pending = [job for job in jobs if not self.manifest.is_completed(job.job_id)]
+        skipped = len(jobs) - len(pending)
+
+        if skipped:
+            logger.info(f"Resuming batch: {skipped} job(s) already completed in manifest")
+
+        # Kết quả cuối của từng job (job chạy lại sau khi pool hỏng ghi đè kết quả failed)
+        results: Dict[str, BatchJobResult] = {}
+        start = time.monotonic()
+
+        if pending:
+            workers = min(self.workers, len(pending))
+            config = worker_config(self.config, workers)
+            logger.info(f"Batch workers: {workers}, per-worker LLM limits: "
+                        f"{config.llm.requests_per_minute} rpm, {config.llm.tokens_per_minute} tpm")
+
+            def record(result: BatchJobResult):
+                self.manifest.record(result)
+                results[result.job_id] = result
+                if on_result:
+                    on_result(result)
+
+            restarts = 0
+            while pending:
+                pending = await self._run_pool(pending, config, workers, record)
+                if not pending:
+                    break
+                if restarts >= self.max_pool_restarts:
+                    logger.error(f"Process pool broke again, {len(pending)} job(s) left as failed for resume")
+                    break
+                restarts += 1
+                logger.warning(f"Process pool broke, restarting ({restarts}/{self.max_pool_restarts}) "
+                               f"for {len(pending)} affected job(s)")
+
+        return self._build_stats(list(results.values()), skipped, time.monotonic() - start)
+
+    async def _run_pool(self,
+                        jobs: List[BatchJob],
+                        config: MCTSConfig,
+                        workers: int,
+                        record: Callable[[BatchJobResult], Any]) -> List[BatchJob]:
+        """
+        Chạy jobs trên một process pool mới; trả về các job bị ảnh hưởng khi pool hỏng.
+
+        Worker chết (OOM, SIGKILL, segfault) làm mọi future còn lại raise BrokenProcessPool:
+        các job đó được ghi JOB_FAILED ngay để resume chạy lại, rồi trả về cho caller.
+        Semaphore được tạo mới cùng pool nên permit bị worker chết giữ không làm giảm
+        --max-inflight của các lần chạy sau.
+        """
+        # spawn để worker không kế thừa event loop/sockets của process chính
+        ctx = multiprocessing.get_context("spawn")
+        semaphore = ctx.BoundedSemaphore(self.max_inflight_llm)
+        loop = asyncio.get_running_loop()
+        broken: List[BatchJob] = []
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)),
+                                 mp_context=ctx,
+                                 initializer=_init_worker,
+                                 initargs=(semaphore,)) as pool:
+            futures = {
+                loop.run_in_executor(pool, run_job_in_worker, job, config): job
+                for job in jobs
+            }
+
+            waiting = set(futures)
+            while waiting:
+                done, waiting = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    job = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        if isinstance(e, BrokenProcessPool):
+                            broken.append(job)
+                        logger.error(f"Batch job {job.job_id} failed in process pool: {type(e).__name__}: {str(e)}")
+                        result = BatchJobResult(
+                            job_id=job.job_id,
+                            status=JOB_FAILED,
+                            error=f"{type(e).__name__}: {str(e)}",
+                            finished_at=datetime.now().isoformat()
+                        )
+                    record(result)
+
+        return broken
+
+    def _build_stats(self,
+                     results: List[BatchJobResult],
+                     skipped: int,
+                     wall_time: float) -> Dict[str, Any]:
+        """Tổng hợp throughput của lần chạy này (không tính job đã skip)"""
+        completed = [r for r in results if r.status == JOB_COMPLETED]
+        total_tokens = sum(r.total_tokens for r in completed)
+
+        return {
+            "completed": len(completed),
+            "failed": len(results) - len(completed),
+            "skipped": skipped,
+            "wall_time": round(wall_time, 2),
+            "total_tokens": total_tokens,
+            "sessions_per_hour": round(len(completed) / wall_time * 3600, 2) if wall_time > 0 else 0.0,
+            "tokens_per_sec": round(total_tokens / wall_time, 2) if wall_time > 0 else 0.0,
+            "manifest": self.manifest.path
+        }
@@ -0,0 +1,197 @@
+"""
+Context Renderer - Render AgentInput.context thành text gọn cho prompt thay vì JSON indent=2
+Bỏ field rỗng, dòng key: value, dict nhỏ viết trên một dòng, giới hạn độ dài list, bỏ nội dung
+đã có trong prompt và dừng khi hết token budget; mỗi agent có profile riêng
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Any, Tuple
+
+from backend.core.token_estimator import estimate_tokens, truncate_to_tokens
+
+_INDENT = "  "
+_EMPTY = (None, "", [], {}, ())
+
+@dataclass(frozen=True)
+class RenderProfile:
+    """
+    Cách render context cho một agent.
+
+    include: các key (dạng "a.b" để lấy field con) theo thứ tự ưu tiên; None = mọi key theo thứ tự gốc.
+    exclude: các key/đường dẫn bỏ qua ở mọi cấp (vd. "idea_diversity_analysis.idea_ids").
+    """
+    include: Optional[Tuple[str, ...]] = None
+    exclude: Tuple[str, ...] = ()
+    max_list_items: int = 5
+    max_value_chars: int = 240
+    max_inline_keys: int = 6  # Dict chỉ gồm giá trị scalar với tối đa số key này được viết trên một dòng
+    min_dedupe_chars: int = 24  # Chuỗi ngắn hơn không được kiểm tra trùng với prompt
+
+DEFAULT_PROFILE = RenderProfile()
+
+# Profile theo agent_type; key đã có sẵn ở phần khác của prompt bị loại khỏi context
+CONTEXT_PROFILES: Dict[str, RenderProfile] = {
+    "primary": RenderProfile(
+        # diversity_guidance/style_variant đã có section riêng trong prompt Primary
+        include=("sa_next_instructions.primary_llm", "rejected_duplicate_ideas", "max_loops")
+    ),
+    "critical_thinking": RenderProfile(
+        include=("sa_next_instructions.ct_llm", "idea_novelty", "idea_diversity_analysis", "ideas"),
+        exclude=("idea_diversity_analysis.idea_ids",)
+    ),
+    "adversarial": RenderProfile(
+        include=("sa_next_instructions.ae_llm", "idea_novelty", "idea_diversity_analysis", "ideas"),
+        exclude=("idea_diversity_analysis.idea_ids",)
+    ),
+    "synthesis": RenderProfile(
+        # Diversity và phase đã được viết thành section riêng trong prompt SA
+        include=("sa_prev_instructions", "idea_novelty", "ideas", "max_loops"),
+        max_list_items=8
+    )
+}
+
+def get_profile(agent_type: str) -> RenderProfile:
+    return CONTEXT_PROFILES.get(agent_type, DEFAULT_PROFILE)
+
+def _resolve(context: Dict[str, Any], path: str) -> Any:
+    value: Any = context
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+def _is_scalar(value: Any) -> bool:
+    return not isinstance(value, (dict, list, tuple, set))
+
+class _Renderer:
+    """Render một context; giữ tập giá trị đã viết để không lặp lại"""
+
+    def __init__(self, profile: RenderProfile, seen_text: str):
+        self.profile = profile
+        self.seen_text = seen_text
+        self.written: set = set()
+
+    def prune(self, value: Any, path: str) -> Any:
+        """Bỏ field rỗng/bị exclude và chuỗi đã có trong prompt; trả về None nếu không còn gì"""
+        if path in self.profile.exclude:
+            return None
+
+        if isinstance(value, dict):
+            pruned = {}
+            for key, item in value.items():
+                item = self.prune(item, f"{path}.{key}" if path else str(key))
+                if item not in _EMPTY:
+                    pruned[key] = item
+            return pruned or None
+
+        if isinstance(value, (list, tuple, set)):
+            pruned = [self.prune(item, path) for item in value]
+            pruned = [item for item in pruned if item not in _EMPTY]
+            if all(_is_scalar(item) for item in pruned):
+                pruned = list(dict.fromkeys(pruned))  # Bỏ phần tử lặp, giữ thứ tự
+            return pruned or None
+
+        if isinstance(value, str):
+            value = value.strip()
+            if len(value) >= self.profile.min_dedupe_chars:
+                if value in self.written or value in self.seen_text:
+                    return None
+                self.written.add(value)
+            return value or None
+
+        return value
+
+    def scalar(self, value: Any) -> str:
+        if isinstance(value, float):
+            text = f"{value:.3f}".rstrip("0").rstrip(".")
+        else:
+            text = " ".join(str(value).split())
+        limit = self.profile.max_value_chars
+        return text if len(text) <= limit else text[:limit].rstrip() + "…"
+
+    def inline(self, value: Any) -> Optional[str]:
+        """Text một dòng cho scalar, list scalar hoặc dict scalar nhỏ; None nếu cần nhiều dòng"""
+        if _is_scalar(value):
+            return self.scalar(value)
+
+        if isinstance(value, dict):
+            if len(value) <= self.profile.max_inline_keys and all(_is_scalar(v) for v in value.values()):
+                return ", ".join(f"{k}={self.scalar(v)}" for k, v in value.items())
+            return None
+
+        if all(_is_scalar(item) for item in value):
+            items = [self.scalar(item) for item in value[:self.profile.max_list_items]]
+            extra = len(value) - len(items)
+            return "; ".join(items) + (f" (+{extra})" if extra > 0 else "")
+
+        if all(isinstance(item, (list, tuple)) and all(_is_scalar(x) for x in item) for item in value):
+            # Cặp/bộ giá trị (vd. cặp ý tưởng trùng)
+            items = ["(" + ", ".join(self.scalar(x) for x in item) + ")" for item in value[:self.profile.max_list_items]]
+            extra = len(value) - len(items)
+            return "; ".join(items) + (f" (+{extra})" if extra > 0 else "")
+
+        return None
+
+    def lines(self, key: str, value: Any, depth: int) -> List[str]:
+        prefix = _INDENT * depth
+        text = self.inline(value)
+        if text is not None:
+            return [f"{prefix}{key}: {text}"]
+
+        result = [f"{prefix}{key}:"]
+        if isinstance(value, dict):
+            for child_key, child in value.items():
+                result.extend(self.lines(str(child_key), child, depth + 1))
+            return result
+
+        for item in value[:self.profile.max_list_items]:
+            item_text = self.inline(item)
+            if item_text is not None:
+                result.append(f"{prefix}{_INDENT}- {item_text}")
+            else:
+                result.extend(self.lines("-", item, depth + 1))
+        extra = len(value) - self.profile.max_list_items
+        if extra > 0:
+            result.append(f"{prefix}{_INDENT}(+{extra} mục)")
+        return result
+
+def render_context(context: Dict[str, Any],
+                   profile: RenderProfile = DEFAULT_PROFILE,
+                   max_tokens: Optional[int] = None,
+                   seen_text: str = "") -> str:
+    """
+    Render context thành các dòng key: value.
+
+    Key được render theo thứ tự ưu tiên của profile; khi vượt max_tokens các key sau bị bỏ
+    (key đang render dở bị cắt). seen_text là phần còn lại của prompt, dùng để bỏ chuỗi trùng.
+    Trả về "" nếu không còn gì đáng render.
+    """
+    if not context:
+        return ""
+
+    renderer = _Renderer(profile, seen_text)
+    keys = profile.include if profile.include is not None else [str(key) for key in context]
+
+    blocks = []
+    used = 0
+    for key in keys:
+        value = renderer.prune(_resolve(context, key), key)
+        if value in _EMPTY:
+            continue
+
+        block = "\n".join(renderer.lines(key, value, 0))
+        tokens = estimate_tokens(block) + 1
+
+        if max_tokens is not None and used + tokens > max_tokens:
+            remaining = max_tokens - used
+            if remaining > 0:
+                block = truncate_to_tokens(block, remaining)
+                if block:
+                    blocks.append(block)
+            break
+
+        blocks.append(block)
+        used += tokens
+
+    return "\n".join(blocks)
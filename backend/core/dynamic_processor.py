@@ -6,12 +6,13 @@ import asyncio
 import logging
 import json
 import re
-from typing import Dict, List, Optional, Any, Union, Tuple
+from typing import Dict, List, Optional, Any, Union, Tuple, Callable
 from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum
 
 from backend.core.llm_client import LLMClient, LLMMessage, LLMResponse
+from backend.core.http_transport import HTTPTransport
 from backend.core.mcts_orchestrator import MCTSOrchestrator, MCTSSession
 from backend.config import MCTSConfig, DEFAULT_CONFIG
 
@@ -50,11 +51,15 @@ class DynamicProcessor:
     Processor chính để xử lý mọi loại input từ user
     """
     
-    def __init__(self, config: MCTSConfig = None):
+    def __init__(self, config: MCTSConfig = None, stream_handler: Optional[Callable[[str], Any]] = None):
         self.config = config or DEFAULT_CONFIG
+        self.transport: Optional[HTTPTransport] = None
         self.llm_client: Optional[LLMClient] = None
         self.mcts_orchestrator: Optional[MCTSOrchestrator] = None
         
+        # Nếu có, các câu trả lời trực tiếp được stream từng token tới handler
+        self.stream_handler = stream_handler
+        
         # Conversation context
         self.conversation_history: List[Dict[str, Any]] = []
         self.current_session: Optional[MCTSSession] = None
@@ -95,12 +100,15 @@ Trả về JSON format:
         """Khởi tạo components"""
         logger.info("Initializing Dynamic Processor...")
         
+        # Shared HTTP transport cho cả chat và MCTS pipeline
+        self.transport = HTTPTransport(self.config.http)
+        
         # Initialize LLM client
-        self.llm_client = LLMClient(self.config.llm)
+        self.llm_client = LLMClient(self.config.llm, transport=self.transport)
         await self.llm_client.start_session()
         
         # Initialize MCTS orchestrator
-        self.mcts_orchestrator = MCTSOrchestrator(self.config)
+        self.mcts_orchestrator = MCTSOrchestrator(self.config, transport=self.transport)
         await self.mcts_orchestrator.initialize()
         
         logger.info("✅ Dynamic Processor initialized successfully")
@@ -112,6 +120,9 @@ Trả về JSON format:
         
         if self.mcts_orchestrator:
             await self.mcts_orchestrator.cleanup()
+        
+        if self.transport:
+            await self.transport.close()
     
     async def process_user_input(self, user_input: str, context: Optional[Dict[str, Any]] = None) -> ProcessedResponse:
         """
@@ -281,7 +292,8 @@ Trả lời bằng tiếng Việt.
         response = await self.llm_client.single_prompt(
             prompt=dynamic_input.content,
             system_message=system_prompt,
-            temperature=0.7
+            temperature=0.7,
+            on_token=self.stream_handler
         )
         
         if not response.success:
@@ -435,7 +447,8 @@ Context: User đã nhận kết quả từ session {self.current_session.session
         response = await self.llm_client.single_prompt(
             prompt=prompt,
             system_message=system_prompt,
-            temperature=0.6
+            temperature=0.6,
+            on_token=self.stream_handler
         )
         
         return ProcessedResponse(
@@ -468,7 +481,8 @@ Trả lời bằng tiếng Việt.
         response = await self.llm_client.single_prompt(
             prompt=dynamic_input.content,
             system_message=system_prompt,
-            temperature=0.8
+            temperature=0.8,
+            on_token=self.stream_handler
         )
         
         return ProcessedResponse(
@@ -517,7 +531,8 @@ Trả lời bằng tiếng Việt.
         response = await self.llm_client.single_prompt(
             prompt=prompt,
             system_message=system_prompt,
-            temperature=0.7
+            temperature=0.7,
+            on_token=self.stream_handler
         )
         
         return ProcessedResponse(
@@ -724,7 +739,7 @@ async def process_user_message(message: str, config: MCTSConfig = None) -> Proce
     async with DynamicProcessor(config) as processor:
         return await processor.process_user_input(message)
 
-async def start_interactive_session(config: MCTSConfig = None):
+async def start_interactive_session(config: MCTSConfig = None, stream: bool = True):
     """Start interactive session với user"""
     
     from rich.console import Console
@@ -732,13 +747,22 @@ async def start_interactive_session(config: MCTSConfig = None):
     
     console = Console()
     
+    # Streaming: in token ngay khi nhận được thay vì chờ toàn bộ response
+    stream_state = {"started": False}
+    
+    def print_token(delta: str):
+        if not stream_state["started"]:
+            stream_state["started"] = True
+            console.print("\n🤖 MCTS: ", style="white", end="")
+        console.print(delta, end="", markup=False, highlight=False)
+    
     console.print(Panel.fit(
         "🧠 MCTS Interactive Session\nNhập 'quit' để thoát",
         title="Dynamic AI Assistant",
         border_style="blue"
     ))
     
-    async with DynamicProcessor(config) as processor:
+    async with DynamicProcessor(config, stream_handler=print_token if stream else None) as processor:
         while True:
             try:
                 # Get user input
@@ -753,10 +777,14 @@ async def start_interactive_session(config: MCTSConfig = None):
                 
                 # Process input
                 console.print("\n🤔 Đang xử lý...", style="yellow")
+                stream_state["started"] = False
                 response = await processor.process_user_input(user_input)
                 
-                # Display response
-                console.print(f"\n🤖 MCTS: {response.content}", style="white")
+                # Display response (nếu đã stream thì chỉ cần xuống dòng)
+                if stream_state["started"]:
+                    console.print()
+                else:
+                    console.print(f"\n🤖 MCTS: {response.content}", style="white")
                 
                 # Show suggestions if available
                 if response.suggestions:
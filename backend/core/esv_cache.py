@@ -0,0 +1,313 @@
+"""
+ESV Result Cache - Cache kết quả search engine trên đĩa (SQLite WAL), dùng chung giữa các process
+Key = digest(engine, query_type, query đã chuẩn hóa, max_results); TTL theo loại query,
+negative caching cho kết quả rỗng, stale-while-revalidate và validators ETag/Last-Modified
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Any, Iterator
+
+logger = logging.getLogger(__name__)
+
+# TTL mặc định theo query_type (giây)
+DEFAULT_QUERY_TYPE_TTLS = {
+    "trend": 24 * 3600,
+    "technology": 24 * 3600,
+    "competitor": 3 * 24 * 3600,
+    "market_size": 7 * 24 * 3600,
+    "general": 24 * 3600
+}
+
+@dataclass
+class ESVCacheEntry:
+    """Một entry đã đọc từ cache"""
+    key: str
+    results: List[Dict[str, Any]]
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    age: float = 0.0
+    state: str = "fresh"  # "fresh", "stale" (vẫn trả về, revalidate nền) hoặc "expired"
+
+    @property
+    def negative(self) -> bool:
+        return not self.results
+
+def normalize_query(text: str) -> str:
+    """Chuẩn hóa query để các biến thể chữ hoa/khoảng trắng dùng chung một entry"""
+    text = unicodedata.normalize("NFC", text or "").lower()
+    return re.sub(r"\s+", " ", text).strip()
+
+class ESVResultCache:
+    """
+    Cache kết quả từng engine cho từng query.
+
+    - Entry còn hạn: trả về ngay (hit)
+    - Quá hạn nhưng trong cửa sổ stale: trả về ngay và caller revalidate ở nền
+    - Quá cửa sổ stale: caller gọi lại engine (kèm ETag/Last-Modified nếu có)
+    Kết quả rỗng được cache với negative_ttl ngắn hơn.
+    """
+
+    def __init__(self,
+                 db_path: str,
+                 ttls: Optional[Dict[str, int]] = None,
+                 default_ttl: int = 24 * 3600,
+                 negative_ttl: int = 3600,
+                 stale_ttl: int = 24 * 3600,
+                 max_entries: int = 20000,
+                 max_bytes: int = 64 * 1024 * 1024):
+        self.db_path = db_path
+        self.ttls = {**DEFAULT_QUERY_TYPE_TTLS, **(ttls or {})}
+        self.default_ttl = default_ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        # Counters
+        self.hits = 0
+        self.stale_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.revalidations = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS esv_results (
+                key TEXT PRIMARY KEY,
+                engine TEXT NOT NULL,
+                query_type TEXT NOT NULL,
+                query TEXT NOT NULL,
+                results TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hit_count INTEGER NOT NULL DEFAULT 0,
+                size_bytes INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_esv_results_last_access ON esv_results(last_access)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(engine: str, query_type: str, query: str, max_results: int) -> str:
+        """Digest ổn định giữa các process và các lần chạy"""
+        material = json.dumps(
+            [engine, query_type, normalize_query(query), max_results],
+            ensure_ascii=False,
+            separators=(",", ":")
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get_ttl(self, query_type: str, negative: bool = False) -> int:
+        if negative:
+            return self.negative_ttl
+        return self.ttls.get(query_type, self.default_ttl)
+
+    def get(self, key: str) -> Optional[ESVCacheEntry]:
+        """Đọc entry (kể cả đã hết hạn, để dùng validators); None nếu không có"""
+        try:
+            row = self._conn.execute(
+                "SELECT results, etag, last_modified, created_at, expires_at FROM esv_results WHERE key = ?",
+                (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            results, etag, last_modified, created_at, expires_at = row
+            now = time.time()
+
+            if now <= expires_at:
+                state = "fresh"
+            elif now <= expires_at + self.stale_ttl:
+                state = "stale"
+            else:
+                state = "expired"
+
+            entry = ESVCacheEntry(
+                key=key,
+                results=json.loads(results),
+                etag=etag,
+                last_modified=last_modified,
+                age=now - created_at,
+                state=state
+            )
+
+            if state == "expired":
+                self.misses += 1
+                return entry
+
+            if state == "stale":
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+            if entry.negative:
+                self.negative_hits += 1
+
+            self._conn.execute(
+                "UPDATE esv_results SET last_access = ?, hit_count = hit_count + 1 WHERE key = ?",
+                (now, key)
+            )
+            self._conn.commit()
+
+            return entry
+
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f"ESV cache read error: {str(e)}")
+            self.misses += 1
+            return None
+
+    def put(self,
+            key: str,
+            engine: str,
+            query_type: str,
+            query: str,
+            results: List[Dict[str, Any]],
+            etag: Optional[str] = None,
+            last_modified: Optional[str] = None):
+        """Ghi kết quả của một engine; kết quả rỗng dùng negative TTL"""
+        try:
+            now = time.time()
+            payload = json.dumps(results, ensure_ascii=False, default=str)
+            ttl = self.get_ttl(query_type, negative=not results)
+
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO esv_results
+                    (key, engine, query_type, query, results, etag, last_modified,
+                     created_at, expires_at, last_access, hit_count, size_bytes)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?)
+                """,
+                (key, engine, query_type, normalize_query(query), payload, etag, last_modified,
+                 now, now + ttl, now, len(payload.encode("utf-8")))
+            )
+            self._conn.commit()
+            self.writes += 1
+            self._evict_if_needed()
+
+        except sqlite3.Error as e:
+            logger.warning(f"ESV cache write error: {str(e)}")
+
+    def touch(self, key: str, query_type: str):
+        """Gia hạn entry sau khi server trả 304 Not Modified"""
+        try:
+            now = time.time()
+            row = self._conn.execute("SELECT results FROM esv_results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return
+
+            ttl = self.get_ttl(query_type, negative=row[0] == "[]")
+            self._conn.execute(
+                "UPDATE esv_results SET expires_at = ?, last_access = ? WHERE key = ?",
+                (now + ttl, now, key)
+            )
+            self._conn.commit()
+            self.not_modified += 1
+
+        except sqlite3.Error as e:
+            logger.warning(f"ESV cache write error: {str(e)}")
+
+    def _evict_if_needed(self):
+        """Xóa entries quá cửa sổ stale, rồi LRU cho tới khi dưới giới hạn số entry và dung lượng"""
+        cursor = self._conn.execute(
+            "DELETE FROM esv_results WHERE expires_at < ? AND etag IS NULL AND last_modified IS NULL",
+            (time.time() - self.stale_ttl,)
+        )
+        self.evictions += cursor.rowcount
+
+        count, total_bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM esv_results"
+        ).fetchone()
+
+        if count > self.max_entries or total_bytes > self.max_bytes:
+            # Xóa theo thứ tự LRU tới khi vừa cả hai giới hạn
+            to_delete = []
+            for key, size_bytes in self._conn.execute(
+                "SELECT key, size_bytes FROM esv_results ORDER BY last_access ASC"
+            ):
+                if count <= self.max_entries and total_bytes <= self.max_bytes:
+                    break
+                to_delete.append((key,))
+                count -= 1
+                total_bytes -= size_bytes
+
+            self._conn.executemany("DELETE FROM esv_results WHERE key = ?", to_delete)
+            self.evictions += len(to_delete)
+
+        self._conn.commit()
+
+    def iter_results(self) -> Iterator[Dict[str, Any]]:
+        """Mọi kết quả search đã cache (vd. để build index local)"""
+        try:
+            rows = self._conn.execute("SELECT results FROM esv_results WHERE results != '[]'").fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"ESV cache read error: {str(e)}")
+            return
+
+        for (results,) in rows:
+            try:
+                yield from json.loads(results)
+            except ValueError:
+                continue
+
+    def clear(self):
+        """Xóa toàn bộ cache"""
+        self._conn.execute("DELETE FROM esv_results")
+        self._conn.commit()
+        logger.info("ESV result cache cleared")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê cache"""
+        try:
+            entries, total_bytes, negative_entries = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0), "
+                "COALESCE(SUM(CASE WHEN results = '[]' THEN 1 ELSE 0 END), 0) FROM esv_results"
+            ).fetchone()
+        except sqlite3.Error:
+            entries, total_bytes, negative_entries = -1, -1, -1
+
+        lookups = self.hits + self.stale_hits + self.misses
+
+        return {
+            "entries": entries,
+            "negative_entries": negative_entries,
+            "size_bytes": total_bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "revalidations": self.revalidations,
+            "not_modified": self.not_modified,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.stale_hits) / lookups, 3) if lookups else 0.0
+        }
+
+    def close(self):
+        """Đóng kết nối SQLite"""
+        try:
+            self._conn.close()
+        except sqlite3.Error:
+            pass
@@ -11,14 +11,21 @@ Lưu ý về DuckDuckGo Instant Answer API:
 
 import asyncio
 import aiohttp
+import hashlib
 import json
 import logging
-import re
-from typing import Dict, List, Optional, Any, Union
+from typing import Dict, List, Optional, Any, Union, Tuple
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from urllib.parse import quote_plus
 
+from backend.core.esv_cache import ESVResultCache, ESVCacheEntry
+from backend.core.http_transport import HTTPTransport
+from backend.core.rate_limiter import TokenBucket
+from backend.core.singleflight import get_shared_singleflight
+from backend.core.keyword_extractor import get_default_extractor
+from backend.core.tracing import get_tracer, Span, CATEGORY_ESV, CATEGORY_HTTP, CATEGORY_RETRY
+
 logger = logging.getLogger(__name__)
 
 @dataclass
@@ -54,31 +61,53 @@ class ValidationResult:
     sources_count: int
     processed_at: datetime = field(default_factory=datetime.now)
 
+class ESVEngineError(Exception):
+    """Lỗi khi gọi một search engine (không được cache, khác với kết quả rỗng)"""
+
+def _search_result_to_dict(result: SearchResult) -> Dict[str, Any]:
+    return {**result.__dict__, "timestamp": result.timestamp.isoformat() if result.timestamp else None}
+
+def _search_result_from_dict(data: Dict[str, Any]) -> SearchResult:
+    return SearchResult(**{
+        **data,
+        "timestamp": datetime.fromisoformat(data["timestamp"]) if data.get("timestamp") else None
+    })
+
 class ESVModule:
     """
     External Search & Validation Module
     """
     
-    def __init__(self, config=None):
+    def __init__(self,
+                 config=None,
+                 transport: Optional[HTTPTransport] = None,
+                 result_cache: Optional[ESVResultCache] = None):
         self.config = config or {}
+        self.transport = transport
+        # Cache kết quả engine trên đĩa, dùng chung giữa các session/process
+        self.result_cache = result_cache
         self.session: Optional[aiohttp.ClientSession] = None
+        self._timeout = aiohttp.ClientTimeout(total=60)
         
         # Search engines configurations
         self.search_engines = {
             "google": {
                 "url": "https://www.googleapis.com/customsearch/v1",
                 "enabled": False,  # Requires API key
-                "rate_limit": 1.0  # seconds between requests
+                "rate_limit": 1.0,  # seconds between requests
+                "burst": 1  # Số request được phép dồn ngay khi bucket đầy
             },
             "bing": {
                 "url": "https://api.bing.microsoft.com/v7.0/search",
                 "enabled": False,  # Requires API key
-                "rate_limit": 1.0
+                "rate_limit": 1.0,
+                "burst": 1
             },
             "duckduckgo": {
                 "url": "https://api.duckduckgo.com/",
                 "enabled": True,  # Public API
-                "rate_limit": 2.0
+                "rate_limit": 2.0,
+                "burst": 1
             }
         }
         
@@ -92,13 +121,26 @@ class ESVModule:
             "github": {
                 "url": "https://api.github.com",
                 "enabled": True,  # Public API with rate limits
-                "focus": ["technology", "trends", "repositories"]
+                "focus": ["technology", "trends", "repositories"],
+                "rate_limit": 6.0,  # Search API không xác thực: 10 requests/phút
+                "burst": 2
             }
         }
         
-        # Cache
+        # Token bucket riêng cho từng engine; các engine khác nhau không chặn lẫn nhau
+        self._engine_buckets: Dict[str, TokenBucket] = {
+            name: TokenBucket(60.0 / settings["rate_limit"], burst=settings.get("burst", 1))
+            for name, settings in {**self.search_engines, **self.databases}.items()
+            if settings.get("rate_limit")
+        }
+        self._engine_stats: Dict[str, Dict[str, float]] = {}
+        
+        # Cache ValidationResult trong session (được checkpoint cùng journal)
         self._cache: Dict[str, ValidationResult] = {}
-        self._last_request_time: Dict[str, datetime] = {}
+        
+        # Các task stale-while-revalidate đang chạy nền
+        self._revalidation_tasks: set = set()
+        self._revalidating: set = set()
         
     async def __aenter__(self):
         """Async context manager entry"""
@@ -110,15 +152,24 @@ class ESVModule:
         await self.close_session()
         
     async def start_session(self):
-        """Khởi tạo aiohttp session"""
-        if self.session is None:
-            timeout = aiohttp.ClientTimeout(total=60)
-            self.session = aiohttp.ClientSession(timeout=timeout)
+        """Khởi tạo aiohttp session (dùng session của transport nếu được inject)"""
+        if self.session is None or self.session.closed:
+            if self.transport:
+                self.session = await self.transport.get_session()
+            else:
+                self.session = aiohttp.ClientSession()
             
     async def close_session(self):
-        """Đóng aiohttp session"""
+        """Đóng aiohttp session; session của transport dùng chung do owner đóng"""
+        # Revalidation nền chưa xong thì bỏ; entry stale vẫn dùng được ở lần sau
+        for task in list(self._revalidation_tasks):
+            task.cancel()
+        if self._revalidation_tasks:
+            await asyncio.gather(*self._revalidation_tasks, return_exceptions=True)
+        
         if self.session:
-            await self.session.close()
+            if not self.transport:
+                await self.session.close()
             self.session = None
     
     async def validate_multiple(self, queries: List[SearchQuery]) -> Dict[str, ValidationResult]:
@@ -141,67 +192,60 @@ class ESVModule:
         
         # Process uncached queries
         if queries_to_process:
-            # Sort by priority
+            # Sort by priority: query ưu tiên cao được lấy token của engine trước
             queries_to_process.sort(key=lambda q: {"high": 3, "medium": 2, "low": 1}[q.priority], reverse=True)
             
-            # Execute with rate limiting
-            tasks = []
-            for query in queries_to_process:
-                task = self._validate_single_with_rate_limit(query)
-                tasks.append(task)
+            # Tất cả queries chạy song song; nhịp gọi từng engine do token bucket của engine đó quyết định
+            all_results = await asyncio.gather(
+                *[self._validate_single_safe(query) for query in queries_to_process],
+                return_exceptions=True
+            )
             
-            # Execute in batches to avoid overwhelming APIs
-            batch_size = 3
-            for i in range(0, len(tasks), batch_size):
-                batch = tasks[i:i + batch_size]
-                batch_results = await asyncio.gather(*batch, return_exceptions=True)
+            for query, result in zip(queries_to_process, all_results):
+                if isinstance(result, Exception):
+                    logger.error(f"Error validating {query.query}: {str(result)}")
+                    result = ValidationResult(
+                        query=query,
+                        results=[],
+                        summary=f"Error during validation: {str(result)}",
+                        confidence=0.0,
+                        validation_status="inconclusive",
+                        key_findings=[],
+                        sources_count=0
+                    )
                 
-                for j, result in enumerate(batch_results):
-                    query = queries_to_process[i + j]
-                    
-                    if isinstance(result, Exception):
-                        logger.error(f"Error validating {query.query}: {str(result)}")
-                        result = ValidationResult(
-                            query=query,
-                            results=[],
-                            summary=f"Error during validation: {str(result)}",
-                            confidence=0.0,
-                            validation_status="inconclusive",
-                            key_findings=[],
-                            sources_count=0
-                        )
-                    
-                    results[query.query] = result
-                    
-                    # Cache result
-                    cache_key = self._get_cache_key(query)
-                    self._cache[cache_key] = result
+                results[query.query] = result
                 
-                # Rate limiting between batches
-                if i + batch_size < len(tasks):
-                    await asyncio.sleep(2.0)
+                # Cache result
+                cache_key = self._get_cache_key(query)
+                self._cache[cache_key] = result
         
         return results
     
-    async def _validate_single_with_rate_limit(self, query: SearchQuery) -> ValidationResult:
-        """Validate single query với rate limiting"""
+    async def _validate_single_safe(self, query: SearchQuery) -> ValidationResult:
+        """Validate single query; lỗi được trả về dưới dạng kết quả inconclusive"""
         
-        # Rate limiting
-        await self._enforce_rate_limit()
-        
-        try:
-            return await self._validate_single(query)
-        except Exception as e:
-            logger.error(f"Error in single validation: {str(e)}")
-            return ValidationResult(
-                query=query,
-                results=[],
-                summary=f"Validation failed: {str(e)}",
-                confidence=0.0,
-                validation_status="inconclusive",
-                key_findings=[],
-                sources_count=0
-            )
+        with get_tracer().span("esv.query", CATEGORY_ESV, query_type=query.query_type) as span:
+            try:
+                # Query giống hệt đang được xác thực (session/vòng lặp khác): chờ chung kết quả
+                flight_key = f"{self._get_cache_key(query)}:{query.max_results}"
+                flights = get_shared_singleflight("esv")
+                span.set(coalesced=flights.is_inflight(flight_key))
+                result = await flights.do(flight_key, lambda: self._validate_single(query))
+                span.set(sources_count=result.sources_count, validation_status=result.validation_status)
+                return result
+            except Exception as e:
+                logger.error(f"Error in single validation: {str(e)}")
+                span.error = str(e)
+                return ValidationResult(
+                    query=query,
+                    results=[],
+                    summary=f"Validation failed: {str(e)}",
+                    confidence=0.0,
+                    validation_status="inconclusive",
+                    key_findings=[],
+                    sources_count=0
+                )
     
     async def _validate_single(self, query: SearchQuery) -> ValidationResult:
         """Validate single query"""
@@ -209,16 +253,20 @@ class ESVModule:
         # Determine best search strategy
         search_strategy = self._determine_search_strategy(query)
         
-        # Execute searches
+        # Execute searches: các engine được gọi song song
+        engines = [engine for engine, enabled in search_strategy.items() if enabled]
+        engine_results = await asyncio.gather(
+            *[self._search_with_engine(query, engine) for engine in engines],
+            return_exceptions=True
+        )
+        
         all_results = []
         
-        for engine, enabled in search_strategy.items():
-            if enabled:
-                try:
-                    engine_results = await self._search_with_engine(query, engine)
-                    all_results.extend(engine_results)
-                except Exception as e:
-                    logger.warning(f"Search engine {engine} failed: {str(e)}")
+        for engine, result in zip(engines, engine_results):
+            if isinstance(result, Exception):
+                logger.warning(f"Search engine {engine} failed: {str(result)}")
+            else:
+                all_results.extend(result)
         
         # Deduplicate và score results
         unique_results = self._deduplicate_results(all_results)
@@ -259,19 +307,102 @@ class ESVModule:
         return strategy
     
     async def _search_with_engine(self, query: SearchQuery, engine: str) -> List[SearchResult]:
-        """Tìm kiếm với một search engine cụ thể"""
+        """Tìm kiếm với một search engine cụ thể (qua persistent cache nếu có)"""
+        
+        with get_tracer().span("esv.search", CATEGORY_HTTP, engine=engine) as span:
+            cache_key = None
+            entry = None
+            
+            if self.result_cache:
+                cache_key = ESVResultCache.make_key(engine, query.query_type, query.query, query.max_results)
+                entry = self.result_cache.get(cache_key)
+                
+                if entry and entry.state != "expired":
+                    span.set(cache=entry.state, results=len(entry.results))
+                    if entry.state == "stale":
+                        # Stale-while-revalidate: trả kết quả cũ ngay, làm mới ở nền
+                        self._schedule_revalidation(query, engine, cache_key, entry)
+                    return [_search_result_from_dict(r) for r in entry.results]
+            
+            try:
+                results = await self._fetch_engine(query, engine, cache_key, entry, span)
+            except Exception as e:
+                # Lỗi không được cache (khác với kết quả rỗng)
+                logger.warning(f"Search engine {engine} failed: {str(e)}")
+                span.error = str(e)
+                return []
+            
+            span.set(cache="miss" if self.result_cache else "off", results=len(results))
+            return results
+    
+    async def _fetch_engine(self,
+                            query: SearchQuery,
+                            engine: str,
+                            cache_key: Optional[str] = None,
+                            entry: Optional[ESVCacheEntry] = None,
+                            span: Optional[Span] = None) -> List[SearchResult]:
+        """Gọi engine (theo token bucket của engine) và ghi kết quả vào cache"""
+        
+        waited = await self._acquire_engine(engine)
+        if span:
+            span.queue_time = waited
+        
+        validators: Dict[str, Optional[str]] = {}
         
         if engine == "duckduckgo":
-            return await self._search_duckduckgo(query)
+            results = await self._search_duckduckgo(query)
         elif engine == "github":
-            return await self._search_github(query)
+            results, validators = await self._search_github(query, entry)
+            if results is None:
+                # 304 Not Modified: dùng lại kết quả đã cache và gia hạn entry
+                self.result_cache.touch(cache_key, query.query_type)
+                return [_search_result_from_dict(r) for r in entry.results]
         elif engine == "google":
-            return await self._search_google(query)
+            results = await self._search_google(query)
         elif engine == "bing":
-            return await self._search_bing(query)
+            results = await self._search_bing(query)
         else:
-            logger.warning(f"Unknown search engine: {engine}")
-            return []
+            raise ESVEngineError(f"Unknown search engine: {engine}")
+        
+        if self.result_cache and cache_key:
+            self.result_cache.put(
+                cache_key,
+                engine,
+                query.query_type,
+                query.query,
+                [_search_result_to_dict(r) for r in results],
+                etag=validators.get("etag"),
+                last_modified=validators.get("last_modified")
+            )
+        
+        return results
+    
+    def _schedule_revalidation(self,
+                               query: SearchQuery,
+                               engine: str,
+                               cache_key: str,
+                               entry: ESVCacheEntry):
+        """Làm mới entry stale ở nền (mỗi key tối đa một task)"""
+        if cache_key in self._revalidating:
+            return
+        
+        self._revalidating.add(cache_key)
+        task = asyncio.create_task(self._revalidate(query, engine, cache_key, entry))
+        self._revalidation_tasks.add(task)
+        task.add_done_callback(self._revalidation_tasks.discard)
+    
+    async def _revalidate(self,
+                          query: SearchQuery,
+                          engine: str,
+                          cache_key: str,
+                          entry: ESVCacheEntry):
+        try:
+            self.result_cache.revalidations += 1
+            await self._fetch_engine(query, engine, cache_key, entry)
+        except Exception as e:
+            logger.warning(f"Background revalidation for {engine} failed: {str(e)}")
+        finally:
+            self._revalidating.discard(cache_key)
     
     async def _search_duckduckgo(self, query: SearchQuery) -> List[SearchResult]:
         """Tìm kiếm với DuckDuckGo API (Instant Answer). Có backoff khi gặp 202."""
@@ -289,56 +420,73 @@ class ESVModule:
                     "skip_disambig": "1"
                 }
                 
-                async with self.session.get(url, params=params) as response:
+                async with self.session.get(url, params=params, timeout=self._timeout) as response:
                     if response.status == 200:
                         data = await response.json()
                         return self._parse_duckduckgo_results(data, query)
                     elif response.status == 202:
                         logger.warning("DuckDuckGo API returned 202 - likely warming up or rate-limited. Retrying...")
-                        await asyncio.sleep(backoff)
-                        backoff *= 2
-                        continue
+                        error = ESVEngineError("DuckDuckGo API returned 202")
                     else:
-                        logger.warning(f"DuckDuckGo API returned {response.status}")
-                        return []
+                        raise ESVEngineError(f"DuckDuckGo API returned {response.status}")
+            except ESVEngineError:
+                raise
             except Exception as e:
                 logger.error(f"DuckDuckGo search error: {str(e)}")
-                if attempt == max_attempts:
-                    return []
-                await asyncio.sleep(backoff)
-                backoff *= 2
+                error = e
+            
+            if attempt == max_attempts:
+                raise error
+            
+            await self._retry_sleep(backoff, attempt)
+            await self._acquire_engine("duckduckgo")
+            backoff *= 2
         
         return []
     
-    async def _search_github(self, query: SearchQuery) -> List[SearchResult]:
-        """Tìm kiếm repositories trên GitHub"""
+    async def _search_github(self,
+                             query: SearchQuery,
+                             cached: Optional[ESVCacheEntry] = None) -> Tuple[Optional[List[SearchResult]], Dict[str, Optional[str]]]:
+        """
+        Tìm kiếm repositories trên GitHub.
+        
+        Gửi If-None-Match/If-Modified-Since khi có entry cũ; trả về (None, {}) nếu 304,
+        ngược lại (results, validators) để lưu cho lần revalidate sau.
+        """
+        
+        # GitHub Search API
+        url = "https://api.github.com/search/repositories"
+        params = {
+            "q": query.query,
+            "sort": "stars",
+            "order": "desc",
+            "per_page": min(query.max_results, 10)
+        }
         
-        try:
-            # GitHub Search API
-            url = "https://api.github.com/search/repositories"
-            params = {
-                "q": query.query,
-                "sort": "stars",
-                "order": "desc",
-                "per_page": min(query.max_results, 10)
-            }
+        headers = {
+            "Accept": "application/vnd.github.v3+json",
+            "User-Agent": "MCTS-ESV-Module"
+        }
+        
+        if cached:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+        
+        async with self.session.get(url, params=params, headers=headers, timeout=self._timeout) as response:
+            if response.status == 304 and cached:
+                return None, {}
             
-            headers = {
-                "Accept": "application/vnd.github.v3+json",
-                "User-Agent": "MCTS-ESV-Module"
-            }
+            if response.status == 200:
+                data = await response.json()
+                validators = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified")
+                }
+                return self._parse_github_results(data, query), validators
             
-            async with self.session.get(url, params=params, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return self._parse_github_results(data, query)
-                else:
-                    logger.warning(f"GitHub API returned {response.status}")
-                    return []
-                    
-        except Exception as e:
-            logger.error(f"GitHub search error: {str(e)}")
-            return []
+            raise ESVEngineError(f"GitHub API returned {response.status}")
     
     async def _search_google(self, query: SearchQuery) -> List[SearchResult]:
         """Tìm kiếm với Google Custom Search API (requires API key)"""
@@ -347,29 +495,22 @@ class ESVModule:
         search_engine_id = self.config.get("google_search_engine_id")
         
         if not api_key or not search_engine_id:
-            logger.info("Google API credentials not configured")
-            return []
+            raise ESVEngineError("Google API credentials not configured")
+        
+        url = self.search_engines["google"]["url"]
+        params = {
+            "key": api_key,
+            "cx": search_engine_id,
+            "q": query.query,
+            "num": min(query.max_results, 10)
+        }
         
-        try:
-            url = self.search_engines["google"]["url"]
-            params = {
-                "key": api_key,
-                "cx": search_engine_id,
-                "q": query.query,
-                "num": min(query.max_results, 10)
-            }
+        async with self.session.get(url, params=params, timeout=self._timeout) as response:
+            if response.status == 200:
+                data = await response.json()
+                return self._parse_google_results(data, query)
             
-            async with self.session.get(url, params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return self._parse_google_results(data, query)
-                else:
-                    logger.warning(f"Google API returned {response.status}")
-                    return []
-                    
-        except Exception as e:
-            logger.error(f"Google search error: {str(e)}")
-            return []
+            raise ESVEngineError(f"Google API returned {response.status}")
     
     async def _search_bing(self, query: SearchQuery) -> List[SearchResult]:
         """Tìm kiếm với Bing Search API (requires API key)"""
@@ -377,31 +518,24 @@ class ESVModule:
         api_key = self.config.get("bing_api_key")
         
         if not api_key:
-            logger.info("Bing API key not configured")
-            return []
+            raise ESVEngineError("Bing API key not configured")
         
-        try:
-            url = self.search_engines["bing"]["url"]
-            headers = {
-                "Ocp-Apim-Subscription-Key": api_key
-            }
-            params = {
-                "q": query.query,
-                "count": min(query.max_results, 10),
-                "responseFilter": "Webpages"
-            }
+        url = self.search_engines["bing"]["url"]
+        headers = {
+            "Ocp-Apim-Subscription-Key": api_key
+        }
+        params = {
+            "q": query.query,
+            "count": min(query.max_results, 10),
+            "responseFilter": "Webpages"
+        }
+        
+        async with self.session.get(url, params=params, headers=headers, timeout=self._timeout) as response:
+            if response.status == 200:
+                data = await response.json()
+                return self._parse_bing_results(data, query)
             
-            async with self.session.get(url, params=params, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return self._parse_bing_results(data, query)
-                else:
-                    logger.warning(f"Bing API returned {response.status}")
-                    return []
-                    
-        except Exception as e:
-            logger.error(f"Bing search error: {str(e)}")
-            return []
+            raise ESVEngineError(f"Bing API returned {response.status}")
     
     def _parse_duckduckgo_results(self, data: Dict[str, Any], query: SearchQuery) -> List[SearchResult]:
         """Parse DuckDuckGo results"""
@@ -589,24 +723,75 @@ class ESVModule:
             "key_findings": key_findings
         }
     
-    async def _enforce_rate_limit(self):
-        """Enforce rate limiting"""
-        
-        now = datetime.now()
-        last_request = self._last_request_time.get("global", datetime.min)
-        
-        time_since_last = (now - last_request).total_seconds()
-        min_interval = 1.0  # Minimum 1 second between requests
-        
-        if time_since_last < min_interval:
-            sleep_time = min_interval - time_since_last
-            await asyncio.sleep(sleep_time)
-        
-        self._last_request_time["global"] = datetime.now()
+    async def _retry_sleep(self, delay: float, attempt: int):
+        """Backoff giữa các lần thử, được ghi thành span riêng"""
+        with get_tracer().span("esv.retry_backoff", CATEGORY_RETRY, attempt=attempt, delay=delay):
+            await asyncio.sleep(delay)
+    
+    async def _acquire_engine(self, engine: str) -> float:
+        """Lấy token của engine (chờ nếu cần); trả về thời gian đã chờ"""
+        stats = self._engine_stats.setdefault(engine, {"requests": 0, "wait_time": 0.0})
+        stats["requests"] += 1
+        
+        bucket = self._engine_buckets.get(engine)
+        if bucket is None:
+            return 0.0
+        
+        waited = await bucket.take()
+        stats["wait_time"] += waited
+        return waited
+    
+    def get_coalescing_stats(self) -> Dict[str, Any]:
+        """Thống kê gộp query ESV đang bay (dùng chung trong event loop)"""
+        return get_shared_singleflight("esv").get_stats()
+    
+    def get_rate_limit_stats(self) -> Dict[str, Any]:
+        """Số request và tổng thời gian chờ token theo engine"""
+        return {
+            engine: {"requests": int(stats["requests"]), "wait_time": round(stats["wait_time"], 3)}
+            for engine, stats in self._engine_stats.items()
+        }
     
     def _get_cache_key(self, query: SearchQuery) -> str:
         """Tạo cache key cho query"""
-        return f"{query.query_type}:{hash(query.query)}"
+        # Digest ổn định giữa các process (hash() của str bị random hóa theo process)
+        digest = hashlib.sha1(query.query.encode("utf-8")).hexdigest()[:16]
+        return f"{query.query_type}:{digest}"
+    
+    def export_cache(self) -> Dict[str, Dict[str, Any]]:
+        """Serialize cache ra dict JSON (dùng cho checkpoint session)"""
+        return {
+            key: {
+                "query": result.query.__dict__,
+                "results": [_search_result_to_dict(r) for r in result.results],
+                "summary": result.summary,
+                "confidence": result.confidence,
+                "validation_status": result.validation_status,
+                "key_findings": result.key_findings,
+                "sources_count": result.sources_count,
+                "processed_at": result.processed_at.isoformat()
+            }
+            for key, result in self._cache.items()
+        }
+    
+    def import_cache(self, entries: Dict[str, Dict[str, Any]]):
+        """Nạp lại cache đã export (không ghi đè entries đang có)"""
+        for key, data in entries.items():
+            if key in self._cache:
+                continue
+            try:
+                self._cache[key] = ValidationResult(
+                    query=SearchQuery(**data["query"]),
+                    results=[_search_result_from_dict(r) for r in data.get("results", [])],
+                    summary=data["summary"],
+                    confidence=data["confidence"],
+                    validation_status=data["validation_status"],
+                    key_findings=data.get("key_findings", []),
+                    sources_count=data.get("sources_count", 0),
+                    processed_at=datetime.fromisoformat(data["processed_at"])
+                )
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning(f"Skipping invalid ESV cache entry {key}: {str(e)}")
     
     def clear_cache(self):
         """Xóa cache"""
@@ -617,7 +802,8 @@ class ESVModule:
         """Lấy thống kê cache"""
         return {
             "cache_size": len(self._cache),
-            "cached_queries": list(self._cache.keys())[:10]  # Show first 10
+            "cached_queries": list(self._cache.keys())[:10],  # Show first 10
+            "persistent": self.result_cache.get_stats() if self.result_cache else {}
         }
 
 # Helper functions
@@ -636,25 +822,8 @@ def create_search_query(query: str,
     )
 
 def extract_keywords_from_text(text: str, max_keywords: int = 5) -> List[str]:
-    """Extract keywords từ text để tạo search queries"""
-    
-    # Simple keyword extraction
-    words = re.findall(r'\b[a-zA-Z]{3,}\b', text.lower())
-    
-    # Filter out common words
-    stop_words = {"the", "and", "for", "are", "but", "not", "you", "all", "can", "her", "was", "one", "our", "had", "have", "what", "there", "said", "each", "which", "their", "time", "will", "about", "would", "has", "its", "who", "oil", "sit", "now", "find", "down", "way", "been", "may", "new", "use", "she", "see", "him", "two", "how", "more", "get", "very", "man", "day", "made", "they", "these", "could", "well", "were"}
-    
-    keywords = [word for word in words if word not in stop_words and len(word) > 3]
-    
-    # Count frequency
-    keyword_freq = {}
-    for keyword in keywords:
-        keyword_freq[keyword] = keyword_freq.get(keyword, 0) + 1
-    
-    # Sort by frequency
-    sorted_keywords = sorted(keyword_freq.items(), key=lambda x: x[1], reverse=True)
-    
-    return [keyword for keyword, freq in sorted_keywords[:max_keywords]]
+    """Extract keywords từ text để tạo search queries (không có IDF corpus, xem KeywordExtractor)"""
+    return get_default_extractor().extract(text, max_keywords=max_keywords)
 
 # Test function
 async def test_esv_module():
@@ -0,0 +1,221 @@
+"""
+Feedback Compressor - Nén trích xuất (extractive) phản hồi chuyển giữa các agent
+Chấm điểm từng câu/dòng theo tín hiệu (điểm số, cờ đỏ, con số, action items), giữ các đơn vị
+có điểm cao nhất theo tỉ lệ mục tiêu và ghép lại theo thứ tự gốc kèm heading của chúng.
+Không gọi LLM, kết quả ổn định và được cache theo hash nội dung
+"""
+
+import re
+import hashlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Any, Tuple
+
+from backend.core.token_estimator import estimate_tokens, truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+_HEADING_PATTERN = re.compile(r"^\s*(#{1,6})\s+\S")
+_LABEL_PATTERN = re.compile(r"^\*\*[^*]{1,60}:?\*\*:?$")  # Dòng nhãn kiểu "**Đề xuất cải thiện:**"
+_LABEL_LEVEL = 7
+_LIST_ITEM_PATTERN = re.compile(r"^\s*(?:[-*•+]|\d+[.)])\s+")
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+(?=[A-ZÀ-Ỹ0-9*\"“])")
+
+_SCORE_PATTERN = re.compile(r"\d+(?:[.,]\d+)?\s*/\s*10\b|\bđiểm\b|\bscore\b", re.IGNORECASE)
+_RED_FLAG_PATTERN = re.compile(
+    r"red flag|cờ đỏ|🚩|🔴|critical|chí mạng|nghiêm trọng|rủi ro|risk|lỗ hổng|điểm yếu|weakness|"
+    r"thất bại|fail|thiếu|không khả thi|mâu thuẫn|sai lầm|flaw",
+    re.IGNORECASE
+)
+_ACTION_PATTERN = re.compile(
+    r"\bcần\b|\bnên\b|\bphải\b|đề xuất|khuyến nghị|cải thiện|bổ sung|làm rõ|ưu tiên|"
+    r"recommend|should|must|action|fix|mitigat",
+    re.IGNORECASE
+)
+_NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)*\s*(?:%|\$|usd|vnđ|đ|k|m|tr|tỷ|triệu|năm|tháng)?", re.IGNORECASE)
+_FILLER_PATTERN = re.compile(
+    r"^(?:tóm lại|nhìn chung|nói chung|như đã (?:nói|đề cập)|rõ ràng là|có thể thấy|"
+    r"in conclusion|overall|in summary|it is clear)",
+    re.IGNORECASE
+)
+
+@dataclass
+class _Unit:
+    """Một câu/dòng của text gốc"""
+    position: int
+    text: str
+    headings: Tuple[int, ...]  # position của các heading/nhãn chứa đơn vị này (ngoài vào trong)
+    is_heading: bool
+    tokens: int
+    score: float = 0.0
+
+class FeedbackCompressor:
+    """
+    Nén extractive theo tỉ lệ token mục tiêu.
+
+    Đơn vị được chọn tham lam theo điểm / sqrt(token) (ưu tiên câu ngắn nhiều thông tin),
+    đơn vị trùng nội dung bị bỏ. Text ngắn hơn min_tokens được giữ nguyên.
+    """
+
+    def __init__(self,
+                 target_ratio: float = 0.35,
+                 min_tokens: int = 300,
+                 max_cache_entries: int = 256):
+        self.target_ratio = target_ratio
+        self.min_tokens = min_tokens
+        self.max_cache_entries = max_cache_entries
+
+        # hash(text, target) -> text đã nén
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+
+        # Metrics
+        self.compressions = 0
+        self.cache_hits = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def compress(self,
+                 text: str,
+                 target_ratio: Optional[float] = None,
+                 max_tokens: Optional[int] = None) -> str:
+        """
+        Nén text còn khoảng target_ratio số token (và không quá max_tokens nếu có).
+
+        target_ratio <= 0 hoặc >= 1 chỉ giới hạn theo max_tokens.
+        """
+        if not text or not text.strip():
+            return text or ""
+
+        ratio = self.target_ratio if target_ratio is None else target_ratio
+        input_tokens = estimate_tokens(text)
+
+        target = input_tokens
+        if 0 < ratio < 1 and input_tokens > self.min_tokens:
+            target = max(self.min_tokens, int(input_tokens * ratio))
+        if max_tokens is not None:
+            target = min(target, max(0, max_tokens))
+
+        if target >= input_tokens:
+            self._record(input_tokens, text)
+            return text
+
+        key = hashlib.blake2b(f"{target}\x00{text}".encode("utf-8"), digest_size=16).hexdigest()
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            self._record(input_tokens, cached)
+            return cached
+
+        compressed = self._extract(text, target)
+        self._cache[key] = compressed
+        if len(self._cache) > self.max_cache_entries:
+            self._cache.popitem(last=False)
+
+        self.compressions += 1
+        self._record(input_tokens, compressed)
+        logger.debug(f"Compressed feedback: {input_tokens} -> {estimate_tokens(compressed)} tokens")
+        return compressed
+
+    def _record(self, input_tokens: int, compressed: str):
+        self.input_tokens += input_tokens
+        self.output_tokens += estimate_tokens(compressed)
+
+    def _split_units(self, text: str) -> List[_Unit]:
+        """Tách dòng; dòng dài (đoạn văn) được tách tiếp thành câu. Heading và dòng nhãn mở section"""
+        units: List[_Unit] = []
+        stack: List[Tuple[int, int]] = []  # (level, position) của các heading đang mở
+
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or set(line) <= set("-=*_|"):
+                continue
+
+            heading_match = _HEADING_PATTERN.match(line)
+            level = len(heading_match.group(1)) if heading_match else (_LABEL_LEVEL if _LABEL_PATTERN.match(line) else 0)
+            if level:
+                while stack and stack[-1][0] >= level:
+                    stack.pop()
+                units.append(_Unit(len(units), line, tuple(p for _, p in stack), True, estimate_tokens(line) + 1))
+                stack.append((level, len(units) - 1))
+                continue
+
+            headings = tuple(p for _, p in stack)
+            parts = [line] if _LIST_ITEM_PATTERN.match(line) and len(line) < 300 else _SENTENCE_SPLIT.split(line)
+            for part in parts:
+                part = part.strip()
+                if part:
+                    units.append(_Unit(len(units), part, headings, False, estimate_tokens(part) + 1))
+
+        return units
+
+    @staticmethod
+    def _score(unit: _Unit) -> float:
+        text = unit.text
+        score = 0.0
+
+        if _SCORE_PATTERN.search(text):
+            score += 3.0
+        if _RED_FLAG_PATTERN.search(text):
+            score += 2.5
+        if _ACTION_PATTERN.search(text):
+            score += 2.0
+        score += min(3, len(_NUMBER_PATTERN.findall(text))) * 0.75
+        if _LIST_ITEM_PATTERN.match(text):
+            score += 0.5
+        if "**" in text:
+            score += 0.5
+
+        stripped = _LIST_ITEM_PATTERN.sub("", text).lstrip("*").strip()
+        if _FILLER_PATTERN.match(stripped):
+            score -= 1.5
+        if len(stripped.split()) < 4 and not any(ch.isdigit() for ch in stripped):
+            score -= 1.0
+
+        return score
+
+    def _extract(self, text: str, target: int) -> str:
+        units = self._split_units(text)
+        for unit in units:
+            unit.score = self._score(unit)
+
+        # Heading chỉ được chọn riêng khi mang con số (vd. "#### 1. TÍNH LOGIC: 5/10")
+        candidates = sorted(
+            (u for u in units if u.score > 0 and (not u.is_heading or _NUMBER_PATTERN.search(u.text))),
+            key=lambda u: (-u.score / u.tokens ** 0.5, u.position)
+        )
+
+        selected: Dict[int, _Unit] = {}
+        seen = set()
+        used = 0
+        for unit in candidates:
+            normalized = " ".join(re.sub(r"[^\w\s]", " ", unit.text.lower()).split())
+            if unit.position in selected or normalized in seen:
+                continue
+
+            # Heading/nhãn của section được giữ lại cùng đơn vị đầu tiên được chọn trong section
+            missing = [units[p] for p in unit.headings if p not in selected]
+            cost = unit.tokens + sum(h.tokens for h in missing)
+            if used + cost > target:
+                continue
+
+            seen.add(normalized)
+            for chosen in missing + [unit]:
+                selected[chosen.position] = chosen
+            used += cost
+
+        if not selected:
+            return truncate_to_tokens(text, target)
+
+        return "\n".join(selected[position].text for position in sorted(selected))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê nén"""
+        return {
+            "compressions": self.compressions,
+            "cache_hits": self.cache_hits,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "ratio": round(self.output_tokens / self.input_tokens, 3) if self.input_tokens else 1.0
+        }
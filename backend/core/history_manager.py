@@ -0,0 +1,197 @@
+"""
+Conversation History Manager - Giới hạn token của conversation history cho agents
+Giữ system prompt + N lượt gần nhất, các lượt cũ được thay bằng digest có cấu trúc
+"""
+
+import re
+import hashlib
+import logging
+from typing import Dict, List, Optional, Any, Tuple
+
+from backend.core.llm_client import LLMMessage
+from backend.core.token_estimator import estimate_messages_tokens
+
+logger = logging.getLogger(__name__)
+
+DIGEST_HEADER = "## TÓM TẮT CÁC VÒNG TRƯỚC (đã rút gọn)"
+DIGEST_ACK = "Đã ghi nhận tóm tắt các vòng trước."
+
+# Các dòng đáng giữ lại trong digest: heading, điểm số, cờ đỏ, quyết định, action items
+_KEY_LINE_PATTERN = re.compile(
+    r"^\s*#{1,4}\s|\d+(?:\.\d+)?\s*/\s*10|red flag|cờ đỏ|🔴|critical|chí mạng|"
+    r"decision|quyết định|action|đề xuất|khuyến nghị|ưu tiên|urgent",
+    re.IGNORECASE
+)
+
+class ConversationHistoryManager:
+    """
+    Compact conversation history theo token budget.
+
+    History có dạng [system, user, assistant, user, assistant, ...]. Khi vượt budget,
+    các lượt (user, assistant) cũ được gộp thành một cặp digest ngay sau system prompt.
+    """
+
+    def __init__(self,
+                 token_budget: int,
+                 keep_last_turns: int = 2,
+                 digest_chars_per_turn: int = 800,
+                 max_digest_chars: int = 4000):
+        self.token_budget = token_budget
+        self.keep_last_turns = max(1, keep_last_turns)
+        self.digest_chars_per_turn = digest_chars_per_turn
+        self.max_digest_chars = max_digest_chars
+
+        # Cache digest theo hash nội dung của lượt
+        self._digest_cache: Dict[str, str] = {}
+
+        # Metrics
+        self.compactions = 0
+        self.removed_tokens = 0  # Tổng token đã bị loại khỏi history lưu trữ
+        self.tokens_saved = 0  # Tổng token không phải gửi lại qua tất cả các call
+
+    def compact(self,
+                history: List[LLMMessage],
+                reserve_tokens: int = 0,
+                token_budget: Optional[int] = None) -> List[LLMMessage]:
+        """
+        Trả về history đã compact sao cho history + reserve_tokens nằm trong budget.
+
+        reserve_tokens là phần dành cho message mới sắp gửi kèm history; token_budget
+        (nếu có) siết budget cho call này, vd. theo context window còn lại.
+        """
+        if len(history) < 2:
+            return history
+
+        budget = min(self.token_budget, token_budget) if token_budget else self.token_budget
+        current_tokens = estimate_messages_tokens(history)
+
+        if current_tokens + reserve_tokens > budget:
+            history = self._compact_turns(history, reserve_tokens, budget)
+            new_tokens = estimate_messages_tokens(history)
+
+            if new_tokens < current_tokens:
+                self.compactions += 1
+                self.removed_tokens += current_tokens - new_tokens
+                logger.info(f"Compacted conversation history: {current_tokens} -> {new_tokens} tokens")
+
+        # Mỗi call sau compaction đều tránh gửi lại phần token đã loại bỏ
+        self.tokens_saved += self.removed_tokens
+
+        return history
+
+    def _compact_turns(self,
+                       history: List[LLMMessage],
+                       reserve_tokens: int,
+                       budget: int) -> List[LLMMessage]:
+        """Gộp các lượt cũ thành digest, giảm dần số lượt giữ lại tới khi vừa budget"""
+        system_message = history[0] if history[0].role == "system" else None
+        body = history[1:] if system_message else history
+
+        previous_digest, turns = self._split_turns(body)
+
+        keep = min(self.keep_last_turns, len(turns))
+        compacted = history
+
+        while keep >= 1:
+            old_turns = turns[:-keep]
+            kept_turns = turns[-keep:]
+
+            digest = self._build_digest(previous_digest, old_turns)
+
+            compacted = [system_message] if system_message else []
+            if digest:
+                compacted.append(LLMMessage(role="user", content=f"{DIGEST_HEADER}\n\n{digest}"))
+                compacted.append(LLMMessage(role="assistant", content=DIGEST_ACK))
+            for turn in kept_turns:
+                compacted.extend(turn)
+
+            if estimate_messages_tokens(compacted) + reserve_tokens <= budget:
+                break
+            keep -= 1
+
+        return compacted
+
+    def _split_turns(self, body: List[LLMMessage]) -> Tuple[str, List[List[LLMMessage]]]:
+        """Tách digest cũ (nếu có) và nhóm messages thành các lượt user/assistant"""
+        previous_digest = ""
+
+        if len(body) >= 2 and body[0].role == "user" and body[0].content.startswith(DIGEST_HEADER):
+            previous_digest = body[0].content[len(DIGEST_HEADER):].strip()
+            body = body[2:]
+
+        turns: List[List[LLMMessage]] = []
+        for message in body:
+            if message.role == "user" or not turns:
+                turns.append([message])
+            else:
+                turns[-1].append(message)
+
+        return previous_digest, turns
+
+    def _build_digest(self, previous_digest: str, old_turns: List[List[LLMMessage]]) -> str:
+        """Tạo digest từ digest trước + các lượt cũ, giữ phần mới nhất khi vượt giới hạn"""
+        entries = [previous_digest] if previous_digest else []
+        entries.extend(self._digest_turn(turn) for turn in old_turns)
+
+        digest = "\n\n".join(entry for entry in entries if entry)
+
+        if len(digest) > self.max_digest_chars:
+            digest = "...\n" + digest[-self.max_digest_chars:]
+
+        return digest
+
+    def _digest_turn(self, turn: List[LLMMessage]) -> str:
+        """Digest có cấu trúc cho một lượt: tiêu đề yêu cầu + các dòng quan trọng của reply"""
+        raw = "\n".join(f"{m.role}:{m.content}" for m in turn)
+        cache_key = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+        if cache_key in self._digest_cache:
+            return self._digest_cache[cache_key]
+
+        request_title = ""
+        reply_lines: List[str] = []
+
+        for message in turn:
+            if message.role == "user":
+                request_title = next(
+                    (line.strip("# ").strip() for line in message.content.splitlines() if line.strip()),
+                    ""
+                )
+            elif message.role == "assistant":
+                reply_lines.extend(self._extract_key_lines(message.content))
+
+        digest = f"### {request_title[:150]}\n" + "\n".join(reply_lines)
+        if len(digest) > self.digest_chars_per_turn:
+            digest = digest[:self.digest_chars_per_turn].rstrip() + "..."
+
+        self._digest_cache[cache_key] = digest
+        return digest
+
+    def _extract_key_lines(self, content: str) -> List[str]:
+        """Lấy các dòng mang thông tin chính (heading, điểm số, cờ đỏ, quyết định)"""
+        lines = []
+        in_metadata = False
+
+        for line in content.splitlines():
+            stripped = line.strip()
+            if stripped == "<!-- METADATA -->":
+                in_metadata = True
+                continue
+            if stripped == "<!-- END METADATA -->":
+                in_metadata = False
+                continue
+            if in_metadata or not stripped:
+                continue
+            if _KEY_LINE_PATTERN.search(stripped) and stripped[:200] not in lines:
+                lines.append(stripped[:200])
+
+        return lines
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Lấy metrics của history manager"""
+        return {
+            "token_budget": self.token_budget,
+            "compactions": self.compactions,
+            "tokens_removed": self.removed_tokens,
+            "tokens_saved": self.tokens_saved
+        }
@@ -0,0 +1,93 @@
+"""
+HTTP Transport - Connection pool aiohttp dùng chung cho LLM client, ESV và các components khác
+Một ClientSession duy nhất với keep-alive, giới hạn connection và cache DNS
+"""
+
+import logging
+from typing import Dict, Optional, Any
+
+import aiohttp
+
+from backend.config import HTTPPoolConfig
+
+logger = logging.getLogger(__name__)
+
+class HTTPTransport:
+    """
+    Pooled HTTP transport, được inject vào các components thay vì mỗi nơi tự mở session.
+
+    Components nhận transport không đóng session; chỉ owner (nơi tạo transport) gọi close().
+    Timeout và headers được truyền theo từng request.
+    """
+
+    def __init__(self, config: Optional[HTTPPoolConfig] = None):
+        self.config = config or HTTPPoolConfig()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._connector: Optional[aiohttp.TCPConnector] = None
+
+        # Số session đã mở trong suốt vòng đời transport (để theo dõi reuse)
+        self.sessions_opened = 0
+
+    async def __aenter__(self):
+        """Async context manager entry"""
+        await self.get_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        """Async context manager exit"""
+        await self.close()
+
+    @property
+    def closed(self) -> bool:
+        return self._session is None or self._session.closed
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Lấy session dùng chung, tạo mới nếu chưa có hoặc đã bị đóng"""
+        if self.closed:
+            self._connector = aiohttp.TCPConnector(
+                limit=self.config.connector_limit,
+                limit_per_host=self.config.limit_per_host,
+                keepalive_timeout=self.config.keepalive_timeout,
+                use_dns_cache=True,
+                ttl_dns_cache=self.config.dns_cache_ttl
+            )
+            # Không đặt timeout mặc định: mỗi component tự truyền timeout theo request
+            self._session = aiohttp.ClientSession(
+                connector=self._connector,
+                timeout=aiohttp.ClientTimeout(total=None)
+            )
+            self.sessions_opened += 1
+            logger.info(
+                f"HTTP transport started (limit={self.config.connector_limit}, "
+                f"per_host={self.config.limit_per_host})"
+            )
+
+        return self._session
+
+    async def close(self):
+        """Đóng session và toàn bộ connection trong pool"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._connector = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê connection pool"""
+        stats: Dict[str, Any] = {
+            "connector_limit": self.config.connector_limit,
+            "limit_per_host": self.config.limit_per_host,
+            "sessions_opened": self.sessions_opened,
+            "open_connections": 0,
+            "idle_connections": 0
+        }
+
+        if self._connector and not self._connector.closed:
+            # Các thuộc tính nội bộ của aiohttp; chỉ dùng cho monitoring
+            acquired = getattr(self._connector, "_acquired", None)
+            conns = getattr(self._connector, "_conns", None)
+            if acquired is not None:
+                stats["open_connections"] = len(acquired)
+            if conns is not None:
+                stats["idle_connections"] = sum(len(v) for v in conns.values())
+
+        return stats
@@ -0,0 +1,254 @@
+"""
+Idea Index - Chỉ mục near-duplicate (MinHash/LSH) của mọi ý tưởng đã tạo, lưu trên đĩa (SQLite WAL)
+Mỗi ý tưởng (tên, đối tượng khách hàng, mô hình kinh doanh, giải pháp) được băm thành chữ ký
+MinHash; tra cứu chỉ đọc các bucket LSH có index nên không phụ thuộc số ý tưởng đã lưu
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from array import array
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Any, Iterable, Set, Tuple
+
+from backend.core.keyword_extractor import tokenize
+from backend.core.idea_model import Idea, IDEA_FIELDS
+
+logger = logging.getLogger(__name__)
+
+_MAX_HASH = (1 << 32) - 1
+
+@dataclass
+class IdeaMatch:
+    """Một ý tưởng đã lưu gần trùng với ý tưởng được tra cứu"""
+    idea_id: str
+    name: str
+    session_id: str
+    iteration: int
+    similarity: float  # Jaccard ước lượng từ chữ ký MinHash
+
+def idea_shingles(idea: Idea) -> Set[str]:
+    """Token và bigram của từng field, gắn prefix field để field khác nhau không khớp nhau"""
+    shingles = set()
+
+    for field_name in IDEA_FIELDS:
+        tokens = tokenize(getattr(idea, field_name))
+        shingles.update(f"{field_name}:{token}" for token in tokens)
+        shingles.update(f"{field_name}:{a} {b}" for a, b in zip(tokens, tokens[1:]))
+
+    return shingles
+
+class MinHasher:
+    """
+    Chữ ký MinHash với num_perm hàm băm 32-bit.
+
+    Mỗi shingle được băm một lần bằng SHAKE-128 lấy num_perm * 4 byte (mỗi 4 byte là giá trị
+    của một hàm băm); min theo từng vị trí được tính trên một array duy nhất bằng slicing,
+    không có vòng lặp Python theo từng phần tử. Không có seed nên chữ ký ổn định giữa các process.
+    """
+
+    def __init__(self, num_perm: int = 64):
+        self.num_perm = num_perm
+        self._digest_size = num_perm * 4
+
+    def signature(self, shingles: Iterable[str]) -> List[int]:
+        digests = [hashlib.shake_128(s.encode("utf-8")).digest(self._digest_size) for s in shingles]
+
+        if not digests:
+            return [_MAX_HASH] * self.num_perm
+
+        values = array("I", b"".join(digests))
+        return [min(values[i::self.num_perm]) for i in range(self.num_perm)]
+
+class IdeaIndex:
+    """
+    Chỉ mục LSH (bands x rows) trên chữ ký MinHash.
+
+    Hai ý tưởng có Jaccard s rơi chung ít nhất một bucket với xác suất 1 - (1 - s^rows)^bands;
+    với 16 x 4 ngưỡng hiệu dụng khoảng 0.5. Ứng viên được lọc lại bằng Jaccard ước lượng.
+    """
+
+    def __init__(self,
+                 db_path: str,
+                 num_perm: int = 64,
+                 bands: int = 16,
+                 threshold: float = 0.6):
+        if num_perm % bands != 0:
+            raise ValueError("num_perm phải chia hết cho bands")
+
+        self.db_path = db_path
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm)
+
+        # Counters
+        self.inserts = 0
+        self.queries = 0
+        self.candidates = 0
+        self.matches = 0
+        self.query_time = 0.0
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS ideas (
+                id TEXT PRIMARY KEY,
+                session_id TEXT NOT NULL,
+                iteration INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                audience TEXT NOT NULL,
+                business_model TEXT NOT NULL,
+                solution TEXT NOT NULL,
+                signature BLOB NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS idea_lsh (
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                idea_id TEXT NOT NULL,
+                PRIMARY KEY (band, bucket, idea_id)
+            ) WITHOUT ROWID
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def make_id(session_id: str, iteration: int, position: int) -> str:
+        """ID ổn định theo vị trí, để resume/chèn lại cùng vòng không tạo bản ghi trùng"""
+        return hashlib.sha1(f"{session_id}:{iteration}:{position}".encode("utf-8")).hexdigest()[:20]
+
+    def _band_buckets(self, signature: List[int]) -> List[Tuple[int, int]]:
+        buckets = []
+        for band in range(self.bands):
+            chunk = array("I", signature[band * self.rows:(band + 1) * self.rows]).tobytes()
+            digest = hashlib.blake2b(chunk, digest_size=8).digest()
+            buckets.append((band, int.from_bytes(digest, "little", signed=True)))
+        return buckets
+
+    def _insert(self, idea_id: str, idea: Idea, session_id: str, iteration: int) -> bool:
+        signature = self.hasher.signature(idea_shingles(idea))
+
+        cursor = self._conn.execute(
+            """
+            INSERT OR IGNORE INTO ideas
+                (id, session_id, iteration, name, audience, business_model, solution, signature, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (idea_id, session_id, iteration,
+             *[getattr(idea, field_name) for field_name in IDEA_FIELDS],
+             array("I", signature).tobytes(), time.time())
+        )
+        if cursor.rowcount == 0:
+            return False
+
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO idea_lsh (band, bucket, idea_id) VALUES (?, ?, ?)",
+            [(band, bucket, idea_id) for band, bucket in self._band_buckets(signature)]
+        )
+        self.inserts += 1
+        return True
+
+    def add(self, idea_id: str, idea: Idea, session_id: str, iteration: int) -> bool:
+        """Chèn một ý tưởng; trả về False nếu id đã có"""
+        return self.add_many([idea], session_id, iteration, ids=[idea_id]) == 1
+
+    def add_many(self,
+                 ideas: List[Idea],
+                 session_id: str,
+                 iteration: int,
+                 ids: Optional[List[str]] = None) -> int:
+        """Chèn các ý tưởng của một vòng trong một transaction; trả về số ý tưởng mới"""
+        ids = ids or [self.make_id(session_id, iteration, position) for position in range(len(ideas))]
+
+        try:
+            added = sum(
+                1 for idea_id, idea in zip(ids, ideas)
+                if self._insert(idea_id, idea, session_id, iteration)
+            )
+            self._conn.commit()
+            return added
+
+        except sqlite3.Error as e:
+            logger.warning(f"Idea index write error: {str(e)}")
+            self._conn.rollback()
+            return 0
+
+    def query(self,
+              idea: Idea,
+              threshold: Optional[float] = None,
+              exclude_session: Optional[str] = None,
+              limit: int = 5) -> List[IdeaMatch]:
+        """Các ý tưởng đã lưu gần trùng (Jaccard ước lượng >= threshold), giảm dần theo similarity"""
+        started = time.perf_counter()
+        threshold = self.threshold if threshold is None else threshold
+        signature = self.hasher.signature(idea_shingles(idea))
+        matches: List[IdeaMatch] = []
+
+        try:
+            candidate_ids = set()
+            for band, bucket in self._band_buckets(signature):
+                candidate_ids.update(
+                    row[0] for row in self._conn.execute(
+                        "SELECT idea_id FROM idea_lsh WHERE band = ? AND bucket = ?", (band, bucket)
+                    )
+                )
+            self.candidates += len(candidate_ids)
+
+            if candidate_ids:
+                placeholders = ",".join("?" * len(candidate_ids))
+                rows = self._conn.execute(
+                    f"SELECT id, name, session_id, iteration, signature FROM ideas WHERE id IN ({placeholders})",
+                    list(candidate_ids)
+                ).fetchall()
+
+                for idea_id, name, session_id, iteration, blob in rows:
+                    if exclude_session and session_id == exclude_session:
+                        continue
+                    stored = array("I")
+                    stored.frombytes(blob)
+                    similarity = sum(1 for x, y in zip(signature, stored) if x == y) / len(signature)
+                    if similarity >= threshold:
+                        matches.append(IdeaMatch(idea_id, name, session_id, iteration, round(similarity, 3)))
+
+        except sqlite3.Error as e:
+            logger.warning(f"Idea index read error: {str(e)}")
+
+        matches.sort(key=lambda m: m.similarity, reverse=True)
+        self.queries += 1
+        self.matches += len(matches)
+        self.query_time += time.perf_counter() - started
+
+        return matches[:limit]
+
+    def count(self) -> int:
+        try:
+            return self._conn.execute("SELECT COUNT(*) FROM ideas").fetchone()[0]
+        except sqlite3.Error:
+            return -1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê index"""
+        return {
+            "entries": self.count(),
+            "inserts": self.inserts,
+            "queries": self.queries,
+            "candidates": self.candidates,
+            "matches": self.matches,
+            "avg_query_ms": round(self.query_time / self.queries * 1000, 3) if self.queries else 0.0
+        }
+
+    def close(self):
+        """Đóng kết nối SQLite"""
+        try:
+            self._conn.close()
+        except sqlite3.Error:
+            pass
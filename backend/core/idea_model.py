@@ -0,0 +1,308 @@
+"""
+Idea Model - Bản ghi Idea chuẩn, parse một lần từ output của Primary Agent
+Parser đọc từng dòng (dùng được với output streaming); mỗi Idea có ID ổn định theo tên và hash
+nội dung theo từng field, đi cùng AgentInput, ESV, chấm điểm và session đã lưu
+"""
+
+import hashlib
+import logging
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Any, Tuple
+
+from backend.core.keyword_extractor import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Các field nội dung của ý tưởng (thứ tự của field_hashes)
+IDEA_FIELDS = ("name", "audience", "business_model", "solution")
+
+_MAX_NAME_CHARS = 120
+_MAX_FIELD_CHARS = 300
+_MAX_CONTINUATION_LINES = 3
+
+# Nhãn field trong markdown (chữ thường) -> field
+FIELD_LABELS = {
+    "tên ý tưởng": "name",
+    "idea name": "name",
+    "target market": "audience",
+    "target audience": "audience",
+    "khách hàng mục tiêu": "audience",
+    "đối tượng khách hàng": "audience",
+    "thị trường mục tiêu": "audience",
+    "business model": "business_model",
+    "revenue model": "business_model",
+    "mô hình kinh doanh": "business_model",
+    "mô hình doanh thu": "business_model",
+    "solution": "solution",
+    "proposed solution": "solution",
+    "giải pháp": "solution",
+    "giải pháp đề xuất": "solution"
+}
+
+# Heading bắt đầu một ý tưởng: "## 1.", "#### 2. Tên", "## Tên ...", "### TÊN ..."
+_HEADING_PATTERN = re.compile(r"^\s*#{2,4}\s*(?:\d+\.|Tên\b|TÊN\b)")
+_HEADING_PREFIX_PATTERN = re.compile(r"^\s*#{2,4}\s*(?:\d+\.)?\s*")
+_NAME_PREFIX_PATTERN = re.compile(r"^(?:tên\s*ý\s*tưởng|tên|ý\s*tưởng\s*\d*)\s*[:\-–]\s*", re.IGNORECASE)
+_LABEL_PATTERN = re.compile(r"^([^:]{2,40}):\s*(.*)$")
+_METADATA_START_PATTERN = re.compile(r"<!--\s*METADATA\s*-->")
+_METADATA_END_PATTERN = re.compile(r"<!--\s*END METADATA\s*-->")
+_UNIQUE_TAG_PATTERN = re.compile(r"\s*\[UNIQUE[^\]]*\]", re.IGNORECASE)
+_BULLET_PATTERN = re.compile(r"^(?:[-•*+]|\d+\.)\s")
+_BULLET_CHARS = "-•*+ \t"
+_POSITION_PREFIX_PATTERN = re.compile(r"^(\s*#{2,4}\s*)\d+\.\s*")
+
+def content_hash(text: str) -> str:
+    """Hash ngắn của nội dung đã chuẩn hóa (bỏ khác biệt hoa/thường, khoảng trắng)"""
+    return hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=8).hexdigest()
+
+def make_idea_id(name: str) -> str:
+    """ID ổn định theo tên: ý tưởng giữ tên qua các vòng cải thiện giữ nguyên ID"""
+    return "idea-" + content_hash(name)[:10]
+
+def body_hash(text: str) -> str:
+    """content_hash của markdown ý tưởng bỏ số thứ tự ở heading ("#### 2. Tên" -> "#### Tên")"""
+    return content_hash(_POSITION_PREFIX_PATTERN.sub(r"\1", text, count=1))
+
+@dataclass(frozen=True, slots=True)
+class Idea:
+    """Một ý tưởng startup từ output của Primary Agent"""
+    id: str
+    position: int
+    name: str
+    audience: str
+    business_model: str
+    solution: str
+    text: str  # Markdown đầy đủ của ý tưởng (heading + chi tiết)
+    field_hashes: Tuple[str, ...]  # content_hash của từng field trong IDEA_FIELDS
+    text_hash: str  # content_hash của text
+    body_hash: str  # content_hash của text bỏ số thứ tự: khóa cache cho các đánh giá theo ý tưởng
+
+    @classmethod
+    def create(cls,
+               position: int,
+               name: str,
+               audience: str = "",
+               business_model: str = "",
+               solution: str = "",
+               text: str = "",
+               idea_id: Optional[str] = None) -> "Idea":
+        values = (name, audience, business_model, solution)
+        return cls(
+            id=idea_id or make_idea_id(name),
+            position=position,
+            name=name,
+            audience=audience,
+            business_model=business_model,
+            solution=solution,
+            text=text,
+            field_hashes=tuple(content_hash(value) for value in values),
+            text_hash=content_hash(text),
+            body_hash=body_hash(text)
+        )
+
+    def field_hash(self, field_name: str) -> str:
+        return self.field_hashes[IDEA_FIELDS.index(field_name)]
+
+    def changed_fields(self, other: "Idea") -> List[str]:
+        """Các field khác nội dung so với một phiên bản khác của ý tưởng"""
+        return [
+            field_name for field_name, a, b in zip(IDEA_FIELDS, self.field_hashes, other.field_hashes)
+            if a != b
+        ]
+
+    def ref(self) -> Dict[str, str]:
+        """Tham chiếu gọn (id + tên) để đưa vào ngữ cảnh prompt"""
+        return {"id": self.id, "name": self.name}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "position": self.position,
+            "name": self.name,
+            "audience": self.audience,
+            "business_model": self.business_model,
+            "solution": self.solution,
+            "text": self.text,
+            "field_hashes": list(self.field_hashes),
+            "text_hash": self.text_hash,
+            "body_hash": self.body_hash
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Idea":
+        # Hash được tính lại từ nội dung để bản ghi cũ/thiếu hash vẫn dùng được
+        return cls.create(
+            position=data.get("position", 0),
+            name=data.get("name", ""),
+            audience=data.get("audience", ""),
+            business_model=data.get("business_model", ""),
+            solution=data.get("solution", ""),
+            text=data.get("text", ""),
+            idea_id=data.get("id")
+        )
+
+class IdeaStreamParser:
+    """
+    Parser markdown ý tưởng theo dòng.
+
+    feed() nhận từng đoạn text (vd. delta khi streaming) và trả về các ý tưởng đã hoàn tất
+    (ý tưởng kết thúc khi heading của ý tưởng tiếp theo xuất hiện); close() trả về phần còn lại.
+    Phần mở đầu trước heading đầu tiên và block METADATA của agent được bỏ qua.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._in_metadata = False
+        self._count = 0
+        self._seen_ids: Dict[str, int] = {}
+
+        # Ý tưởng đang đọc
+        self._lines: List[str] = []
+        self._fields: Dict[str, str] = {}
+        self._pending_field: Optional[str] = None
+        self._pending_lines = 0
+        self._heading_name = ""
+
+        # Nội dung trước heading đầu tiên (dùng khi output không có heading nào)
+        self._preamble: List[str] = []
+        self._preamble_fields: Dict[str, str] = {}
+
+    def feed(self, text: str) -> List[Idea]:
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split("\n")
+        return [idea for idea in (self._feed_line(line) for line in lines) if idea]
+
+    def close(self) -> List[Idea]:
+        ideas = []
+        if self._buffer:
+            idea = self._feed_line(self._buffer)
+            self._buffer = ""
+            if idea:
+                ideas.append(idea)
+
+        if self._heading_name or self._lines:
+            idea = self._finish_idea()
+            if idea:
+                ideas.append(idea)
+        elif self._count == 0 and self._preamble_fields:
+            # Không có heading nào: cả output là một ý tưởng
+            self._lines, self._fields = self._preamble, self._preamble_fields
+            idea = self._finish_idea()
+            if idea:
+                ideas.append(idea)
+
+        return ideas
+
+    def _feed_line(self, line: str) -> Optional[Idea]:
+        stripped = line.strip()
+
+        if self._in_metadata:
+            if _METADATA_END_PATTERN.match(stripped):
+                self._in_metadata = False
+            return None
+        if _METADATA_START_PATTERN.match(stripped):
+            self._in_metadata = True
+            return None
+
+        finished = None
+        if _HEADING_PATTERN.match(line):
+            if self._heading_name or self._lines:
+                finished = self._finish_idea()
+            self._heading_name = self._clean_name(_HEADING_PREFIX_PATTERN.sub("", line, count=1))
+            self._lines = [line]
+            # Field nhiều dòng đang đọc ở phần mở đầu không kéo sang ý tưởng mới
+            self._pending_field = None
+            return finished
+
+        in_idea = bool(self._heading_name or self._lines)
+        if in_idea:
+            self._lines.append(line)
+        else:
+            self._preamble.append(line)
+
+        self._read_field(stripped, self._fields if in_idea else self._preamble_fields)
+        return finished
+
+    def _read_field(self, stripped: str, fields: Dict[str, str]):
+        if not stripped:
+            return
+
+        plain = stripped.lstrip(_BULLET_CHARS).replace("**", "").replace("__", "")
+        match = _LABEL_PATTERN.match(plain)
+        field_name = FIELD_LABELS.get(match.group(1).strip().lower()) if match else None
+
+        if field_name:
+            self._pending_field = None
+            if field_name in fields:
+                return
+            value = match.group(2).strip()
+            fields[field_name] = value
+            if not value:
+                # Giá trị nằm ở các dòng sau (danh sách gạch đầu dòng)
+                self._pending_field = field_name
+                self._pending_lines = 0
+            return
+
+        # Dòng nhãn khác (không phải gạch đầu dòng con của field đang đọc) kết thúc giá trị nhiều dòng
+        if stripped.startswith("#") or (match and not _BULLET_PATTERN.match(stripped)):
+            self._pending_field = None
+            return
+
+        if self._pending_field in fields and self._pending_lines < _MAX_CONTINUATION_LINES:
+            current = fields[self._pending_field]
+            fields[self._pending_field] = f"{current}; {plain}" if current else plain
+            self._pending_lines += 1
+
+    def _finish_idea(self) -> Optional[Idea]:
+        text = "\n".join(self._lines).strip()
+        fields = self._fields
+        name = self._clean_name(fields.get("name", "")) or self._heading_name or _first_line(text)
+
+        self._lines, self._fields, self._heading_name, self._pending_field = [], {}, "", None
+
+        if len(text) <= 30:
+            return None
+
+        idea_id = make_idea_id(name)
+        # Tên trùng trong cùng một output: thêm hậu tố để ID vẫn duy nhất
+        duplicates = self._seen_ids.get(idea_id, 0)
+        self._seen_ids[idea_id] = duplicates + 1
+        if duplicates:
+            idea_id = f"{idea_id}-{duplicates}"
+
+        idea = Idea.create(
+            position=self._count,
+            name=name[:_MAX_NAME_CHARS],
+            audience=fields.get("audience", "")[:_MAX_FIELD_CHARS],
+            business_model=fields.get("business_model", "")[:_MAX_FIELD_CHARS],
+            solution=fields.get("solution", "")[:_MAX_FIELD_CHARS],
+            text=text,
+            idea_id=idea_id
+        )
+        self._count += 1
+        return idea
+
+    @staticmethod
+    def _clean_name(raw: str) -> str:
+        name = _UNIQUE_TAG_PATTERN.sub("", re.sub(r"[#*_`]", "", raw)).strip()
+        return _NAME_PREFIX_PATTERN.sub("", name).strip()[:_MAX_NAME_CHARS]
+
+def _first_line(text: str) -> str:
+    for line in text.splitlines():
+        if line.strip():
+            return re.sub(r"[#*]", "", line).strip()[:_MAX_NAME_CHARS]
+    return "Idea"
+
+def parse_ideas(markdown: str) -> List[Idea]:
+    """Parse toàn bộ markdown ý tưởng thành danh sách Idea"""
+    parser = IdeaStreamParser()
+    ideas = parser.feed(markdown)
+    ideas.extend(parser.close())
+    return ideas
+
+def ideas_to_dicts(ideas: List[Idea]) -> List[Dict[str, Any]]:
+    return [idea.to_dict() for idea in ideas]
+
+def ideas_from_dicts(data: List[Dict[str, Any]]) -> List[Idea]:
+    return [Idea.from_dict(item) for item in data]
@@ -0,0 +1,345 @@
+"""
+Keyword Extractor - Trích keywords/keyphrases để tạo ESV queries
+Tokenize có hỗ trợ tiếng Việt (giữ dấu), phát hiện cụm n-gram, chấm điểm TF-IDF với
+IDF tính sẵn từ output của các session đã lưu; kết quả được cache theo hash nội dung
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Any, Iterable, Tuple
+
+logger = logging.getLogger(__name__)
+
+IDF_STATS_FILENAME = "keyword_idf.json"
+
+# Các file output của session dùng làm corpus (mỗi file là một document)
+CORPUS_FILENAMES = ("analysis_results.md", "ideas_results.md")
+
+STOP_WORDS_EN = {
+    "the", "and", "for", "are", "but", "not", "you", "all", "can", "her", "was", "one", "our",
+    "had", "have", "what", "there", "said", "each", "which", "their", "time", "will", "about",
+    "would", "has", "its", "who", "now", "find", "down", "way", "been", "may", "new", "use",
+    "she", "see", "him", "two", "how", "more", "get", "very", "man", "day", "made", "they",
+    "these", "could", "well", "were", "this", "that", "with", "from", "into", "than", "then",
+    "them", "some", "such", "only", "also", "other", "any", "most", "etc", "via", "per", "why",
+    "a", "an", "of", "to", "in", "on", "at", "by", "or", "is", "be", "as", "it", "if", "so", "do",
+    "no", "we", "us", "my", "vs"
+}
+
+# Âm tiết hư từ tiếng Việt; cụm từ không bắt đầu/kết thúc bằng các âm tiết này
+STOP_WORDS_VI = {
+    "và", "của", "là", "có", "cho", "các", "những", "được", "trong", "với", "một", "này", "đó",
+    "không", "để", "từ", "khi", "theo", "như", "về", "đã", "sẽ", "đang", "cũng", "thì", "mà",
+    "nên", "hoặc", "hay", "nhưng", "rất", "nhiều", "hơn", "trên", "dưới", "tại", "bởi", "vì",
+    "do", "ra", "vào", "lên", "việc", "cách", "phải", "chỉ", "còn", "nếu", "sau", "trước",
+    "giữa", "qua", "đến", "tới", "cùng", "mỗi", "bị", "nào", "gì", "ai", "đây", "ở", "thể",
+    "nhất", "rằng", "vẫn", "lại", "đều", "chưa", "chính", "ngay", "luôn", "thêm", "nữa", "họ",
+    "chúng", "ta", "tôi", "bạn", "mình", "nó", "cả", "hết", "rồi", "vậy", "thế", "sự", "điều",
+    "cần", "muốn", "bằng", "nhằm", "quá", "khá", "đi", "làm", "gồm"
+}
+
+STOP_WORDS = STOP_WORDS_EN | STOP_WORDS_VI
+
+# Token: chuỗi chữ cái (kể cả có dấu) và số, cho phép nối bằng - hoặc . (vd. "b2b", "e-commerce")
+_TOKEN_PATTERN = re.compile(r"[^\W_]+(?:[-.][^\W_]+)*")
+
+# Ranh giới cụm: dấu câu và xuống dòng (cụm không vượt qua các ký tự này)
+_SEGMENT_SPLIT_PATTERN = re.compile(r"[\n\r.,;:!?()\[\]{}\"“”'‘’/|*#>`=+<]+|\s-\s|\s–\s")
+
+# Markdown noise: code, link URL, HTML comments
+_MARKDOWN_NOISE_PATTERN = re.compile(r"```.*?```|<!--.*?-->|https?://\S+", re.DOTALL)
+
+def normalize_text(text: str) -> str:
+    """NFC + lowercase (tiếng Việt có thể ở dạng tổ hợp dấu rời)"""
+    return unicodedata.normalize("NFC", text or "").lower()
+
+def _is_candidate_token(token: str) -> bool:
+    return token not in STOP_WORDS and not token.replace(".", "").replace("-", "").isdigit()
+
+def iter_candidate_runs(text: str) -> Iterable[List[str]]:
+    """
+    Tách text thành các chuỗi token liên tiếp không chứa stop word hay dấu câu.
+
+    Từ tiếng Việt là nhiều âm tiết cách nhau bởi khoảng trắng, nên cụm n-gram trong
+    một run chính là ứng viên từ ghép/keyphrase.
+    """
+    text = _MARKDOWN_NOISE_PATTERN.sub(" ", normalize_text(text))
+
+    for segment in _SEGMENT_SPLIT_PATTERN.split(text):
+        run: List[str] = []
+        for token in _TOKEN_PATTERN.findall(segment):
+            if _is_candidate_token(token) and len(token) >= 2:
+                run.append(token)
+            elif run:
+                yield run
+                run = []
+        if run:
+            yield run
+
+def tokenize(text: str) -> List[str]:
+    """Các token không phải stop word của text, theo thứ tự xuất hiện"""
+    return [token for run in iter_candidate_runs(text) for token in run]
+
+def count_ngrams(text: str, max_ngram: int = 4) -> Counter:
+    """Đếm mọi n-gram (1..max_ngram) của text trong một lượt duyệt"""
+    counts: Counter = Counter()
+
+    for run in iter_candidate_runs(text):
+        length = len(run)
+        for n in range(1, max_ngram + 1):
+            for i in range(length - n + 1):
+                counts[" ".join(run[i:i + n])] += 1
+
+    return counts
+
+class IDFStats:
+    """
+    Document frequency của n-gram trên corpus output của các session đã lưu.
+
+    Lưu ở {output_dir}/keyword_idf.json cùng danh sách file nguồn (mtime) để lần sau chỉ
+    cần đếm thêm các session mới; nếu file nguồn đã đếm bị sửa/xóa thì build lại.
+    """
+
+    def __init__(self, max_ngram: int = 4):
+        self.max_ngram = max_ngram
+        self.document_count = 0
+        self.document_frequency: Counter = Counter()
+        self.sources: Dict[str, float] = {}
+
+    def add_document(self, text: str):
+        self.document_count += 1
+        self.document_frequency.update(count_ngrams(text, self.max_ngram).keys())
+
+    def idf(self, term: str) -> float:
+        """IDF smooth; term chưa gặp có IDF cao nhất"""
+        return math.log((self.document_count + 1) / (self.document_frequency.get(term, 0) + 1)) + 1.0
+
+    @staticmethod
+    def _scan_sources(output_dir: str) -> Dict[str, float]:
+        """Các file output session trong output_dir -> mtime"""
+        sources = {}
+
+        if not os.path.isdir(output_dir):
+            return sources
+
+        for entry in sorted(os.listdir(output_dir)):
+            session_dir = os.path.join(output_dir, entry)
+            if not os.path.isdir(session_dir):
+                continue
+            for filename in CORPUS_FILENAMES:
+                path = os.path.join(session_dir, filename)
+                if os.path.isfile(path):
+                    sources[os.path.join(entry, filename)] = os.path.getmtime(path)
+
+        return sources
+
+    @classmethod
+    def load(cls, path: str, max_ngram: int = 4) -> "IDFStats":
+        stats = cls(max_ngram)
+
+        if not os.path.exists(path):
+            return stats
+
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("max_ngram") != max_ngram:
+                return stats
+            stats.document_count = data["document_count"]
+            stats.document_frequency = Counter(data["document_frequency"])
+            stats.sources = data.get("sources", {})
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Invalid keyword IDF stats at {path}, rebuilding: {str(e)}")
+            return cls(max_ngram)
+
+        return stats
+
+    def save(self, path: str):
+        """Ghi qua file tạm + rename: các worker batch có thể build lại file cùng lúc"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "max_ngram": self.max_ngram,
+                    "document_count": self.document_count,
+                    "sources": self.sources,
+                    "document_frequency": dict(self.document_frequency)
+                }, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to save keyword IDF stats: {str(e)}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    @classmethod
+    def from_sessions(cls, output_dir: str, max_ngram: int = 4) -> "IDFStats":
+        """Load stats đã lưu và cập nhật với các session mới trong output_dir"""
+        path = os.path.join(output_dir, IDF_STATS_FILENAME)
+        stats = cls.load(path, max_ngram)
+        current = cls._scan_sources(output_dir)
+
+        if any(current.get(source) != mtime for source, mtime in stats.sources.items()):
+            stats = cls(max_ngram)
+
+        new_sources = [source for source in current if source not in stats.sources]
+        if not new_sources:
+            return stats
+
+        for source in new_sources:
+            try:
+                with open(os.path.join(output_dir, source), 'r', encoding='utf-8') as f:
+                    stats.add_document(f.read())
+                stats.sources[source] = current[source]
+            except OSError as e:
+                logger.warning(f"Skipping keyword corpus file {source}: {str(e)}")
+
+        stats.save(path)
+        logger.info(f"Keyword IDF stats: {stats.document_count} documents ({len(new_sources)} new)")
+
+        return stats
+
+class KeywordExtractor:
+    """
+    Trích keyphrases cho ESV queries.
+
+    Điểm = tf * idf * hệ số độ dài cụm; cụm nhiều từ chỉ được xét khi lặp lại ít nhất
+    min_phrase_count lần; term chủ yếu xuất hiện bên trong một cụm dài hơn (>= subsumption_ratio
+    số lần) hoặc nằm trong một cụm dài hơn có điểm cao hơn nhường chỗ cho cụm đó. Term một âm tiết
+    (thường là mảnh của từ ghép, vd. "tài" trong "tài chính") chỉ được giữ khi IDF >= min_syllable_idf;
+    âm tiết tiếng Việt còn phải có trong ít nhất min_syllable_df document của corpus. Keyphrases trùng
+    từ với cụm đã chọn bị loại.
+    """
+
+    def __init__(self,
+                 idf_stats: Optional[IDFStats] = None,
+                 max_ngram: int = 4,
+                 min_phrase_count: int = 2,
+                 phrase_boost: float = 0.5,
+                 subsumption_ratio: float = 0.5,
+                 min_syllable_idf: float = 1.5,
+                 min_syllable_df: int = 1,
+                 cache_size: int = 256):
+        self.idf_stats = idf_stats or IDFStats(max_ngram)
+        self.max_ngram = max_ngram
+        self.min_phrase_count = min_phrase_count
+        self.phrase_boost = phrase_boost
+        self.subsumption_ratio = subsumption_ratio
+        self.min_syllable_idf = min_syllable_idf
+        self.min_syllable_df = min_syllable_df
+        self.cache_size = cache_size
+
+        self._cache: "OrderedDict[str, List[str]]" = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @classmethod
+    def from_sessions(cls, output_dir: str, **kwargs) -> "KeywordExtractor":
+        """Extractor với IDF từ các session đã lưu trong output_dir"""
+        max_ngram = kwargs.get("max_ngram", 4)
+        return cls(IDFStats.from_sessions(output_dir, max_ngram), **kwargs)
+
+    def score_candidates(self, text: str) -> List[Tuple[str, float]]:
+        """Chấm điểm mọi ứng viên, sắp xếp giảm dần"""
+        counts = count_ngrams(text, self.max_ngram)
+
+        # Số lần mỗi term nằm trong một cụm dài hơn có lặp lại: âm tiết "chi" trong "chi phí" hay
+        # "động" trong "di động"/"hoạt động" chủ yếu xuất hiện như một phần của từ ghép
+        in_phrases: Dict[str, int] = {}
+        for term, tf in counts.items():
+            words = term.split(" ")
+            if len(words) < 2 or tf < self.min_phrase_count:
+                continue
+            for sub in {" ".join(words[:-1]), " ".join(words[1:])}:
+                in_phrases[sub] = in_phrases.get(sub, 0) + tf
+
+        scored = []
+
+        for term, tf in counts.items():
+            words = term.count(" ") + 1
+            idf = self.idf_stats.idf(term)
+            if words == 1:
+                # Âm tiết tiếng Việt chưa gặp trong corpus (hoặc không có corpus) không đánh giá được
+                if not term.isascii() and self.idf_stats.document_frequency.get(term, 0) < self.min_syllable_df:
+                    continue
+                if self.idf_stats.document_count and idf < self.min_syllable_idf:
+                    continue
+            elif tf < self.min_phrase_count:
+                continue
+            if in_phrases.get(term, 0) >= tf * self.subsumption_ratio:
+                continue
+
+            score = tf * idf * (1 + self.phrase_boost * (words - 1))
+            scored.append((term, score))
+
+        scored.sort(key=lambda item: (-item[1], -item[0].count(" "), item[0]))
+
+        # Bỏ term nằm trong một cụm dài hơn có điểm cao hơn (vd. "lý chi phí" trong "quản lý chi phí")
+        covered = set()
+        result = []
+        for term, score in scored:
+            if term in covered:
+                continue
+            result.append((term, score))
+            words = term.split(" ")
+            for n in range(1, len(words)):
+                covered.update(" ".join(words[i:i + n]) for i in range(len(words) - n + 1))
+
+        return result
+
+    def extract(self, text: str, max_keywords: int = 5) -> List[str]:
+        """Top keyphrases của text (cache theo hash nội dung)"""
+        key = hashlib.sha1(f"{max_keywords}:{text}".encode("utf-8")).hexdigest()
+
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return list(cached)
+
+        self.cache_misses += 1
+        keywords: List[str] = []
+
+        kept_words: List[set] = []
+
+        for term, _ in self.score_candidates(text):
+            words = set(term.split(" "))
+            # Bỏ cụm trùng quá nửa số từ với keyphrase đã chọn (vd. "chi phí" / "chi phí saas")
+            if any(len(words & kept) * 2 >= min(len(words), len(kept)) for kept in kept_words):
+                continue
+            kept_words.append(words)
+            keywords.append(term)
+            if len(keywords) >= max_keywords:
+                break
+
+        self._cache[key] = keywords
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+        return list(keywords)
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "corpus_documents": self.idf_stats.document_count,
+            "vocabulary_size": len(self.idf_stats.document_frequency),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "cache_hit_rate": round(self.cache_hits / lookups, 3) if lookups else 0.0
+        }
+
+# Extractor mặc định (không có corpus) cho extract_keywords_from_text
+_default_extractor: Optional[KeywordExtractor] = None
+
+def get_default_extractor() -> KeywordExtractor:
+    global _default_extractor
+    if _default_extractor is None:
+        _default_extractor = KeywordExtractor()
+    return _default_extractor
@@ -0,0 +1,215 @@
+"""
+LLM Response Cache - Cache response LLM trên đĩa (SQLite), địa chỉ hóa theo nội dung
+Key = hash(model, messages, temperature, max_tokens), hỗ trợ TTL và LRU eviction
+"""
+
+import json
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+# Các chế độ cache
+CACHE_MODE_READ_WRITE = "read_write"  # Đọc cache, miss thì gọi API và ghi lại
+CACHE_MODE_CACHE_ONLY = "cache_only"  # Chỉ đọc cache, miss thì trả lỗi (dùng cho test)
+CACHE_MODES = [CACHE_MODE_READ_WRITE, CACHE_MODE_CACHE_ONLY]
+
+class LLMResponseCache:
+    """
+    Cache response LLM trong SQLite, dùng chung được giữa các lần chạy và các process
+    """
+
+    def __init__(self,
+                 db_path: str,
+                 ttl: Optional[int] = 7 * 24 * 3600,
+                 max_entries: int = 10000,
+                 mode: str = CACHE_MODE_READ_WRITE):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"LLM cache mode phải là một trong {CACHE_MODES}")
+
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.mode = mode
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                content TEXT NOT NULL,
+                usage TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hit_count INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_llm_responses_last_access ON llm_responses(last_access)"
+        )
+        self._conn.commit()
+
+    @property
+    def cache_only(self) -> bool:
+        return self.mode == CACHE_MODE_CACHE_ONLY
+
+    @staticmethod
+    def make_key(model: str,
+                 messages: List[Dict[str, str]],
+                 temperature: float,
+                 max_tokens: int,
+                 response_format: Optional[Dict[str, Any]] = None) -> str:
+        """Tạo key ổn định từ các tham số quyết định response"""
+        params = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        # Chỉ thêm khi có để key của các call không dùng structured output giữ nguyên
+        if response_format:
+            params["response_format"] = response_format
+        
+        material = json.dumps(
+            params,
+            ensure_ascii=False,
+            sort_keys=True,
+            separators=(",", ":")
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Lấy entry theo key; trả về None nếu miss hoặc đã hết hạn"""
+        try:
+            row = self._conn.execute(
+                "SELECT model, content, usage, created_at FROM llm_responses WHERE key = ?",
+                (key,)
+            ).fetchone()
+
+            now = time.time()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            model, content, usage, created_at = row
+
+            if self.ttl is not None and now - created_at > self.ttl:
+                self._conn.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self.evictions += 1
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE llm_responses SET last_access = ?, hit_count = hit_count + 1 WHERE key = ?",
+                (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+
+            return {
+                "model": model,
+                "content": content,
+                "usage": json.loads(usage)
+            }
+
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache read error: {str(e)}")
+            self.misses += 1
+            return None
+
+    def put(self, key: str, model: str, content: str, usage: Dict[str, Any]):
+        """Ghi response vào cache (bỏ qua trong chế độ cache_only)"""
+        if self.cache_only:
+            return
+
+        try:
+            now = time.time()
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO llm_responses
+                    (key, model, content, usage, created_at, last_access, hit_count)
+                VALUES (?, ?, ?, ?, ?, ?, 0)
+                """,
+                (key, model, content, json.dumps(usage or {}), now, now)
+            )
+            self._conn.commit()
+            self.writes += 1
+            self._evict_if_needed()
+
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache write error: {str(e)}")
+
+    def _evict_if_needed(self):
+        """Xóa entries hết hạn và entries ít được dùng gần đây nhất khi vượt giới hạn"""
+        if self.ttl is not None:
+            cursor = self._conn.execute(
+                "DELETE FROM llm_responses WHERE created_at < ?",
+                (time.time() - self.ttl,)
+            )
+            self.evictions += cursor.rowcount
+
+        count = self._conn.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+        overflow = count - self.max_entries
+
+        if overflow > 0:
+            cursor = self._conn.execute(
+                """
+                DELETE FROM llm_responses WHERE key IN (
+                    SELECT key FROM llm_responses ORDER BY last_access ASC LIMIT ?
+                )
+                """,
+                (overflow,)
+            )
+            self.evictions += cursor.rowcount
+
+        self._conn.commit()
+
+    def clear(self):
+        """Xóa toàn bộ cache"""
+        self._conn.execute("DELETE FROM llm_responses")
+        self._conn.commit()
+        logger.info("LLM response cache cleared")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê cache"""
+        try:
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+        except sqlite3.Error:
+            entries = -1
+
+        lookups = self.hits + self.misses
+
+        return {
+            "mode": self.mode,
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+        }
+
+    def close(self):
+        """Đóng kết nối SQLite"""
+        try:
+            self._conn.close()
+        except sqlite3.Error:
+            pass
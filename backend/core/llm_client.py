@@ -4,12 +4,22 @@ Xử lý tất cả các kết nối và giao tiếp với LLM API
 """
 
 import json
+import re
+import time
 import asyncio
+import hashlib
 import aiohttp
 import logging
-from typing import Dict, List, Optional, Any, Union
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Any, Union, AsyncIterator, Callable, Tuple
 from dataclasses import dataclass
 from backend.config import LLMConfig
+from backend.core.llm_cache import LLMResponseCache
+from backend.core.http_transport import HTTPTransport
+from backend.core.rate_limiter import AdaptiveRateLimiter, get_shared_rate_limiter
+from backend.core.singleflight import get_shared_singleflight
+from backend.core.token_estimator import estimate_tokens, estimate_messages_tokens, context_limit, safety_margin
+from backend.core.tracing import get_tracer, Span, CATEGORY_LLM, CATEGORY_HTTP, CATEGORY_RETRY
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -30,6 +40,15 @@ class LLMMessage:
     """Cấu trúc message cho LLM"""
     role: str  # "system", "user", "assistant"
     content: str
+    cache_prefix_chars: int = 0  # Số ký tự đầu của content là phần tĩnh, giống nhau giữa các call
+
+@dataclass
+class LLMStreamChunk:
+    """Một chunk từ streaming chat completion"""
+    delta: str  # Phần text mới nhận được
+    content: str  # Toàn bộ text đã nhận tới thời điểm này (dùng cho parse từng phần)
+    done: bool = False
+    response: Optional[LLMResponse] = None  # Chỉ có ở chunk cuối cùng
 
 class LLMClient:
     """
@@ -37,13 +56,34 @@ class LLMClient:
     Hỗ trợ cả sync và async calls
     """
     
-    def __init__(self, config: LLMConfig):
+    def __init__(self,
+                 config: LLMConfig,
+                 cache: Optional[LLMResponseCache] = None,
+                 transport: Optional[HTTPTransport] = None,
+                 limiter: Optional[Any] = None,
+                 rate_limiter: Optional[AdaptiveRateLimiter] = None):
         self.config = config
+        self.cache = cache
+        self.transport = transport
+        # Async context manager giới hạn số request đang bay (vd. asyncio.Semaphore dùng chung)
+        self.limiter = limiter
+        # Governor RPM/TPM/concurrency; mặc định dùng chung theo endpoint trong event loop
+        self.rate_limiter = rate_limiter
         self.session: Optional[aiohttp.ClientSession] = None
+        self._timeout = aiohttp.ClientTimeout(total=config.timeout)
         self._headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {config.api_key}"
         }
+        # Thống kê prefix cache được trên các request thực sự gửi đi
+        self._prompt_cache_stats = {
+            "requests": 0,
+            "prompt_tokens": 0,
+            "cacheable_prefix_tokens": 0,
+            "provider_cached_tokens": 0
+        }
+        # Kiểm tra kích thước prompt trước khi gửi (max_tokens bị co lại / request bị từ chối)
+        self._preflight_stats = {"checked": 0, "clamped": 0, "rejected": 0}
         
     async def __aenter__(self):
         """Async context manager entry"""
@@ -55,24 +95,95 @@ class LLMClient:
         await self.close_session()
         
     async def start_session(self):
-        """Khởi tạo aiohttp session"""
-        if self.session is None:
-            timeout = aiohttp.ClientTimeout(total=self.config.timeout)
-            self.session = aiohttp.ClientSession(
-                headers=self._headers,
-                timeout=timeout
-            )
+        """Khởi tạo aiohttp session (dùng session của transport nếu được inject)"""
+        if self.session is None or self.session.closed:
+            if self.transport:
+                self.session = await self.transport.get_session()
+            else:
+                self.session = aiohttp.ClientSession()
             
     async def close_session(self):
-        """Đóng aiohttp session"""
+        """Đóng aiohttp session; session của transport dùng chung do owner đóng"""
         if self.session:
-            await self.session.close()
+            if not self.transport:
+                await self.session.close()
             self.session = None
     
+    def _get_rate_limiter(self) -> AdaptiveRateLimiter:
+        if self.rate_limiter is None:
+            self.rate_limiter = get_shared_rate_limiter(self.config)
+        return self.rate_limiter
+    
+    @asynccontextmanager
+    async def _request_slot(self, estimated_tokens: int = 0, span: Optional[Span] = None):
+        """Giữ slot của rate limiter (và limiter ngoài nếu có) trong suốt một HTTP request"""
+        queued_at = time.monotonic()
+        rate_limiter = self._get_rate_limiter()
+        await rate_limiter.acquire(estimated_tokens)
+        
+        try:
+            if self.limiter is None:
+                if span:
+                    span.queue_time = time.monotonic() - queued_at
+                yield
+            else:
+                async with self.limiter:
+                    if span:
+                        span.queue_time = time.monotonic() - queued_at
+                    yield
+        finally:
+            await rate_limiter.release()
+    
+    async def _retry_sleep(self, delay: float, attempt: int):
+        """Sleep trước khi retry, được ghi thành span riêng"""
+        with get_tracer().span("llm.retry_backoff", CATEGORY_RETRY, attempt=attempt + 1, delay=round(delay, 3)):
+            await asyncio.sleep(delay)
+    
+    def _estimate_request_tokens(self, payload: Dict[str, Any]) -> int:
+        """Ước lượng token một request tiêu tốn (prompt + max_tokens) cho TPM bucket"""
+        return estimate_messages_tokens(payload["messages"]) + payload["max_tokens"]
+    
+    def _preflight(self,
+                   messages: List[LLMMessage],
+                   max_tokens: Optional[int]) -> Tuple[int, Optional[LLMResponse]]:
+        """
+        Ước lượng prompt trước khi gửi: co max_tokens cho vừa context window của model.
+        
+        Prompt không còn chỗ cho output bị từ chối ngay (LLMResponse lỗi) thay vì gửi đi,
+        lỗi overflow rồi tốn hết các lần retry.
+        """
+        limit = context_limit(self.config.model, self.config.context_window)
+        prompt_tokens = estimate_messages_tokens(messages)
+        available = limit - prompt_tokens - safety_margin(limit)
+        requested = max_tokens or self.config.max_tokens
+        self._preflight_stats["checked"] += 1
+        
+        if available < min(self.config.min_output_tokens, requested):
+            self._preflight_stats["rejected"] += 1
+            error_msg = f"Prompt quá dài: ~{prompt_tokens} token, context window {limit} token không còn chỗ cho output"
+            logger.error(error_msg)
+            return requested, LLMResponse(
+                content="",
+                usage={},
+                model=self.config.model,
+                success=False,
+                error=error_msg,
+                metadata={"preflight_rejected": True}
+            )
+        
+        if available < requested:
+            self._preflight_stats["clamped"] += 1
+            logger.info(f"max_tokens {requested} -> {available} (prompt ~{prompt_tokens} token, context window {limit})")
+            return available, None
+        
+        return requested, None
+    
     def _build_payload(self, 
                       messages: List[LLMMessage], 
                       temperature: Optional[float] = None,
-                      max_tokens: Optional[int] = None) -> Dict[str, Any]:
+                      max_tokens: Optional[int] = None,
+                      stream: bool = False,
+                      response_format: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Xây dựng payload cho API request"""
         
         payload = {
@@ -81,88 +192,531 @@ class LLMClient:
                 {"role": msg.role, "content": msg.content} 
                 for msg in messages
             ],
-            "temperature": temperature or self.config.temperature,
+            "temperature": temperature if temperature is not None else self.config.temperature,
             "max_tokens": max_tokens or self.config.max_tokens
         }
         
+        if stream:
+            payload["stream"] = True
+            payload["stream_options"] = {"include_usage": True}
+        
+        if response_format:
+            payload["response_format"] = response_format
+        
         return payload
     
+    def _prompt_cache_plan(self,
+                           messages: List[LLMMessage],
+                           payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """
+        Số token của prefix ổn định (mọi message trước lượt cuối + phần tĩnh của lượt cuối)
+        và payload gửi đi kèm hint prompt caching theo config.prompt_cache_hints.
+        
+        Payload gốc (không hint) vẫn dùng cho cache key, coalescing và ước lượng token.
+        """
+        if not messages:
+            return 0, payload
+        
+        last = messages[-1]
+        static_chars = min(last.cache_prefix_chars, len(last.content))
+        prefix_tokens = estimate_messages_tokens(messages[:-1]) + estimate_tokens(last.content[:static_chars])
+        
+        hints = self.config.prompt_cache_hints
+        if hints == "prompt_cache_key":
+            # OpenAI: request cùng key được route về cùng máy nên dễ trúng cache prefix
+            prefix = "".join(msg.content for msg in messages if msg.role == "system") + last.content[:static_chars]
+            wire_payload = dict(payload)
+            wire_payload["prompt_cache_key"] = hashlib.blake2b(prefix.encode("utf-8"), digest_size=12).hexdigest()
+            return prefix_tokens, wire_payload
+        
+        if hints == "cache_control":
+            # Anthropic/LiteLLM: breakpoint ephemeral sau system, cuối history và cuối phần tĩnh lượt cuối
+            wire_messages = [dict(msg) for msg in payload["messages"]]
+            breakpoints = {i for i, msg in enumerate(messages[:-1]) if msg.role == "system"}
+            if len(messages) > 1:
+                breakpoints.add(len(messages) - 2)
+            
+            for i in breakpoints:
+                wire_messages[i]["content"] = [_cache_part(messages[i].content)]
+            
+            if 0 < static_chars < len(last.content):
+                wire_messages[-1]["content"] = [
+                    _cache_part(last.content[:static_chars]),
+                    {"type": "text", "text": last.content[static_chars:]}
+                ]
+            
+            wire_payload = dict(payload)
+            wire_payload["messages"] = wire_messages
+            return prefix_tokens, wire_payload
+        
+        return prefix_tokens, payload
+    
+    def _record_prompt_cache_request(self, payload: Dict[str, Any], prefix_tokens: int):
+        stats = self._prompt_cache_stats
+        stats["requests"] += 1
+        stats["prompt_tokens"] += estimate_messages_tokens(payload["messages"])
+        stats["cacheable_prefix_tokens"] += prefix_tokens
+    
+    def _record_provider_cached_tokens(self, usage: Dict[str, Any]) -> int:
+        """Token prompt provider báo đã đọc từ cache (OpenAI hoặc Anthropic usage)"""
+        details = usage.get("prompt_tokens_details") or {}
+        cached = details.get("cached_tokens") or usage.get("cache_read_input_tokens") or 0
+        self._prompt_cache_stats["provider_cached_tokens"] += cached
+        return cached
+    
     async def chat_completion(self, 
                             messages: List[LLMMessage],
                             temperature: Optional[float] = None,
                             max_tokens: Optional[int] = None,
-                            retries: int = 3) -> LLMResponse:
+                            retries: int = 3,
+                            use_cache: bool = True,
+                            response_format: Optional[Dict[str, Any]] = None) -> LLMResponse:
         """
         Thực hiện chat completion với retry logic
+        
+        use_cache=False bỏ qua response cache (ví dụ cho các call temperature cao).
+        response_format được gửi nguyên vẹn (structured output kiểu OpenAI) và là một phần của cache key.
         """
+        with get_tracer().span("llm.chat_completion", CATEGORY_LLM, model=self.config.model) as span:
+            response = await self._chat_completion(
+                messages, temperature, max_tokens, retries, use_cache, span, response_format
+            )
+            
+            span.set(
+                prompt_tokens=response.usage.get("prompt_tokens", 0),
+                completion_tokens=response.usage.get("completion_tokens", 0)
+            )
+            if not response.success:
+                span.error = response.error
+            
+            return response
+    
+    async def _chat_completion(self,
+                               messages: List[LLMMessage],
+                               temperature: Optional[float],
+                               max_tokens: Optional[int],
+                               retries: int,
+                               use_cache: bool,
+                               span: Span,
+                               response_format: Optional[Dict[str, Any]] = None) -> LLMResponse:
+        """Phần thực thi của chat_completion (pre-flight, cache, coalescing, retry)"""
+        max_tokens, rejected = self._preflight(messages, max_tokens)
+        if rejected:
+            span.set(preflight_rejected=True)
+            return rejected
+        
+        payload = self._build_payload(messages, temperature, max_tokens, response_format=response_format)
+        
+        cache_key = self._get_cache_key(payload) if use_cache and self.cache else None
+        if cache_key:
+            cached_response = self._lookup_cache(cache_key)
+            span.set(cache_hit=cached_response is not None)
+            if cached_response:
+                return cached_response
+            if self.cache.cache_only:
+                return self._cache_miss_response()
+        
         if not self.session:
             await self.start_session()
-            
-        payload = self._build_payload(messages, temperature, max_tokens)
+        
+        prefix_tokens, wire_payload = self._prompt_cache_plan(messages, payload)
+        span.set(cacheable_prefix_tokens=prefix_tokens)
+        
+        def send() -> Any:
+            return self._send_with_retries(payload, cache_key, retries, span, wire_payload, prefix_tokens)
+        
+        if use_cache and self.config.coalesce_requests and self._is_deterministic(payload):
+            # Request giống hệt đang bay (cùng endpoint + payload): chờ chung kết quả thay vì gọi lại.
+            # Chỉ với temperature thấp: các call sampling (ý tưởng, AE) là các mẫu độc lập, gộp lại làm mất đa dạng
+            flight_key = f"{self.config.url}|{self._get_cache_key(payload)}"
+            flights = get_shared_singleflight("llm")
+            span.set(coalesced=flights.is_inflight(flight_key))
+            return await flights.do(flight_key, send)
+        
+        return await send()
+    
+    def _is_deterministic(self, payload: Dict[str, Any]) -> bool:
+        """Temperature hiệu dụng không vượt coalesce_max_temperature"""
+        return payload.get("temperature", self.config.temperature) <= self.config.coalesce_max_temperature
+    
+    async def _send_with_retries(self,
+                                 payload: Dict[str, Any],
+                                 cache_key: Optional[str],
+                                 retries: int,
+                                 span: Span,
+                                 wire_payload: Optional[Dict[str, Any]] = None,
+                                 prefix_tokens: int = 0) -> LLMResponse:
+        """Gửi request tới API với retry, rate limit và ghi cache khi thành công"""
+        estimated_tokens = self._estimate_request_tokens(payload)
+        rate_limiter = self._get_rate_limiter()
+        tracer = get_tracer()
+        self._record_prompt_cache_request(payload, prefix_tokens)
+        
+        # Serialize một lần cho mọi attempt (payload kèm hint prompt caching); kích thước body được ghi vào trace
+        body = json.dumps(wire_payload or payload).encode("utf-8")
+        span.set(request_bytes=len(body))
         
         for attempt in range(retries + 1):
+            retry_after: Optional[float] = None
+            span.set(attempts=attempt + 1)
+            
             try:
                 logger.info(f"Gửi request đến LLM (attempt {attempt + 1}/{retries + 1})")
                 
-                async with self.session.post(self.config.url, json=payload) as response:
-                    response_data = await response.json()
-                    
-                    if response.status == 200:
-                        return self._parse_success_response(response_data)
-                    else:
-                        error_msg = f"API Error {response.status}: {response_data}"
+                with tracer.span("llm.http_attempt", CATEGORY_HTTP,
+                                 attempt=attempt + 1, request_bytes=len(body)) as attempt_span:
+                    async with self._request_slot(estimated_tokens, attempt_span), self.session.post(
+                        self.config.url,
+                        data=body,
+                        headers=self._headers,
+                        timeout=self._timeout
+                    ) as response:
+                        attempt_span.set(status=response.status)
+                        span.queue_time += attempt_span.queue_time
+                        
+                        if response.status == 200:
+                            raw_body = await response.read()
+                            attempt_span.set(response_bytes=len(raw_body))
+                            
+                            llm_response = self._parse_success_response(json.loads(raw_body))
+                            attempt_span.set(
+                                prompt_tokens=llm_response.usage.get("prompt_tokens", 0),
+                                completion_tokens=llm_response.usage.get("completion_tokens", 0),
+                                cached_prompt_tokens=self._record_provider_cached_tokens(llm_response.usage)
+                            )
+                            rate_limiter.record_success(
+                                response.headers,
+                                llm_response.usage.get("total_tokens", 0),
+                                estimated_tokens
+                            )
+                            if cache_key and llm_response.success:
+                                self.cache.put(cache_key, llm_response.model, llm_response.content, llm_response.usage)
+                            return llm_response
+                        
+                        error_body = await response.text()
+                        attempt_span.set(response_bytes=len(error_body.encode("utf-8")))
+                        retry_after = rate_limiter.record_failure(response.status, response.headers)
+                        error_msg = f"API Error {response.status}: {error_body[:500]}"
+                        attempt_span.error = error_msg
                         logger.error(error_msg)
                         
-                        if attempt == retries:  # Last attempt
+                        if _is_context_overflow(response.status, error_body):
+                            # Gửi lại cùng payload chắc chắn lỗi lại: không retry
                             return LLMResponse(
                                 content="",
                                 usage={},
                                 model=self.config.model,
                                 success=False,
-                                error=error_msg
+                                error=error_msg,
+                                metadata={"context_overflow": True}
                             )
-                        
-                        # Wait before retry
-                        await asyncio.sleep(2 ** attempt)
-                        
+                    
             except asyncio.TimeoutError:
                 error_msg = f"Timeout sau {self.config.timeout}s"
                 logger.error(error_msg)
                 
-                if attempt == retries:
-                    return LLMResponse(
-                        content="",
-                        usage={},
-                        model=self.config.model,
-                        success=False,
-                        error=error_msg
-                    )
+            except Exception as e:
+                error_msg = f"Unexpected error: {str(e)}"
+                logger.error(error_msg)
+            
+            if attempt == retries:  # Last attempt
+                return LLMResponse(
+                    content="",
+                    usage={},
+                    model=self.config.model,
+                    success=False,
+                    error=error_msg
+                )
+            
+            # Wait before retry (jittered; 429 cooldown được áp dụng chung trong rate limiter)
+            await self._retry_sleep(rate_limiter.retry_delay(attempt, retry_after), attempt)
+        
+        # Shouldn't reach here, but just in case
+        return LLMResponse(
+            content="",
+            usage={},
+            model=self.config.model,
+            success=False,
+            error="Max retries exceeded"
+        )
+    
+    async def stream_chat_completion(self,
+                                   messages: List[LLMMessage],
+                                   temperature: Optional[float] = None,
+                                   max_tokens: Optional[int] = None,
+                                   retries: int = 3,
+                                   use_cache: bool = True,
+                                   response_format: Optional[Dict[str, Any]] = None) -> AsyncIterator[LLMStreamChunk]:
+        """
+        Streaming chat completion (OpenAI-style text/event-stream).
+        
+        Yield một LLMStreamChunk cho mỗi delta text; chunk cuối có done=True và
+        chứa LLMResponse tổng hợp (content đầy đủ + usage). Chỉ retry khi lỗi xảy ra
+        trước token đầu tiên, vì text đã yield không thể rút lại.
+        """
+        max_tokens, rejected = self._preflight(messages, max_tokens)
+        if rejected:
+            yield LLMStreamChunk(delta="", content="", done=True, response=rejected)
+            return
+        
+        payload = self._build_payload(messages, temperature, max_tokens, stream=True, response_format=response_format)
+        
+        cache_key = self._get_cache_key(payload) if use_cache and self.cache else None
+        if cache_key:
+            cached_response = self._lookup_cache(cache_key) or (
+                self._cache_miss_response() if self.cache.cache_only else None
+            )
+            if cached_response:
+                if cached_response.content:
+                    yield LLMStreamChunk(delta=cached_response.content, content=cached_response.content)
+                yield LLMStreamChunk(
+                    delta="",
+                    content=cached_response.content,
+                    done=True,
+                    response=cached_response
+                )
+                return
+        
+        if not self.session:
+            await self.start_session()
+        
+        # Stream dài có thể vượt total timeout; chỉ giới hạn thời gian chờ giữa các chunk
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=self.config.timeout)
+        
+        estimated_tokens = self._estimate_request_tokens(payload)
+        rate_limiter = self._get_rate_limiter()
+        tracer = get_tracer()
+        prefix_tokens, wire_payload = self._prompt_cache_plan(messages, payload)
+        self._record_prompt_cache_request(payload, prefix_tokens)
+        body = json.dumps(wire_payload).encode("utf-8")
+        
+        for attempt in range(retries + 1):
+            parts: List[str] = []
+            usage: Dict[str, int] = {}
+            model = self.config.model
+            retry_after: Optional[float] = None
+            overflow = False
+            
+            # Async generator chạy trong context của caller nên không đặt span làm span hiện tại
+            attempt_span = tracer.start_span("llm.http_attempt", CATEGORY_HTTP,
+                                             attempt=attempt + 1, request_bytes=len(body), streamed=True)
+            response_bytes = 0
+            
+            try:
+                logger.info(f"Gửi streaming request đến LLM (attempt {attempt + 1}/{retries + 1})")
+                
+                async with self._request_slot(estimated_tokens, attempt_span), self.session.post(
+                    self.config.url,
+                    data=body,
+                    headers=self._headers,
+                    timeout=timeout
+                ) as response:
+                    attempt_span.set(status=response.status)
+                    
+                    if response.status != 200:
+                        error_body = await response.text()
+                        retry_after = rate_limiter.record_failure(response.status, response.headers)
+                        overflow = _is_context_overflow(response.status, error_body)
+                        raise aiohttp.ClientResponseError(
+                            response.request_info,
+                            response.history,
+                            status=response.status,
+                            message=error_body[:500]
+                        )
+                    
+                    async for raw_line in response.content:
+                        response_bytes += len(raw_line)
+                        event = self._parse_sse_line(raw_line)
+                        if event is None:
+                            continue
+                        if event == "[DONE]":
+                            break
+                        
+                        model = event.get("model", model)
+                        if event.get("usage"):
+                            usage = event["usage"]
+                        
+                        for choice in event.get("choices", []):
+                            delta = (choice.get("delta") or {}).get("content")
+                            if delta:
+                                parts.append(delta)
+                                yield LLMStreamChunk(delta=delta, content="".join(parts))
                     
-                await asyncio.sleep(2 ** attempt)
+                    rate_limiter.record_success(response.headers, usage.get("total_tokens", 0), estimated_tokens)
+                
+                attempt_span.set(
+                    response_bytes=response_bytes,
+                    prompt_tokens=usage.get("prompt_tokens", 0),
+                    completion_tokens=usage.get("completion_tokens", 0),
+                    cached_prompt_tokens=self._record_provider_cached_tokens(usage),
+                    cacheable_prefix_tokens=prefix_tokens
+                )
+                tracer.end_span(attempt_span)
+                
+                content = "".join(parts)
+                if cache_key:
+                    self.cache.put(cache_key, model, content, usage)
+                
+                yield LLMStreamChunk(
+                    delta="",
+                    content=content,
+                    done=True,
+                    response=LLMResponse(
+                        content=content,
+                        usage=usage,
+                        model=model,
+                        success=True,
+                        metadata={"streamed": True}
+                    )
+                )
+                return
                 
             except Exception as e:
-                error_msg = f"Unexpected error: {str(e)}"
+                if isinstance(e, asyncio.TimeoutError):
+                    error_msg = f"Timeout sau {self.config.timeout}s khi chờ stream"
+                else:
+                    error_msg = f"Streaming error: {str(e)}"
                 logger.error(error_msg)
                 
-                if attempt == retries:
-                    return LLMResponse(
-                        content="",
-                        usage={},
-                        model=self.config.model,
-                        success=False,
-                        error=error_msg
+                attempt_span.set(response_bytes=response_bytes)
+                tracer.end_span(attempt_span, error=error_msg)
+                
+                if parts or overflow or attempt == retries:
+                    content = "".join(parts)
+                    yield LLMStreamChunk(
+                        delta="",
+                        content=content,
+                        done=True,
+                        response=LLMResponse(
+                            content=content,
+                            usage=usage,
+                            model=model,
+                            success=False,
+                            error=error_msg,
+                            metadata={"streamed": True}
+                        )
                     )
-                    
-                await asyncio.sleep(2 ** attempt)
+                    return
+                
+                await self._retry_sleep(rate_limiter.retry_delay(attempt, retry_after), attempt)
+    
+    def _parse_sse_line(self, raw_line: bytes) -> Optional[Union[Dict[str, Any], str]]:
+        """Parse một dòng SSE; trả về dict event, "[DONE]" hoặc None nếu bỏ qua"""
+        line = raw_line.decode("utf-8", errors="ignore").strip()
         
-        # Shouldn't reach here, but just in case
+        if not line or line.startswith(":") or not line.startswith("data:"):
+            return None
+        
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return data
+        
+        try:
+            return json.loads(data)
+        except json.JSONDecodeError:
+            logger.warning(f"Bỏ qua SSE chunk không hợp lệ: {data[:100]}")
+            return None
+    
+    async def collect_stream(self,
+                           messages: List[LLMMessage],
+                           on_token: Callable[[str], Any],
+                           temperature: Optional[float] = None,
+                           max_tokens: Optional[int] = None,
+                           use_cache: bool = True,
+                           response_format: Optional[Dict[str, Any]] = None) -> LLMResponse:
+        """
+        Chạy streaming completion, gọi on_token cho mỗi delta và trả về LLMResponse cuối
+        """
+        final_response: Optional[LLMResponse] = None
+        
+        with get_tracer().span("llm.chat_completion", CATEGORY_LLM, model=self.config.model, streamed=True) as span:
+            async for chunk in self.stream_chat_completion(
+                messages, temperature, max_tokens, use_cache=use_cache, response_format=response_format
+            ):
+                if chunk.done:
+                    final_response = chunk.response
+                elif chunk.delta:
+                    on_token(chunk.delta)
+            
+            final_response = final_response or LLMResponse(
+                content="",
+                usage={},
+                model=self.config.model,
+                success=False,
+                error="Stream ended without response"
+            )
+            
+            span.set(
+                prompt_tokens=final_response.usage.get("prompt_tokens", 0),
+                completion_tokens=final_response.usage.get("completion_tokens", 0)
+            )
+            if not final_response.success:
+                span.error = final_response.error
+        
+        return final_response
+    
+    def _get_cache_key(self, payload: Dict[str, Any]) -> str:
+        """Tạo cache key từ payload đã resolve default"""
+        return LLMResponseCache.make_key(
+            payload["model"],
+            payload["messages"],
+            payload["temperature"],
+            payload["max_tokens"],
+            payload.get("response_format")
+        )
+    
+    def _lookup_cache(self, cache_key: str) -> Optional[LLMResponse]:
+        """Tra cứu response cache, trả về LLMResponse nếu hit"""
+        entry = self.cache.get(cache_key)
+        if entry is None:
+            return None
+        
+        logger.info(f"LLM cache hit: {cache_key[:12]}")
+        return LLMResponse(
+            content=entry["content"],
+            usage=entry["usage"],
+            model=entry["model"],
+            success=True,
+            metadata={"cache_hit": True}
+        )
+    
+    def _cache_miss_response(self) -> LLMResponse:
+        """Response lỗi khi miss trong chế độ cache_only"""
         return LLMResponse(
             content="",
             usage={},
             model=self.config.model,
             success=False,
-            error="Max retries exceeded"
+            error="LLM cache miss (cache_only mode)"
+        )
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê response cache (rỗng nếu không bật cache)"""
+        return self.cache.get_stats() if self.cache else {}
+    
+    def get_coalescing_stats(self) -> Dict[str, Any]:
+        """Thống kê gộp request LLM đang bay (dùng chung trong event loop)"""
+        return get_shared_singleflight("llm").get_stats()
+    
+    def get_prompt_cache_stats(self) -> Dict[str, Any]:
+        """Token prompt thuộc prefix ổn định (cache được) và token provider báo đã cache"""
+        stats = dict(self._prompt_cache_stats)
+        stats["hints"] = self.config.prompt_cache_hints
+        stats["cacheable_ratio"] = (
+            round(stats["cacheable_prefix_tokens"] / stats["prompt_tokens"], 3) if stats["prompt_tokens"] else 0.0
         )
+        return stats
+    
+    def get_preflight_stats(self) -> Dict[str, Any]:
+        """Số request được kiểm tra kích thước / bị co max_tokens / bị từ chối trước khi gửi"""
+        return {
+            "context_window": context_limit(self.config.model, self.config.context_window),
+            **self._preflight_stats
+        }
+    
+    def get_rate_limit_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê rate limiter (rỗng nếu client chưa gửi request nào)"""
+        return self.rate_limiter.get_stats() if self.rate_limiter else {}
     
     def _parse_success_response(self, response_data: Dict[str, Any]) -> LLMResponse:
         """Parse thành công response từ API"""
@@ -198,40 +752,80 @@ class LLMClient:
                           prompt: str,
                           system_message: Optional[str] = None,
                           temperature: Optional[float] = None,
-                          max_tokens: Optional[int] = None) -> LLMResponse:
+                          max_tokens: Optional[int] = None,
+                          on_token: Optional[Callable[[str], Any]] = None,
+                          use_cache: bool = True,
+                          response_format: Optional[Dict[str, Any]] = None,
+                          cache_prefix_chars: int = 0) -> LLMResponse:
         """
         Convenience method cho single prompt
+        
+        Nếu có on_token, response được stream và on_token nhận từng delta text.
+        cache_prefix_chars: số ký tự đầu của prompt là phần tĩnh (xem prompt_assembly).
         """
         messages = []
         
         if system_message:
             messages.append(LLMMessage(role="system", content=system_message))
             
-        messages.append(LLMMessage(role="user", content=prompt))
+        messages.append(LLMMessage(role="user", content=prompt, cache_prefix_chars=cache_prefix_chars))
+        
+        if on_token:
+            return await self.collect_stream(
+                messages, on_token, temperature, max_tokens,
+                use_cache=use_cache, response_format=response_format
+            )
         
         return await self.chat_completion(
             messages=messages,
             temperature=temperature,
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            use_cache=use_cache,
+            response_format=response_format
         )
     
     async def continue_conversation(self,
                                   conversation_history: List[LLMMessage],
                                   new_message: str,
                                   temperature: Optional[float] = None,
-                                  max_tokens: Optional[int] = None) -> LLMResponse:
+                                  max_tokens: Optional[int] = None,
+                                  on_token: Optional[Callable[[str], Any]] = None,
+                                  use_cache: bool = True,
+                                  response_format: Optional[Dict[str, Any]] = None,
+                                  cache_prefix_chars: int = 0) -> LLMResponse:
         """
         Tiếp tục cuộc hội thoại với lịch sử
         """
         messages = conversation_history.copy()
-        messages.append(LLMMessage(role="user", content=new_message))
+        messages.append(LLMMessage(role="user", content=new_message, cache_prefix_chars=cache_prefix_chars))
+        
+        if on_token:
+            return await self.collect_stream(
+                messages, on_token, temperature, max_tokens,
+                use_cache=use_cache, response_format=response_format
+            )
         
         return await self.chat_completion(
             messages=messages,
             temperature=temperature,
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            use_cache=use_cache,
+            response_format=response_format
         )
 
+_CONTEXT_OVERFLOW_PATTERN = re.compile(
+    r"context.?length|context.?window|maximum context|too many tokens|prompt is too long|token limit",
+    re.IGNORECASE
+)
+
+def _is_context_overflow(status: int, error_body: str) -> bool:
+    """Lỗi do prompt vượt context window của model (retry không giúp được)"""
+    return status in (400, 413) and bool(_CONTEXT_OVERFLOW_PATTERN.search(error_body))
+
+def _cache_part(text: str) -> Dict[str, Any]:
+    """Content part đánh dấu breakpoint prompt cache (kiểu Anthropic)"""
+    return {"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}
+
 class PromptLoader:
     """
     Utility class để load và quản lý prompts từ files
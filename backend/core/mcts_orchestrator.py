@@ -5,16 +5,33 @@ MCTS Orchestrator - Quy trình chính điều phối toàn bộ hệ thống
 import asyncio
 import logging
 import json
-from typing import Dict, List, Optional, Any, Tuple
-from dataclasses import dataclass, field
+import os
+from typing import Dict, List, Optional, Any, Tuple, Callable, Awaitable
+from dataclasses import dataclass, field, asdict
 from datetime import datetime
 from enum import Enum
 
 from backend.config import MCTSConfig, DEFAULT_CONFIG
 from backend.core.llm_client import LLMClient
+from backend.core.llm_cache import LLMResponseCache
+from backend.core.http_transport import HTTPTransport
 from backend.core.esv_module import ESVModule, create_search_query
+from backend.core.esv_cache import ESVResultCache
+from backend.core.keyword_extractor import KeywordExtractor
+from backend.core.idea_index import IdeaIndex
+from backend.core.idea_model import Idea, parse_ideas, ideas_to_dicts, ideas_from_dicts
+from backend.core.novelty_index import NoveltyIndex
+from backend.core.session_journal import (
+    SessionJournal, RECORD_SESSION_START, RECORD_STEP, RECORD_ITERATION, RECORD_SESSION_COMPLETE,
+    serialize_agent_output, deserialize_agent_output, to_jsonable
+)
+from backend.core.session_store import BlobStore, blob_root, save_session
+from backend.core.tracing import (
+    Tracer, set_tracer, reset_tracer, TRACE_FILENAME, CHROME_TRACE_FILENAME,
+    CATEGORY_SESSION, CATEGORY_PHASE, CATEGORY_LOOP, CATEGORY_AGENT, CATEGORY_ESV
+)
 from backend.core.scoring_system import ScoringSystem, ScoreType, CompositeScore, create_scores_from_text
-from backend.agents.base_agent import AgentOrchestrator, create_agent_input
+from backend.agents.base_agent import AgentOrchestrator, AgentInput, AgentOutput, BaseAgent, create_agent_input
 from backend.agents.primary_agent import PrimaryAgent, AnalysisTask, IdeaGenerationTask
 from backend.agents.critical_thinking_agent import CriticalThinkingAgent, CriticalAnalysisTask
 from backend.agents.adversarial_expert_agent import AdversarialExpertAgent, AdversarialAttackTask, AdversarialRole, get_role_from_string
@@ -46,6 +63,7 @@ class MCTSSession:
     ideas_iteration: int = 0
     analysis_results: str = ""
     ideas_results: str = ""
+    ideas: List[Dict[str, Any]] = field(default_factory=list)  # Idea.to_dict() của ideas_results
     iteration_history: List[Dict[str, Any]] = field(default_factory=list)
     user_checkpoints: List[Dict[str, Any]] = field(default_factory=list)
     final_deliverables: Dict[str, Any] = field(default_factory=dict)
@@ -57,14 +75,29 @@ class MCTSOrchestrator:
     Main orchestrator cho toàn bộ hệ thống MCTS
     """
     
-    def __init__(self, config: MCTSConfig = None):
+    def __init__(self,
+                 config: MCTSConfig = None,
+                 transport: Optional[HTTPTransport] = None,
+                 llm_limiter: Optional[Any] = None):
         self.config = config or DEFAULT_CONFIG
         self.session: Optional[MCTSSession] = None
         
+        # HTTP transport dùng chung; chỉ đóng khi orchestrator tự tạo
+        self.transport: Optional[HTTPTransport] = transport
+        self._owns_transport = transport is None
+        
+        # Giới hạn số LLM request đang bay, dùng chung giữa nhiều sessions (vd. batch runner)
+        self.llm_limiter = llm_limiter
+        
         # Components
         self.llm_client: Optional[LLMClient] = None
+        self.llm_cache: Optional[LLMResponseCache] = None
         self.agent_orchestrator: Optional[AgentOrchestrator] = None
         self.esv_module: Optional[ESVModule] = None
+        self.esv_cache: Optional[ESVResultCache] = None
+        self.keyword_extractor: Optional[KeywordExtractor] = None
+        self.idea_index: Optional[IdeaIndex] = None
+        self.novelty_index: Optional[NoveltyIndex] = None
         self.scoring_system: ScoringSystem = ScoringSystem(
             self.config.weights, 
             self.config.red_flag_threshold
@@ -80,6 +113,15 @@ class MCTSOrchestrator:
         self._next_instructions_analysis: Optional[Dict[str, Any]] = None
         self._next_instructions_ideas: Optional[Dict[str, Any]] = None
         self._last_idea_diversity: Optional[Dict[str, Any]] = None
+        self._last_idea_novelty: Optional[Dict[str, Any]] = None
+        
+        # Checkpoint journal và các bước đã hoàn thành cần replay khi resume
+        self.journal: Optional[SessionJournal] = None
+        self._replay_steps: Dict[str, Dict[str, Any]] = {}
+        self._journaled_iterations: set = set()
+        
+        # Tracer của session đang chạy (span cho phase/loop/agent/HTTP/ESV)
+        self.tracer: Tracer = Tracer(enabled=False)
         
     async def __aenter__(self):
         """Async context manager entry"""
@@ -94,12 +136,37 @@ class MCTSOrchestrator:
         """Khởi tạo tất cả components"""
         logger.info("Initializing MCTS Orchestrator...")
         
+        # Initialize LLM response cache
+        if self.config.enable_llm_cache:
+            self.llm_cache = LLMResponseCache(
+                f"{self.config.output_dir}/llm_cache.sqlite3",
+                ttl=self.config.llm_cache_ttl,
+                max_entries=self.config.llm_cache_max_entries,
+                mode=self.config.llm_cache_mode
+            )
+        
+        # Initialize near-duplicate idea index
+        if self.config.enable_idea_index:
+            self.idea_index = IdeaIndex(
+                f"{self.config.output_dir}/idea_index.sqlite3",
+                threshold=self.config.idea_duplicate_threshold
+            )
+        
+        # Initialize shared HTTP transport
+        if self.transport is None:
+            self.transport = HTTPTransport(self.config.http)
+        
         # Initialize LLM client
-        self.llm_client = LLMClient(self.config.llm)
+        self.llm_client = LLMClient(
+            self.config.llm,
+            cache=self.llm_cache,
+            transport=self.transport,
+            limiter=self.llm_limiter
+        )
         await self.llm_client.start_session()
         
         # Initialize agent orchestrator
-        self.agent_orchestrator = AgentOrchestrator(self.config)
+        self.agent_orchestrator = AgentOrchestrator(self.config, llm_client=self.llm_client)
         await self.agent_orchestrator.__aenter__()
         
         # Initialize agents
@@ -116,8 +183,32 @@ class MCTSOrchestrator:
         
         # Initialize ESV module
         if self.config.enable_external_validation:
-            self.esv_module = ESVModule()
+            if self.config.enable_esv_cache:
+                self.esv_cache = ESVResultCache(
+                    f"{self.config.output_dir}/esv_cache.sqlite3",
+                    ttls=self.config.esv_cache_ttls,
+                    negative_ttl=self.config.esv_cache_negative_ttl,
+                    stale_ttl=self.config.esv_cache_stale_ttl,
+                    max_entries=self.config.esv_cache_max_entries,
+                    max_bytes=self.config.esv_cache_max_mb * 1024 * 1024
+                )
+            self.esv_module = ESVModule(transport=self.transport, result_cache=self.esv_cache)
             await self.esv_module.start_session()
+            
+            if self.config.esv_keyword_idf:
+                self.keyword_extractor = KeywordExtractor.from_sessions(self.config.output_dir)
+            else:
+                self.keyword_extractor = KeywordExtractor()
+            
+            if self.config.enable_novelty_index:
+                self.novelty_index = NoveltyIndex(
+                    f"{self.config.output_dir}/novelty_index.sqlite3",
+                    check_ttl=self.config.novelty_check_ttl
+                )
+                # Lần đầu: build từ các kết quả ESV đã cache
+                if self.esv_cache and self.novelty_index.document_count() == 0:
+                    self.novelty_index.add_documents(self.esv_cache.iter_results())
+                self.novelty_index.add_known_products(self.config.novelty_known_products)
         
         logger.info("✅ MCTS Orchestrator initialized successfully")
     
@@ -134,13 +225,39 @@ class MCTSOrchestrator:
         if self.esv_module:
             await self.esv_module.close_session()
         
+        if self.esv_cache:
+            logger.info(f"ESV cache stats: {self.esv_cache.get_stats()}")
+            self.esv_cache.close()
+        
+        if self.idea_index:
+            logger.info(f"Idea index stats: {self.idea_index.get_stats()}")
+            self.idea_index.close()
+        
+        if self.novelty_index:
+            logger.info(f"Novelty index stats: {self.novelty_index.get_stats()}")
+            self.novelty_index.close()
+        
+        if self.llm_cache:
+            logger.info(f"LLM cache stats: {self.llm_cache.get_stats()}")
+            self.llm_cache.close()
+        
+        if self.transport and self._owns_transport:
+            await self.transport.close()
+        
         logger.info("✅ MCTS Orchestrator cleanup completed")
     
+    def set_stream_handler(self, handler: Optional[Callable[[str, str, int], Any]]):
+        """Stream token của tất cả agents tới handler(agent_type, delta, stream_id)"""
+        for agent in (self.primary_agent, self.ct_agent, self.ae_agent, self.sa_agent):
+            if agent:
+                agent.set_stream_handler(handler)
+    
     async def run_full_analysis(self, 
                               data_sources: List[Dict[str, Any]],
                               timeframe: Dict[str, str],
                               focus_areas: List[str],
-                              user_preferences: Optional[Dict[str, Any]] = None) -> MCTSSession:
+                              user_preferences: Optional[Dict[str, Any]] = None,
+                              session_id: Optional[str] = None) -> MCTSSession:
         """
         Chạy toàn bộ quy trình MCTS
         
@@ -149,13 +266,14 @@ class MCTSOrchestrator:
             timeframe: Dict với 'start' và 'end' dates
             focus_areas: List các lĩnh vực tập trung
             user_preferences: Optional user preferences
+            session_id: Optional session ID (mặc định sinh theo thời gian)
         
         Returns:
             MCTSSession với kết quả cuối cùng
         """
         
         # Create new session
-        session_id = f"mcts_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        session_id = session_id or f"mcts_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         self.session = MCTSSession(
             session_id=session_id,
             config=self.config
@@ -163,26 +281,198 @@ class MCTSOrchestrator:
         
         logger.info(f"🚀 Starting MCTS Analysis Session: {session_id}")
         
+        if self.config.enable_checkpointing and self.journal is None:
+            self.journal = SessionJournal.for_session(self.config.output_dir, session_id)
+            self.journal.append(
+                RECORD_SESSION_START,
+                session_id=session_id,
+                data_sources=data_sources,
+                timeframe=timeframe,
+                focus_areas=focus_areas,
+                user_preferences=user_preferences,
+                settings={
+                    "max_analysis_loops": self.config.max_analysis_loops,
+                    "max_idea_loops": self.config.max_idea_loops,
+                    "enable_external_validation": self.config.enable_external_validation,
+                    "adversarial_roles": self.config.adversarial_roles
+                }
+            )
+        
+        self.tracer = Tracer(
+            os.path.join(self.config.output_dir, session_id, TRACE_FILENAME),
+            enabled=self.config.enable_tracing
+        )
+        tracer_token = set_tracer(self.tracer)
+        
         try:
-            # Phase 1: Analysis Loops
-            await self._run_analysis_phase(data_sources, timeframe, focus_areas)
-            
-            # Phase 2: Ideas Loops  
-            await self._run_ideas_phase()
-            
-            # Phase 3: Finalization
-            await self._run_finalization_phase()
+            with self.tracer.span("session", CATEGORY_SESSION, session_id=session_id,
+                                  resumed=bool(self._replay_steps)):
+                # Phase 1: Analysis Loops
+                with self.tracer.span("phase.analysis", CATEGORY_PHASE):
+                    await self._run_analysis_phase(data_sources, timeframe, focus_areas)
+                
+                # Phase 2: Ideas Loops  
+                with self.tracer.span("phase.ideas", CATEGORY_PHASE):
+                    await self._run_ideas_phase()
+                
+                # Phase 3: Finalization
+                with self.tracer.span("phase.finalization", CATEGORY_PHASE):
+                    await self._run_finalization_phase()
             
             # Mark completion
             self.session.current_phase = MCTSPhase.COMPLETED
             self.session.end_time = datetime.now()
             
+            if self.journal:
+                self.journal.append(RECORD_SESSION_COMPLETE, session_id=session_id)
+            
             logger.info(f"✅ MCTS Analysis Session completed: {session_id}")
             return self.session
             
         except Exception as e:
             logger.error(f"❌ Error in MCTS session {session_id}: {str(e)}")
             raise
+        
+        finally:
+            reset_tracer(tracer_token)
+            self._export_chrome_trace()
+    
+    def _export_chrome_trace(self):
+        """Ghi Chrome trace của session (kể cả khi session lỗi giữa chừng)"""
+        if not self.tracer.enabled or not self.config.trace_chrome_export:
+            return
+        
+        try:
+            self.tracer.export_chrome_trace(
+                os.path.join(self.config.output_dir, self.session.session_id, CHROME_TRACE_FILENAME)
+            )
+        except OSError as e:
+            logger.warning(f"Failed to export Chrome trace: {str(e)}")
+    
+    async def resume_session(self, session_id: str) -> MCTSSession:
+        """
+        Tiếp tục session từ journal checkpoint.
+        
+        Các bước đã ghi trong journal được replay (khôi phục output và state của agent)
+        mà không gọi lại LLM; session chạy tiếp từ bước đầu tiên chưa hoàn thành.
+        """
+        journal = SessionJournal.for_session(self.config.output_dir, session_id)
+        start_record = journal.get_session_start()
+        
+        if not start_record:
+            raise ValueError(f"Không tìm thấy checkpoint cho session {session_id} trong {journal.path}")
+        
+        records = journal.read()
+        self.journal = journal
+        self._replay_steps = {r["key"]: r for r in records if r["type"] == RECORD_STEP}
+        self._journaled_iterations = {
+            (r["phase"], r["iteration"]) for r in records if r["type"] == RECORD_ITERATION
+        }
+        
+        logger.info(f"♻️ Resuming session {session_id}: {len(self._replay_steps)} completed step(s) to replay")
+        
+        session = await self.run_full_analysis(
+            data_sources=start_record.get("data_sources", []),
+            timeframe=start_record.get("timeframe", {}),
+            focus_areas=start_record.get("focus_areas", []),
+            user_preferences=start_record.get("user_preferences"),
+            session_id=session_id
+        )
+        
+        if self._replay_steps:
+            logger.warning(f"{len(self._replay_steps)} journaled step(s) were not replayed (config changed?)")
+            self._replay_steps = {}
+        
+        return session
+    
+    def _current_iteration(self) -> int:
+        if self.session.current_loop_type == LoopType.IDEAS:
+            return self.session.ideas_iteration
+        return self.session.analysis_iteration
+    
+    def _step_key(self, step: str) -> str:
+        """Key của một bước trong journal: <phase>:<iteration>:<step>"""
+        loop_type = self.session.current_loop_type.value if self.session.current_loop_type else "init"
+        return f"{loop_type}:{self._current_iteration()}:{step}"
+    
+    def _export_checkpoint_state(self, include_esv_cache: bool = False) -> Dict[str, Any]:
+        """State của orchestrator cần để tiếp tục vòng lặp"""
+        state = {
+            "next_instructions_analysis": self._next_instructions_analysis,
+            "next_instructions_ideas": self._next_instructions_ideas,
+            "last_idea_diversity": self._last_idea_diversity,
+            "last_idea_novelty": self._last_idea_novelty
+        }
+        if include_esv_cache and self.esv_module:
+            state["esv_cache"] = self.esv_module.export_cache()
+        return state
+    
+    def _restore_checkpoint_state(self, state: Dict[str, Any]):
+        self._next_instructions_analysis = state.get("next_instructions_analysis")
+        self._next_instructions_ideas = state.get("next_instructions_ideas")
+        self._last_idea_diversity = state.get("last_idea_diversity")
+        self._last_idea_novelty = state.get("last_idea_novelty")
+        if state.get("esv_cache") and self.esv_module:
+            self.esv_module.import_cache(state["esv_cache"])
+    
+    def _pop_replay_step(self, key: str) -> Optional[Dict[str, Any]]:
+        """Lấy bước đã hoàn thành từ journal (nếu đang resume) và khôi phục state"""
+        record = self._replay_steps.pop(key, None)
+        if record is not None:
+            self._restore_checkpoint_state(record.get("state", {}))
+            logger.info(f"⏩ Replayed step {key} from checkpoint")
+        return record
+    
+    def _journal_step(self, key: str, include_esv_cache: bool = False, **data):
+        if self.journal:
+            self.journal.append(
+                RECORD_STEP,
+                key=key,
+                state=self._export_checkpoint_state(include_esv_cache),
+                **data
+            )
+    
+    def _journal_iteration(self, phase: str, iteration: int, loop_result: Dict[str, Any]):
+        """Ghi tóm tắt vòng lặp vừa xong (bỏ qua nếu đã có từ lần chạy trước)"""
+        if not self.journal or (phase, iteration) in self._journaled_iterations:
+            return
+        self._journaled_iterations.add((phase, iteration))
+        self.journal.append(
+            RECORD_ITERATION,
+            phase=phase,
+            iteration=iteration,
+            overall_score=loop_result.get("overall_score", 0),
+            decision=loop_result.get("decision"),
+            red_flags=loop_result.get("red_flags", 0)
+        )
+    
+    async def _run_agent_step(self,
+                              step: str,
+                              agent: BaseAgent,
+                              agent_input: AgentInput,
+                              runner: Optional[Callable[[AgentInput], Awaitable[AgentOutput]]] = None) -> AgentOutput:
+        """Chạy một bước agent có checkpoint: replay nếu đã có trong journal, ngược lại gọi agent và ghi journal"""
+        key = self._step_key(step)
+        
+        with self.tracer.span(f"agent.{step}", CATEGORY_AGENT,
+                              agent_type=agent.agent_type, iteration=agent_input.iteration) as span:
+            record = self._pop_replay_step(key)
+            if record is not None:
+                agent.restore_state(record.get("agent_state", {}))
+                span.set(replayed=True)
+                return deserialize_agent_output(record["output"])
+            
+            tokens_before = agent.total_tokens
+            output = await (runner or agent.process)(agent_input)
+            span.set(tokens=agent.total_tokens - tokens_before)
+            
+            # Chỉ checkpoint bước thành công; bước lỗi sẽ được chạy lại khi resume
+            if output.success:
+                self._journal_step(key, output=serialize_agent_output(output), agent_state=agent.export_state())
+            else:
+                span.error = output.error
+            
+            return output
     
     async def _run_analysis_phase(self, 
                                 data_sources: List[Dict[str, Any]],
@@ -201,9 +491,11 @@ class MCTSOrchestrator:
             logger.info(f"🔄 Analysis Loop {self.session.analysis_iteration}")
             
             # Run single analysis loop
-            loop_result = await self._run_single_analysis_loop(
-                data_sources, timeframe, focus_areas
-            )
+            with self.tracer.span("loop.analysis", CATEGORY_LOOP, iteration=self.session.analysis_iteration) as span:
+                loop_result = await self._run_single_analysis_loop(
+                    data_sources, timeframe, focus_areas
+                )
+                span.set(decision=loop_result.get("decision"), overall_score=loop_result.get("overall_score"))
             
             # Record iteration
             self.session.iteration_history.append({
@@ -212,6 +504,7 @@ class MCTSOrchestrator:
                 "timestamp": datetime.now().isoformat(),
                 "result": loop_result
             })
+            self._journal_iteration("analysis", self.session.analysis_iteration, loop_result)
             
             # Check completion criteria
             if loop_result["decision"] == "stop":
@@ -259,7 +552,7 @@ class MCTSOrchestrator:
             iteration=iteration
         )
         
-        primary_output = await self.primary_agent.process(primary_input)
+        primary_output = await self._run_agent_step("primary", self.primary_agent, primary_input)
         
         if not primary_output.success:
             raise Exception(f"Primary agent failed: {primary_output.error}")
@@ -274,7 +567,6 @@ class MCTSOrchestrator:
         )
         
         ct_input = create_agent_input(data=ct_task, iteration=iteration)
-        ct_output = await self.ct_agent.process(ct_input)
         
         # Step 3: Adversarial Expert Analysis
         ae_roles = [get_role_from_string(role) for role in self.config.adversarial_roles[:2]]
@@ -289,12 +581,11 @@ class MCTSOrchestrator:
         )
         
         ae_input = create_agent_input(data=ae_task, iteration=iteration)
-        ae_output = await self.ae_agent.process(ae_input)
         
-        # Step 4: ESV Validation (if enabled)
-        esv_results = None
-        if self.esv_module:
-            esv_results = await self._run_esv_validation(primary_output.content, "analysis")
+        # Step 4: CT, AE và ESV (nếu bật) chạy song song trên cùng primary output
+        ct_output, ae_output, esv_results = await self._run_review_stage(
+            ct_input, ae_input, primary_output.content, "analysis"
+        )
         
         # Step 5: Synthesis & Assessment
         synthesis_task = SynthesisTask(
@@ -316,13 +607,13 @@ class MCTSOrchestrator:
             iteration=iteration
         )
         
-        sa_output = await self.sa_agent.process(sa_input)
+        sa_output = await self._run_agent_step("sa", self.sa_agent, sa_input)
         
         if not sa_output.success:
             raise Exception(f"Synthesis agent failed: {sa_output.error}")
         
         # Extract scores và decision
-        scores_data = create_scores_from_text(sa_output.content, ScoreType.ANALYSIS, self.config.weights)
+        scores_data = self._scores_from_sa_output(sa_output, ScoreType.ANALYSIS)
         composite_score = self.scoring_system.calculate_score(scores_data, ScoreType.ANALYSIS)
 
         # Prefer structured decision from SA metadata if available
@@ -362,7 +653,9 @@ class MCTSOrchestrator:
             logger.info(f"🔄 Ideas Loop {self.session.ideas_iteration}")
             
             # Run single ideas loop
-            loop_result = await self._run_single_ideas_loop()
+            with self.tracer.span("loop.ideas", CATEGORY_LOOP, iteration=self.session.ideas_iteration) as span:
+                loop_result = await self._run_single_ideas_loop()
+                span.set(decision=loop_result.get("decision"), overall_score=loop_result.get("overall_score"))
             
             # Record iteration
             self.session.iteration_history.append({
@@ -371,11 +664,13 @@ class MCTSOrchestrator:
                 "timestamp": datetime.now().isoformat(),
                 "result": loop_result
             })
+            self._journal_iteration("ideas", self.session.ideas_iteration, loop_result)
             
             # Check completion criteria
             if loop_result["decision"] == "stop":
                 ideas_complete = True
                 self.session.ideas_results = loop_result["primary_output"]
+                self.session.ideas = loop_result.get("ideas", [])
                 logger.info("✅ Ideas phase completed - quality achieved")
             elif loop_result["decision"] == "user_checkpoint":
                 # Handle user checkpoint
@@ -383,6 +678,7 @@ class MCTSOrchestrator:
                 if checkpoint_result["action"] == "stop":
                     ideas_complete = True
                     self.session.ideas_results = loop_result["primary_output"]
+                    self.session.ideas = loop_result.get("ideas", [])
         
         if not ideas_complete:
             logger.warning("⚠️ Ideas phase stopped due to max iterations")
@@ -391,6 +687,7 @@ class MCTSOrchestrator:
             if ideas_iterations:
                 best_iteration = max(ideas_iterations, key=lambda x: x["result"].get("overall_score", 0))
                 self.session.ideas_results = best_iteration["result"]["primary_output"]
+                self.session.ideas = best_iteration["result"].get("ideas", [])
     
     async def _run_single_ideas_loop(self) -> Dict[str, Any]:
         """Chạy một vòng lặp tạo ý tưởng"""
@@ -431,42 +728,88 @@ class MCTSOrchestrator:
             iteration=iteration
         )
         
-        primary_output = await self.primary_agent.process(primary_input)
+        if self.config.idea_best_of_n > 1:
+            primary_output = await self._run_agent_step(
+                "primary", self.primary_agent, primary_input, runner=self._run_best_of_n_ideas
+            )
+        else:
+            primary_output = await self._run_agent_step("primary", self.primary_agent, primary_input)
         
         if not primary_output.success:
             raise Exception(f"Primary agent failed: {primary_output.error}")
         
+        # Ý tưởng lặp lại ý tưởng của các session trước: yêu cầu Primary tạo lại trước khi tốn CT/AE/SA
+        ideas = self._ideas_from_output(primary_output)
+        near_duplicates = self._find_near_duplicate_ideas(ideas)
+        
+        for attempt in range(1, self.config.idea_duplicate_max_regenerations + 1):
+            if not ideas or len(near_duplicates) < self.config.idea_duplicate_reject_ratio * len(ideas):
+                break
+            
+            logger.info(f"♻️ {len(near_duplicates)}/{len(ideas)} ý tưởng gần trùng với session trước, tạo lại (lần {attempt})")
+            retry_input = create_agent_input(
+                data=ideas_task,
+                context={
+                    **primary_input.context,
+                    "rejected_duplicate_ideas": near_duplicates,
+                    "diversity_guidance": primary_input.context["diversity_guidance"]
+                        + " Các ý tưởng trong rejected_duplicate_ideas đã được đề xuất ở các phiên trước; thay thế chúng bằng ý tưởng mới hoàn toàn."
+                },
+                iteration=iteration
+            )
+            retry_output = await self._run_agent_step(f"primary_dedup_{attempt}", self.primary_agent, retry_input)
+            if not retry_output.success:
+                break
+            
+            primary_output = retry_output
+            ideas = self._ideas_from_output(primary_output)
+            near_duplicates = self._find_near_duplicate_ideas(ideas)
+        
         # Phân tích đa dạng ý tưởng để cung cấp ngữ cảnh cho các agent khác
-        idea_diversity = self._analyze_idea_diversity(primary_output.content)
+        idea_diversity = self._analyze_idea_diversity(ideas)
+        if near_duplicates:
+            idea_diversity["near_duplicates"] = near_duplicates
+            idea_diversity.setdefault("insights", []).append(
+                f"Có {len(near_duplicates)} ý tưởng gần trùng với ý tưởng của các phiên trước; cần khác biệt rõ rệt hơn."
+            )
         self._last_idea_diversity = idea_diversity
 
         # Đánh giá novelty dựa trên ESV cho từng ý tưởng (nếu ESV bật)
         idea_novelty = None
-        if self.esv_module and idea_diversity.get("idea_names"):
-            try:
-                idea_novelty = await self._evaluate_idea_novelty(idea_diversity.get("idea_names", []))
+        if self.esv_module and ideas:
+            novelty_key = self._step_key("novelty")
+            record = self._pop_replay_step(novelty_key)
+            if record is not None:
+                idea_novelty = record.get("result") or {}
                 self._last_idea_novelty = idea_novelty
-            except Exception as _e:
-                logger.warning(f"Idea novelty evaluation failed: {_e}")
-                self._last_idea_novelty = {}
+            else:
+                try:
+                    with self.tracer.span("esv.novelty", CATEGORY_ESV):
+                        idea_novelty = await self._evaluate_idea_novelty([idea.name for idea in ideas])
+                    self._last_idea_novelty = idea_novelty
+                    self._journal_step(novelty_key, include_esv_cache=True, result=idea_novelty)
+                except Exception as _e:
+                    logger.warning(f"Idea novelty evaluation failed: {_e}")
+                    self._last_idea_novelty = {}
 
         # Step 2: Critical Thinking Analysis
         ct_task = CriticalAnalysisTask(
             content_to_analyze=primary_output.content,
             content_type="ideas",
             focus_areas=["feasibility", "market_potential", "business_model"],
-            iteration=iteration
+            iteration=iteration,
+            ideas=ideas
         )
         
         ct_input = create_agent_input(
             data=ct_task,
             context={
+                "ideas": [idea.ref() for idea in ideas],
                 "idea_diversity_analysis": idea_diversity,
                 "idea_novelty": idea_novelty or {}
             },
             iteration=iteration
         )
-        ct_output = await self.ct_agent.process(ct_input)
         
         # Step 3: Adversarial Expert Attack
         ae_roles = [get_role_from_string(role) for role in self.config.adversarial_roles]
@@ -477,23 +820,24 @@ class MCTSOrchestrator:
             content_type="ideas",
             active_roles=ae_roles,
             attack_intensity="aggressive",  # More aggressive for ideas
-            iteration=iteration
+            iteration=iteration,
+            ideas=ideas
         )
         
         ae_input = create_agent_input(
             data=ae_task,
             context={
+                "ideas": [idea.ref() for idea in ideas],
                 "idea_diversity_analysis": idea_diversity,
                 "idea_novelty": idea_novelty or {}
             },
             iteration=iteration
         )
-        ae_output = await self.ae_agent.process(ae_input)
         
-        # Step 4: ESV Validation (if enabled)
-        esv_results = None
-        if self.esv_module:
-            esv_results = await self._run_esv_validation(primary_output.content, "ideas")
+        # Step 4: CT, AE và ESV (nếu bật) chạy song song trên cùng primary output
+        ct_output, ae_output, esv_results = await self._run_review_stage(
+            ct_input, ae_input, primary_output.content, "ideas", ideas=ideas
+        )
         
         # Step 5: Synthesis & Assessment
         synthesis_task = SynthesisTask(
@@ -502,7 +846,8 @@ class MCTSOrchestrator:
             ae_feedback=ae_output.content if ae_output.success else None,
             esv_results=esv_results,
             phase="ideas",
-            iteration=iteration
+            iteration=iteration,
+            ideas=ideas
         )
         
         sa_input = create_agent_input(
@@ -510,6 +855,7 @@ class MCTSOrchestrator:
             context={
                 "max_loops": self.config.max_idea_loops,
                 "phase": "ideas",
+                "ideas": [idea.ref() for idea in ideas],
                 "idea_diversity_analysis": idea_diversity,
                 "idea_novelty": idea_novelty or {},
                 "sa_prev_instructions": self._next_instructions_ideas or {}
@@ -517,14 +863,16 @@ class MCTSOrchestrator:
             iteration=iteration
         )
         
-        sa_output = await self.sa_agent.process(sa_input)
+        sa_output = await self._run_agent_step("sa", self.sa_agent, sa_input)
         
         if not sa_output.success:
             raise Exception(f"Synthesis agent failed: {sa_output.error}")
         
         # Extract scores và decision
-        scores_data = create_scores_from_text(sa_output.content, ScoreType.IDEAS, self.config.weights)
-        composite_score = self.scoring_system.calculate_score(scores_data, ScoreType.IDEAS)
+        scores_data = self._scores_from_sa_output(sa_output, ScoreType.IDEAS)
+        composite_score = self.scoring_system.calculate_score(
+            scores_data, ScoreType.IDEAS, metadata={"idea_ids": [idea.id for idea in ideas]}
+        )
 
         # Prefer structured decision from SA metadata if available
         sa_metadata = sa_output.metadata or {}
@@ -533,8 +881,13 @@ class MCTSOrchestrator:
         # Persist next round instructions for subsequent ideas loop
         self._next_instructions_ideas = loop_decision_md.get("next_round_instructions")
         
+        # Chèn ý tưởng của vòng này vào index (id theo vị trí nên replay khi resume không chèn trùng)
+        if self.idea_index and ideas:
+            self.idea_index.add_many(ideas, self.session.session_id, iteration)
+        
         return {
             "primary_output": primary_output.content,
+            "ideas": ideas_to_dicts(ideas),
             "ct_output": ct_output.content if ct_output.success else "",
             "ae_output": ae_output.content if ae_output.success else "",
             "sa_output": sa_output.content,
@@ -549,16 +902,98 @@ class MCTSOrchestrator:
             }
         }
     
-    async def _run_esv_validation(self, content: str, content_type: str) -> Optional[Dict[str, Any]]:
+    async def _run_review_stage(self,
+                                ct_input: AgentInput,
+                                ae_input: AgentInput,
+                                content: str,
+                                content_type: str,
+                                ideas: Optional[List[Idea]] = None) -> Tuple[AgentOutput, AgentOutput, Optional[Dict[str, Any]]]:
+        """Fan-out CT, AE và ESV song song, join lại trước khi chạy SA.
+
+        Mỗi nhánh có timeout riêng; nhánh lỗi/timeout không làm hỏng các nhánh khác
+        (CT/AE trả về AgentOutput với success=False, ESV trả về None).
+        """
+        timeout = self.config.review_branch_timeout
+        
+        ct_output, ae_output, esv_results = await asyncio.gather(
+            self._run_agent_branch("ct", self.ct_agent, ct_input, timeout),
+            self._run_agent_branch("ae", self.ae_agent, ae_input, timeout),
+            self._run_esv_branch(content, content_type, timeout, ideas)
+        )
+        
+        return ct_output, ae_output, esv_results
+    
+    async def _run_agent_branch(self,
+                                step: str,
+                                agent: BaseAgent,
+                                agent_input: AgentInput,
+                                timeout: float) -> AgentOutput:
+        """Chạy một agent trong review stage với timeout và bắt lỗi riêng"""
+        
+        try:
+            return await asyncio.wait_for(self._run_agent_step(step, agent, agent_input), timeout=timeout)
+        except asyncio.TimeoutError:
+            error_msg = f"Timeout sau {timeout}s"
+        except Exception as e:
+            error_msg = str(e)
+        
+        logger.warning(f"Review branch {agent.agent_type} failed: {error_msg}")
+        return AgentOutput(
+            content="",
+            success=False,
+            agent_type=agent.agent_type,
+            error=error_msg,
+            iteration=agent_input.iteration
+        )
+    
+    async def _run_esv_branch(self,
+                              content: str,
+                              content_type: str,
+                              timeout: float,
+                              ideas: Optional[List[Idea]] = None) -> Optional[Dict[str, Any]]:
+        """Chạy ESV validation trong review stage với timeout riêng"""
+        
+        if not self.esv_module:
+            return None
+        
+        key = self._step_key("esv")
+        record = self._pop_replay_step(key)
+        if record is not None:
+            return record.get("result")
+        
+        with self.tracer.span("esv.validate", CATEGORY_ESV, content_type=content_type) as span:
+            try:
+                esv_results = await asyncio.wait_for(
+                    self._run_esv_validation(content, content_type, ideas), timeout=timeout
+                )
+            except asyncio.TimeoutError:
+                logger.warning(f"ESV validation timeout sau {timeout}s")
+                span.error = f"Timeout sau {timeout}s"
+                return None
+        
+        if esv_results is not None:
+            esv_results = to_jsonable(esv_results)
+            self._journal_step(key, include_esv_cache=True, result=esv_results)
+        
+        return esv_results
+    
+    async def _run_esv_validation(self,
+                                  content: str,
+                                  content_type: str,
+                                  ideas: Optional[List[Idea]] = None) -> Optional[Dict[str, Any]]:
         """Chạy ESV validation"""
         
         if not self.esv_module:
             return None
         
         try:
-            # Extract key concepts cho validation
-            from backend.core.esv_module import extract_keywords_from_text
-            keywords = extract_keywords_from_text(content, max_keywords=3)
+            # Extract key concepts cho validation: với ý tưởng đã parse, chỉ dùng tên + giải pháp
+            # (bỏ phần mở đầu, metadata và các mục rủi ro/roadmap dài)
+            if ideas:
+                keyword_source = "\n".join(f"{idea.name}. {idea.solution}" for idea in ideas)
+            else:
+                keyword_source = content
+            keywords = self.keyword_extractor.extract(keyword_source, max_keywords=3)
             
             # Create search queries based on content type
             queries = []
@@ -592,6 +1027,9 @@ class MCTSOrchestrator:
             # Execute validation
             results = await self.esv_module.validate_multiple(queries)
             
+            if self.novelty_index:
+                self.novelty_index.add_documents(r for v in results.values() for r in v.results)
+            
             # Summarize results
             summary = {
                 "queries_executed": len(queries),
@@ -611,6 +1049,14 @@ class MCTSOrchestrator:
             logger.warning(f"ESV validation failed: {str(e)}")
             return None
     
+    def _scores_from_sa_output(self, sa_output: AgentOutput, score_type: ScoreType) -> Dict[str, float]:
+        """Điểm thô theo tiêu chí: dùng điểm SA đã parse (JSON hoặc bảng), parse lại text nếu không có"""
+        quality_scores = (sa_output.metadata or {}).get("quality_scores")
+        if quality_scores:
+            return {score["criterion"]: score["raw_score"] for score in quality_scores}
+        
+        return create_scores_from_text(sa_output.content, score_type, self.config.weights)
+    
     def _extract_decision_from_sa_output(self, sa_output: str) -> str:
         """Extract decision từ SA agent output"""
         
@@ -639,55 +1085,81 @@ class MCTSOrchestrator:
         else:
             return "continue"
 
-    def _analyze_idea_diversity(self, ideas_markdown: str) -> Dict[str, Any]:
-        """Phân tích đa dạng ý tưởng từ markdown output của Primary Agent.
+    async def _run_best_of_n_ideas(self, primary_input: AgentInput) -> AgentOutput:
+        """Best-of-N: tạo song song nhiều bộ ý tưởng, chấm điểm local và chỉ giữ bộ tốt nhất cho CT/AE/SA"""
+        candidates = await self.primary_agent.generate_idea_candidates(
+            primary_input,
+            n=self.config.idea_best_of_n,
+            temperature_spread=self.config.idea_temperature_spread,
+            style_variants=self.config.idea_style_variants
+        )
+        
+        successful = [c for c in candidates if c.success]
+        if not successful:
+            # Trả về lỗi của candidate đầu tiên để caller xử lý như một call đơn
+            return candidates[0]
+        
+        target_count = getattr(primary_input.data, "target_count", 5)
+        scored = [
+            (self._score_idea_candidate(self._analyze_idea_diversity(self._ideas_from_output(c)), target_count), c)
+            for c in successful
+        ]
+        best_score, best = max(scored, key=lambda item: item[0])
+        
+        # Chỉ candidate được chọn mới được ghi vào conversation history của Primary Agent
+        self.primary_agent.commit_idea_candidate(primary_input, best)
+        
+        best.metadata["best_of_n"] = {
+            "candidates": len(candidates),
+            "successful": len(successful),
+            "scores": [round(score, 3) for score, _ in scored],
+            "selected_score": round(best_score, 3),
+            "selected_temperature": best.metadata.get("temperature"),
+            "selected_style": best.metadata.get("style_variant", "")
+        }
+        logger.info(
+            f"Best-of-{len(candidates)} ideas: selected score {best_score:.3f} "
+            f"(temperature={best.metadata.get('temperature')})"
+        )
+        
+        return best
+    
+    def _score_idea_candidate(self, diversity: Dict[str, Any], target_count: int) -> float:
+        """Điểm local rẻ cho một bộ ý tưởng: đa dạng, độ phủ các trường và đủ số lượng"""
+        ideas_count = diversity.get("ideas_count", 0)
+        if ideas_count <= 0:
+            return 0.0
+        
+        # Tỉ lệ audience/business model/tech khác nhau trên số ý tưởng
+        coverage = sum(
+            diversity.get(key, 0) for key in ("unique_audiences", "unique_business_models", "unique_techs")
+        ) / (3 * ideas_count)
+        completeness = min(ideas_count / max(target_count, 1), 1.0)
+        
+        return (0.5 * diversity.get("diversity_score", 0.0)
+                + 0.3 * min(coverage, 1.0)
+                + 0.2 * completeness
+                - 0.1 * len(diversity.get("duplicates", [])))
+
+    def _ideas_from_output(self, primary_output: AgentOutput) -> List[Idea]:
+        """Ý tưởng của Primary: bản ghi đã parse trong metadata, parse lại markdown nếu không có
+        (output replay từ journal cũ)"""
+        records = (primary_output.metadata or {}).get("ideas")
+        return ideas_from_dicts(records) if records else parse_ideas(primary_output.content)
+
+    def _analyze_idea_diversity(self, ideas: List[Idea]) -> Dict[str, Any]:
+        """Phân tích đa dạng của các ý tưởng đã parse từ output của Primary Agent.
 
         Trả về các thống kê: số ý tưởng, số nhóm audience khác nhau, số mô hình kinh doanh,
         số công nghệ khác nhau, tỉ lệ trùng lặp tên/keyword, và gợi ý cải thiện.
         """
         try:
             import re
-            from collections import Counter
-
-            # Tách các ý tưởng theo các heading phổ biến
-            idea_chunks = re.split(r"\n\s*####?\s*\d+\.|\n\s*##\s*\d+\.|\n\s*##\s+Tên|\n\s*###\s+TÊN", ideas_markdown)
-            idea_chunks = [c.strip() for c in idea_chunks if len(c.strip()) > 30]
-
-            def extract_field(patterns, text):
-                for p in patterns:
-                    m = re.search(p, text, re.IGNORECASE)
-                    if m:
-                        return m.group(1).strip()[:300]
-                return ""
 
-            audience_patterns = [r"Target\s*Market\s*:\s*(.*?)(?:\n\*\*|\n#|$)", r"Target\s*Audience\s*:\s*(.*?)(?:\n\*\*|\n#|$)"]
-            bm_patterns = [r"Mô hình\s*Kinh\s*doanh\s*:\s*(.*?)(?:\n\*\*|\n#|$)", r"Business\s*Model\s*:\s*(.*?)(?:\n\*\*|\n#|$)"]
-            tech_patterns = [r"Giải pháp\s*đề\s*xuất\s*:\s*(.*?)(?:\n\*\*|\n#|$)", r"Solution\s*:\s*(.*?)(?:\n\*\*|\n#|$)"]
-            name_patterns = [r"^\s*\*\*?Tên\s*ý\s*tưởng\s*:?\s*\*\*(.*)\*\*", r"^\s*####?\s*\d+\.\s*(.*)$", r"^\s*##\s*(.*)$"]
-
-            def extract_name(text):
-                lines = text.splitlines()
-                for line in lines[:4]:
-                    for p in name_patterns:
-                        m = re.search(p, line.strip(), re.IGNORECASE)
-                        if m:
-                            return re.sub(r"[#*]", "", m.group(1)).strip()[:120]
-                # fallback: first non-empty line
-                for line in lines:
-                    if line.strip():
-                        return line.strip()[:120]
-                return "Idea"
-
-            names = []
-            audiences = []
-            bms = []
-            techs = []
-
-            for chunk in idea_chunks:
-                names.append(extract_name(chunk))
-                audiences.append(extract_field(audience_patterns, chunk))
-                bms.append(extract_field(bm_patterns, chunk))
-                techs.append(extract_field(tech_patterns, chunk))
+            names = [idea.name for idea in ideas]
+            audiences = [idea.audience for idea in ideas]
+            bms = [idea.business_model for idea in ideas]
+            techs = [idea.solution for idea in ideas]
 
             def tokenize(s):
                 tokens = re.findall(r"[a-zA-Z0-9]+", s.lower())
@@ -706,7 +1178,7 @@ class MCTSOrchestrator:
             audience_tokens = [tokenize(x) for x in audiences]
             tech_tokens = [tokenize(x) for x in techs]
 
-            n = len(idea_chunks)
+            n = len(ideas)
             if n <= 1:
                 return {"ideas_count": n, "diversity_score": 0.0, "duplicates": [], "insights": []}
 
@@ -737,7 +1209,7 @@ class MCTSOrchestrator:
                 "unique_techs": unique_nonempty(techs),
                 "diversity_score": round(diversity_score, 3),
                 "duplicates": duplicate_pairs,
-                "idea_names": names[:n]
+                "idea_ids": [idea.id for idea in ideas]
             }
 
             insights = []
@@ -751,23 +1223,61 @@ class MCTSOrchestrator:
             logger.warning(f"Diversity analysis failed: {str(e)}")
             return {"ideas_count": 0, "diversity_score": 0.0, "error": str(e)}
 
+    def _find_near_duplicate_ideas(self, ideas: List[Idea]) -> Dict[str, List[Dict[str, Any]]]:
+        """Tên ý tưởng -> các ý tưởng gần trùng đã tạo trong các session trước"""
+        if not self.idea_index:
+            return {}
+        
+        near_duplicates = {}
+        for idea in ideas:
+            matches = self.idea_index.query(idea, exclude_session=self.session.session_id, limit=3)
+            if matches:
+                near_duplicates[idea.name] = [asdict(match) for match in matches]
+        
+        return near_duplicates
+    
     async def _evaluate_idea_novelty(self, idea_names: List[str]) -> Dict[str, Any]:
-        """Đánh giá tính mới (novelty) bằng ESV: kiểm tra nhanh sự hiện diện/độ phổ biến.
+        """Đánh giá tính mới (novelty): kiểm tra nhanh sự hiện diện/độ phổ biến.
 
-        Trả về mapping tên ý tưởng -> {presence, confidence, summary} và tổng hợp thống kê.
+        Tên đã biết được trả lời từ novelty index local; chỉ tên chưa biết mới search qua ESV.
+        Trả về mapping tên ý tưởng -> {hits, avg_confidence, novelty_score} và tổng hợp thống kê.
         """
         if not self.esv_module or not idea_names:
             return {}
+        
+        novelty = {"by_idea": {}, "summary": {}}
+        
+        # Trả lời tại chỗ các tên đã biết; chỉ tên chưa biết mới search qua ESV
+        unknown_names = idea_names
+        if self.novelty_index:
+            unknown_names = []
+            for name in idea_names:
+                known = self.novelty_index.lookup(name)
+                if known is None:
+                    unknown_names.append(name)
+                else:
+                    novelty["by_idea"][name] = known
+        
         from backend.core.esv_module import create_search_query
         queries = []
-        for name in idea_names[:5]:  # giới hạn để nhẹ nhàng
+        searched_names = unknown_names[:5]  # giới hạn để nhẹ nhàng
+        for name in searched_names:
             queries.append(create_search_query(f"startup '{name}' product", "competitor", "medium", max_results=5))
             queries.append(create_search_query(f"'{name}' SaaS", "competitor", "low", max_results=5))
-        results = await self.esv_module.validate_multiple(queries)
+        results = await self.esv_module.validate_multiple(queries) if queries else {}
+        
+        if self.novelty_index:
+            # Chỉ ghi nhớ kết quả của các tên đã thực sự được search
+            self.novelty_index.add_documents(r for v in results.values() for r in v.results)
+            for name in unknown_names:
+                if name in searched_names:
+                    novelty["by_idea"][name] = self.novelty_index.record_check(name)
+                else:
+                    novelty["by_idea"][name] = self.novelty_index.evaluate(name)
+            unknown_names = []
 
         # Tính sơ bộ: nếu tìm thấy nhiều kết quả liên quan trực tiếp, coi như novelty thấp hơn
-        novelty = {"by_idea": {}, "summary": {}}
-        for name in idea_names:
+        for name in unknown_names:
             related = [r for q, v in results.items() for r in v.results if name.lower() in (r.title or "").lower() or name.lower() in (r.snippet or "").lower()]
             count = len(related)
             avg_conf = sum(r.confidence for r in related) / count if count else 0.0
@@ -777,7 +1287,8 @@ class MCTSOrchestrator:
                 "avg_confidence": round(avg_conf, 2),
                 "novelty_score": round(novelty_score, 2)
             }
-        # summary
+        # summary (theo thứ tự idea_names)
+        novelty["by_idea"] = {name: novelty["by_idea"][name] for name in idea_names}
         all_scores = [d["novelty_score"] for d in novelty["by_idea"].values()]
         novelty["summary"] = {
             "avg_novelty": round(sum(all_scores) / len(all_scores), 2) if all_scores else 0.0,
@@ -839,12 +1350,28 @@ class MCTSOrchestrator:
             },
             "ideas_results": {
                 "final_ideas": self.session.ideas_results,
+                "ideas": self.session.ideas,
                 "iteration_count": self.session.ideas_iteration,
                 "diversity_analysis": self._last_idea_diversity or {},
                 "novelty": getattr(self, '_last_idea_novelty', {}) or {}
             },
             "quality_metrics": self._compile_quality_metrics(),
             "agent_performance": self._compile_agent_performance(),
+            "llm_cache": self.llm_client.get_cache_stats() if self.llm_client else {},
+            "prompt_cache": self.llm_client.get_prompt_cache_stats() if self.llm_client else {},
+            "token_preflight": self.llm_client.get_preflight_stats() if self.llm_client else {},
+            "http_pool": self.transport.get_stats() if self.transport else {},
+            "rate_limiter": self.llm_client.get_rate_limit_stats() if self.llm_client else {},
+            "esv_rate_limits": self.esv_module.get_rate_limit_stats() if self.esv_module else {},
+            "esv_cache": self.esv_cache.get_stats() if self.esv_cache else {},
+            "esv_keywords": self.keyword_extractor.get_stats() if self.keyword_extractor else {},
+            "idea_index": self.idea_index.get_stats() if self.idea_index else {},
+            "novelty_index": self.novelty_index.get_stats() if self.novelty_index else {},
+            "request_coalescing": {
+                "llm": self.llm_client.get_coalescing_stats() if self.llm_client else {},
+                "esv": self.esv_module.get_coalescing_stats() if self.esv_module else {}
+            },
+            "latency_breakdown": self.tracer.get_latency_breakdown() if self.tracer.enabled else {},
             "recommendations": self._compile_recommendations(),
             "iterations": self.session.iteration_history  # thêm chi tiết từng vòng
         }
@@ -932,13 +1459,21 @@ class MCTSOrchestrator:
         results_dir = f"{self.config.output_dir}/{self.session.session_id}"
         os.makedirs(results_dir, exist_ok=True)
         
-        # Save session summary
-        with open(f"{results_dir}/session_summary.json", "w", encoding="utf-8") as f:
-            json.dump(self.session.__dict__, f, ensure_ascii=False, indent=2, default=str)
-        
-        # Save final deliverables
-        with open(f"{results_dir}/final_deliverables.json", "w", encoding="utf-8") as f:
-            json.dump(self.session.final_deliverables, f, ensure_ascii=False, indent=2, default=str)
+        if self.config.session_storage == "blobs":
+            # session.json + blob nén: mỗi output chỉ lưu một lần dù xuất hiện ở cả session và deliverables
+            session_data = {k: v for k, v in self.session.__dict__.items() if k != "final_deliverables"}
+            store = BlobStore(blob_root(self.config.output_dir), self.config.session_blob_codec)
+            save_session(results_dir, session_data, self.session.final_deliverables, store,
+                         self.config.session_blob_min_chars)
+            logger.info(f"Session blob store stats: {store.get_stats()}")
+        else:
+            # Save session summary
+            with open(f"{results_dir}/session_summary.json", "w", encoding="utf-8") as f:
+                json.dump(self.session.__dict__, f, ensure_ascii=False, indent=2, default=str)
+            
+            # Save final deliverables
+            with open(f"{results_dir}/final_deliverables.json", "w", encoding="utf-8") as f:
+                json.dump(self.session.final_deliverables, f, ensure_ascii=False, indent=2, default=str)
         
         # Save analysis results
         with open(f"{results_dir}/analysis_results.md", "w", encoding="utf-8") as f:
@@ -0,0 +1,223 @@
+"""
+Novelty Index - Kiểm tra tính mới của tên ý tưởng tại chỗ trước khi gọi ESV
+Inverted index (SQLite FTS5) trên title/snippet của các kết quả ESV đã lấy và danh sách sản phẩm
+đã biết, cùng kết quả các lần kiểm tra trước; chỉ tên chưa biết mới cần search qua mạng
+"""
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import time
+from typing import Dict, Optional, Any, Iterable, Set, Tuple, Union
+
+from backend.core.keyword_extractor import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Số kết quả liên quan mà từ đó novelty_score đã về 0 (giống cách tính trên kết quả ESV)
+SATURATION_HITS = 5
+
+_FTS_TOKEN_PATTERN = re.compile(r"[^\W_]+")
+
+def novelty_score_from_hits(hits: int) -> float:
+    """Nhiều kết quả liên quan hơn => novelty thấp hơn"""
+    return max(0.0, 1.0 - min(hits, SATURATION_HITS) / SATURATION_HITS)
+
+class NoveltyIndex:
+    """
+    Trả lời "tên ý tưởng này đã xuất hiện ở đâu chưa" từ dữ liệu local.
+
+    - Tên khớp (cụm từ) với ít nhất SATURATION_HITS tài liệu: chắc chắn novelty thấp
+    - Tên đã được kiểm tra qua ESV trong check_ttl: dùng lại kết quả đó
+    - Còn lại: None, caller fallback sang ESV rồi ghi kết quả vào index
+    """
+
+    def __init__(self, db_path: str, check_ttl: int = 7 * 24 * 3600):
+        self.db_path = db_path
+        self.check_ttl = check_ttl
+
+        # Counters
+        self.local_answers = 0
+        self.fallbacks = 0
+        self.documents_added = 0
+
+        # Tên sản phẩm đã biết, dạng " token token " để so khớp cụm trong tên ý tưởng
+        self._known_products: Set[str] = set()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS novelty_docs USING fts5(
+                title,
+                snippet,
+                source UNINDEXED,
+                confidence UNINDEXED,
+                tokenize = 'unicode61 remove_diacritics 0'
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS novelty_doc_keys (
+                doc_key TEXT PRIMARY KEY
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS novelty_checks (
+                name TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL,
+                avg_confidence REAL NOT NULL,
+                checked_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+
+    def add_documents(self, documents: Iterable[Union[Dict[str, Any], Any]]) -> int:
+        """Thêm SearchResult (hoặc dict cùng field); bỏ qua tài liệu đã có (theo url + title)"""
+        added = 0
+
+        try:
+            for doc in documents:
+                data = doc if isinstance(doc, dict) else doc.__dict__
+                title = data.get("title") or ""
+                snippet = data.get("snippet") or ""
+                if not title and not snippet:
+                    continue
+
+                doc_key = hashlib.sha1(f"{data.get('url') or ''}|{title}".encode("utf-8")).hexdigest()
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO novelty_doc_keys (doc_key) VALUES (?)", (doc_key,)
+                )
+                if cursor.rowcount == 0:
+                    continue
+
+                self._conn.execute(
+                    "INSERT INTO novelty_docs (title, snippet, source, confidence) VALUES (?, ?, ?, ?)",
+                    (title, snippet, data.get("source") or "", float(data.get("confidence") or 0.0))
+                )
+                added += 1
+
+            self._conn.commit()
+
+        except sqlite3.Error as e:
+            logger.warning(f"Novelty index write error: {str(e)}")
+            self._conn.rollback()
+
+        self.documents_added += added
+        return added
+
+    def add_known_products(self, names: Iterable[str]):
+        """Sản phẩm đã biết: tên ý tưởng chứa tên sản phẩm được tính như SATURATION_HITS kết quả"""
+        for name in names:
+            tokens = _FTS_TOKEN_PATTERN.findall(normalize_text(name))
+            if tokens:
+                self._known_products.add(f" {' '.join(tokens)} ")
+
+    def document_count(self) -> int:
+        try:
+            return self._conn.execute("SELECT COUNT(*) FROM novelty_doc_keys").fetchone()[0]
+        except sqlite3.Error:
+            return -1
+
+    def match(self, name: str) -> Tuple[int, float]:
+        """Số tài liệu chứa tên (cụm từ liên tiếp, không phân biệt hoa thường) và confidence trung bình"""
+        tokens = _FTS_TOKEN_PATTERN.findall(normalize_text(name))
+        if not tokens:
+            return 0, 0.0
+
+        phrase = " ".join(tokens)
+        if any(product in f" {phrase} " for product in self._known_products):
+            return SATURATION_HITS, 1.0
+
+        try:
+            rows = self._conn.execute(
+                "SELECT confidence FROM novelty_docs WHERE novelty_docs MATCH ? LIMIT 50",
+                (f'"{phrase}"',)
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Novelty index read error: {str(e)}")
+            return 0, 0.0
+
+        hits = len(rows)
+        avg_confidence = sum(float(confidence) for (confidence,) in rows) / hits if hits else 0.0
+        return hits, avg_confidence
+
+    def lookup(self, name: str) -> Optional[Dict[str, Any]]:
+        """Kết quả novelty của tên nếu trả lời được tại chỗ, None nếu cần hỏi ESV"""
+        hits, avg_confidence = self.match(name)
+
+        if hits < SATURATION_HITS:
+            try:
+                row = self._conn.execute(
+                    "SELECT hits, avg_confidence FROM novelty_checks WHERE name = ? AND checked_at >= ?",
+                    (normalize_text(name), time.time() - self.check_ttl)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Novelty index read error: {str(e)}")
+                row = None
+
+            if row is None:
+                self.fallbacks += 1
+                return None
+
+            if row[0] >= hits:
+                hits, avg_confidence = row
+
+        self.local_answers += 1
+        return {
+            "hits": hits,
+            "avg_confidence": round(avg_confidence, 2),
+            "novelty_score": round(novelty_score_from_hits(hits), 2)
+        }
+
+    def evaluate(self, name: str) -> Dict[str, Any]:
+        """Kết quả novelty chỉ dựa trên các tài liệu hiện có trong index"""
+        hits, avg_confidence = self.match(name)
+        return {
+            "hits": hits,
+            "avg_confidence": round(avg_confidence, 2),
+            "novelty_score": round(novelty_score_from_hits(hits), 2)
+        }
+
+    def record_check(self, name: str) -> Dict[str, Any]:
+        """Ghi kết quả sau khi đã thêm kết quả ESV của tên vào index; trả về kết quả novelty"""
+        hits, avg_confidence = self.match(name)
+
+        try:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO novelty_checks (name, hits, avg_confidence, checked_at) VALUES (?, ?, ?, ?)",
+                (normalize_text(name), hits, avg_confidence, time.time())
+            )
+            self._conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Novelty index write error: {str(e)}")
+
+        return {
+            "hits": hits,
+            "avg_confidence": round(avg_confidence, 2),
+            "novelty_score": round(novelty_score_from_hits(hits), 2)
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê index"""
+        lookups = self.local_answers + self.fallbacks
+        return {
+            "documents": self.document_count(),
+            "documents_added": self.documents_added,
+            "local_answers": self.local_answers,
+            "esv_fallbacks": self.fallbacks,
+            "local_rate": round(self.local_answers / lookups, 3) if lookups else 0.0
+        }
+
+    def close(self):
+        """Đóng kết nối SQLite"""
+        try:
+            self._conn.close()
+        except sqlite3.Error:
+            pass
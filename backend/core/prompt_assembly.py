@@ -0,0 +1,51 @@
+"""
+Prompt Assembly - Ghép prompt của agent thành phần tĩnh (prefix cache được) và phần động
+Phần tĩnh (hướng dẫn, framework, kịch bản, schema) giống hệt nhau giữa các call nên được đặt liền
+sau system prompt; số vòng, nội dung cần đánh giá và ngữ cảnh JSON đặt sau cùng
+"""
+
+from dataclasses import dataclass
+from typing import Iterable, Union
+
+SEGMENT_SEPARATOR = "\n\n"
+
+@dataclass(frozen=True)
+class AssembledPrompt:
+    """User message gồm phần tĩnh (giống nhau giữa các call cùng loại) rồi tới phần động"""
+    static: str
+    dynamic: str
+
+    @property
+    def text(self) -> str:
+        if self.static and self.dynamic:
+            return self.static + SEGMENT_SEPARATOR + self.dynamic
+        return self.static or self.dynamic
+
+    @property
+    def static_chars(self) -> int:
+        """Số ký tự đầu của text thuộc phần tĩnh (gồm cả separator)"""
+        if not self.static:
+            return 0
+        return len(self.static) + (len(SEGMENT_SEPARATOR) if self.dynamic else 0)
+
+    def with_static(self, *segments: str) -> "AssembledPrompt":
+        return AssembledPrompt(_join([self.static, *segments]), self.dynamic)
+
+    def with_dynamic(self, *segments: str) -> "AssembledPrompt":
+        return AssembledPrompt(self.static, _join([self.dynamic, *segments]))
+
+    def __str__(self) -> str:
+        return self.text
+
+def _join(segments: Iterable[str]) -> str:
+    return SEGMENT_SEPARATOR.join(s.strip() for s in segments if s and s.strip())
+
+def assemble_prompt(static: Iterable[str], dynamic: Iterable[str]) -> AssembledPrompt:
+    """Ghép các segment; segment rỗng bị bỏ qua"""
+    return AssembledPrompt(_join(static), _join(dynamic))
+
+def prompt_text(prompt: Union[str, AssembledPrompt]) -> str:
+    return prompt.text if isinstance(prompt, AssembledPrompt) else prompt
+
+def static_prefix_chars(prompt: Union[str, AssembledPrompt]) -> int:
+    return prompt.static_chars if isinstance(prompt, AssembledPrompt) else 0
@@ -0,0 +1,364 @@
+"""
+Rate Limiter - Governor cho LLM requests: token bucket (RPM/TPM) + giới hạn concurrency
+Đọc Retry-After / x-ratelimit-* headers và tự điều chỉnh tốc độ kiểu AIMD khi gặp 429
+"""
+
+import asyncio
+import logging
+import random
+import re
+import time
+import weakref
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Any, Mapping
+
+logger = logging.getLogger(__name__)
+
+# Giới hạn dưới của hệ số tốc độ sau nhiều lần giảm liên tiếp
+MIN_RATE_FACTOR = 0.05
+# Cooldown mặc định khi gặp 429 mà server không gửi Retry-After (giây)
+DEFAULT_RATE_LIMIT_COOLDOWN = 2.0
+# Trần backoff cho lỗi không phải 429 (giây)
+MAX_BACKOFF = 30.0
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Parse thời gian reset từ header thành số giây.
+
+    Hỗ trợ số giây ("1.5"), duration kiểu OpenAI ("6m0s", "20ms"), HTTP-date và RFC3339.
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    parts = _DURATION_PART.findall(value)
+    if parts and "".join(f"{n}{u}" for n, u in parts) == value:
+        multipliers = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+        return sum(float(n) * multipliers[u] for n, u in parts)
+
+    try:
+        reset_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            reset_at = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+
+    if reset_at.tzinfo is None:
+        reset_at = reset_at.replace(tzinfo=timezone.utc)
+
+    return max(0.0, (reset_at - datetime.now(timezone.utc)).total_seconds())
+
+def _header(headers: Mapping[str, str], *names: str) -> Optional[str]:
+    """Lấy giá trị header đầu tiên tồn tại trong danh sách tên"""
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            return value
+    return None
+
+def _header_int(headers: Mapping[str, str], *names: str) -> Optional[int]:
+    value = _header(headers, *names)
+    try:
+        return int(float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+class TokenBucket:
+    """Token bucket refill liên tục; capacity mặc định = lượng cho phép trong một phút"""
+
+    def __init__(self, per_minute: float, burst: Optional[float] = None):
+        self.per_minute = per_minute
+        self.burst = burst
+        self.capacity = burst or per_minute
+        self.tokens = self.capacity
+        self._last_refill = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        """Tốc độ refill (đơn vị/giây)"""
+        return self.per_minute / 60.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def try_take(self, amount: float) -> float:
+        """Lấy amount nếu đủ; trả về 0 nếu thành công, ngược lại số giây cần chờ"""
+        self._refill()
+        amount = min(amount, self.capacity)
+
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+
+        return (amount - self.tokens) / max(self.rate, 1e-6)
+
+    async def take(self, amount: float = 1.0) -> float:
+        """Chờ tới khi lấy được amount; trả về tổng thời gian đã chờ (giây)"""
+        waited = 0.0
+        while True:
+            wait = self.try_take(amount)
+            if wait <= 0:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def adjust(self, delta: float):
+        """Hoàn lại (delta > 0) hoặc trừ thêm (delta < 0) sau khi biết usage thực tế"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + delta)
+
+    def cap_remaining(self, remaining: float):
+        """Đồng bộ theo số còn lại mà server báo"""
+        self._refill()
+        self.tokens = min(self.tokens, remaining)
+
+    def set_rate(self, per_minute: float):
+        self._refill()
+        self.per_minute = per_minute
+        self.capacity = self.burst or per_minute
+        self.tokens = min(self.tokens, self.capacity)
+
+class AdaptiveRateLimiter:
+    """
+    Governor dùng chung cho mọi agent/session gọi cùng một LLM endpoint.
+
+    - Token bucket cho requests/phút và tokens/phút (0 = không giới hạn)
+    - Giới hạn số request đồng thời, tự điều chỉnh AIMD: giảm một nửa khi gặp 429,
+      tăng dần khi thành công
+    - Retry-After và x-ratelimit-* headers đặt cooldown chung để tránh 429 storm
+    """
+
+    def __init__(self,
+                 requests_per_minute: int = 0,
+                 tokens_per_minute: int = 0,
+                 max_concurrency: int = 8,
+                 decrease_factor: float = 0.5,
+                 increase_step: float = 0.05):
+        self.base_rpm = requests_per_minute
+        self.base_tpm = tokens_per_minute
+        self.max_concurrency = max(1, max_concurrency)
+        self.decrease_factor = decrease_factor
+        self.increase_step = increase_step
+
+        self._request_bucket = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self._token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+
+        # Trạng thái AIMD
+        self.rate_factor = 1.0
+        self.concurrency_limit = float(self.max_concurrency)
+
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+        self._blocked_until = 0.0
+
+        # Metrics
+        self.requests = 0
+        self.rate_limited = 0
+        self.total_wait_time = 0.0
+
+    async def acquire(self, estimated_tokens: int = 0):
+        """Chờ tới khi được phép gửi request (cooldown, concurrency, RPM, TPM)"""
+        start = time.monotonic()
+
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < max(1, int(self.concurrency_limit)))
+            self._in_flight += 1
+
+        try:
+            await self._wait_cooldown()
+            if self._request_bucket:
+                await self._take(self._request_bucket, 1)
+            if self._token_bucket and estimated_tokens:
+                await self._take(self._token_bucket, estimated_tokens)
+        except BaseException:
+            await self.release()
+            raise
+
+        self.requests += 1
+        self.total_wait_time += time.monotonic() - start
+
+    async def release(self):
+        """Trả slot concurrency"""
+        async with self._condition:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._condition.notify_all()
+
+    async def _wait_cooldown(self):
+        """Chờ hết cooldown chung; thêm jitter để các request không cùng lúc bật dậy"""
+        while True:
+            remaining = self._blocked_until - time.monotonic()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(remaining + random.uniform(0, min(1.0, remaining * 0.2)))
+
+    async def _take(self, bucket: TokenBucket, amount: float):
+        while True:
+            wait = bucket.try_take(amount)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def record_success(self,
+                       headers: Optional[Mapping[str, str]] = None,
+                       used_tokens: int = 0,
+                       estimated_tokens: int = 0):
+        """Cập nhật sau response thành công: đối soát token, đọc headers, additive increase"""
+        if self._token_bucket and used_tokens and estimated_tokens:
+            self._token_bucket.adjust(estimated_tokens - used_tokens)
+
+        if headers:
+            self._apply_headers(headers)
+
+        if self.rate_factor < 1.0:
+            self._set_rate_factor(self.rate_factor + self.increase_step)
+
+        if self.concurrency_limit < self.max_concurrency:
+            # Tăng ~1 slot sau mỗi "vòng" request thành công
+            self.concurrency_limit = min(
+                float(self.max_concurrency),
+                self.concurrency_limit + 1.0 / max(self.concurrency_limit, 1.0)
+            )
+
+    def record_failure(self, status: int, headers: Optional[Mapping[str, str]] = None) -> Optional[float]:
+        """
+        Cập nhật sau response lỗi. Với 429/503 giảm tốc multiplicative và đặt cooldown chung.
+
+        Trả về số giây server yêu cầu chờ (nếu có).
+        """
+        headers = headers or {}
+        retry_after = parse_reset_duration(_header(headers, "Retry-After", "retry-after"))
+
+        if status in (429, 503):
+            self.rate_limited += 1
+            # Các 429 của những request đã bay trước khi cooldown bắt đầu chỉ tính là một lần giảm
+            if time.monotonic() >= self._blocked_until:
+                self._set_rate_factor(self.rate_factor * self.decrease_factor)
+                self.concurrency_limit = max(1.0, self.concurrency_limit * self.decrease_factor)
+
+            cooldown = retry_after if retry_after is not None else self._header_reset_delay(headers)
+            if cooldown is None:
+                cooldown = DEFAULT_RATE_LIMIT_COOLDOWN
+            self._block_for(cooldown)
+
+            logger.warning(
+                f"LLM rate limited ({status}): cooldown {cooldown:.1f}s, "
+                f"rate factor {self.rate_factor:.2f}, concurrency {int(self.concurrency_limit)}"
+            )
+
+        self._apply_headers(headers)
+        return retry_after
+
+    def retry_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Thời gian chờ trước lần retry tiếp theo.
+
+        Full jitter exponential backoff để các client không retry đồng loạt; nếu server
+        đã chỉ định Retry-After thì cooldown chung đã xử lý, chỉ cần jitter nhỏ.
+        """
+        if retry_after is not None:
+            return random.uniform(0, 0.5)
+        return random.uniform(0, min(MAX_BACKOFF, 2 ** (attempt + 1)))
+
+    def _apply_headers(self, headers: Mapping[str, str]):
+        """Đồng bộ bucket theo x-ratelimit-* headers (OpenAI/Anthropic style)"""
+        limit_requests = _header_int(headers, "x-ratelimit-limit-requests", "anthropic-ratelimit-requests-limit")
+        limit_tokens = _header_int(headers, "x-ratelimit-limit-tokens", "anthropic-ratelimit-tokens-limit")
+
+        # Chưa cấu hình giới hạn thì học từ server
+        if limit_requests and not self.base_rpm:
+            self.base_rpm = limit_requests
+            self._request_bucket = TokenBucket(limit_requests * self.rate_factor)
+        if limit_tokens and not self.base_tpm:
+            self.base_tpm = limit_tokens
+            self._token_bucket = TokenBucket(limit_tokens * self.rate_factor)
+
+        remaining_requests = _header_int(
+            headers, "x-ratelimit-remaining-requests", "anthropic-ratelimit-requests-remaining"
+        )
+        remaining_tokens = _header_int(
+            headers, "x-ratelimit-remaining-tokens", "anthropic-ratelimit-tokens-remaining"
+        )
+
+        if remaining_requests is not None and self._request_bucket:
+            self._request_bucket.cap_remaining(remaining_requests)
+        if remaining_tokens is not None and self._token_bucket:
+            self._token_bucket.cap_remaining(remaining_tokens)
+
+        if remaining_requests == 0 or remaining_tokens == 0:
+            delay = self._header_reset_delay(headers)
+            if delay:
+                self._block_for(delay)
+
+    def _header_reset_delay(self, headers: Mapping[str, str]) -> Optional[float]:
+        """Lấy thời gian reset dài nhất từ các header reset"""
+        delays = [
+            parse_reset_duration(_header(headers, name))
+            for name in (
+                "x-ratelimit-reset-requests",
+                "x-ratelimit-reset-tokens",
+                "anthropic-ratelimit-requests-reset",
+                "anthropic-ratelimit-tokens-reset",
+                "ratelimit-reset"
+            )
+        ]
+        delays = [d for d in delays if d is not None]
+        return max(delays) if delays else None
+
+    def _block_for(self, seconds: float):
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def _set_rate_factor(self, factor: float):
+        self.rate_factor = min(1.0, max(MIN_RATE_FACTOR, factor))
+        if self._request_bucket:
+            self._request_bucket.set_rate(self.base_rpm * self.rate_factor)
+        if self._token_bucket:
+            self._token_bucket.set_rate(self.base_tpm * self.rate_factor)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê governor"""
+        return {
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+            "rate_factor": round(self.rate_factor, 3),
+            "concurrency_limit": int(self.concurrency_limit),
+            "in_flight": self._in_flight,
+            "requests_per_minute": round(self.base_rpm * self.rate_factor, 1) if self.base_rpm else None,
+            "tokens_per_minute": round(self.base_tpm * self.rate_factor, 1) if self.base_tpm else None,
+            "avg_wait_time": round(self.total_wait_time / self.requests, 3) if self.requests else 0.0
+        }
+
+# Registry theo event loop: mọi LLMClient cùng endpoint trong một loop dùng chung một governor
+_shared_limiters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, AdaptiveRateLimiter]]" = \
+    weakref.WeakKeyDictionary()
+
+def get_shared_rate_limiter(config) -> AdaptiveRateLimiter:
+    """
+    Lấy governor dùng chung cho (url, model, api_key) trong event loop hiện tại.
+
+    Primitives asyncio gắn với một loop, nên mỗi loop (vd. mỗi job trong batch worker)
+    có registry riêng.
+    """
+    loop = asyncio.get_running_loop()
+    limiters = _shared_limiters.setdefault(loop, {})
+    key = f"{config.url}|{config.model}|{config.api_key}"
+
+    if key not in limiters:
+        limiters[key] = AdaptiveRateLimiter(
+            requests_per_minute=config.requests_per_minute,
+            tokens_per_minute=config.tokens_per_minute,
+            max_concurrency=config.max_concurrent_requests
+        )
+
+    return limiters[key]
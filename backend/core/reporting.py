@@ -117,6 +117,14 @@ def _format_quality_metrics(session: MCTSSession) -> str:
             if low_list:
                 parts.append(_md_kv("Ý tưởng cần cải thiện novelty", ", ".join(low_list[:5])))
         parts.append("\n")
+    if session.ideas:
+        parts.append(_md_heading("Danh sách Ý tưởng cuối", 3))
+        for idea in session.ideas:
+            line = f"{idea.get('position', 0) + 1}. **{idea.get('name', '')}** (`{idea.get('id', '')}`)"
+            if idea.get("audience"):
+                line += f" — {idea['audience'][:120]}"
+            parts.append(line + "\n")
+        parts.append("\n")
     return "".join(parts)
 
 
@@ -134,6 +142,40 @@ def _format_agent_performance(session: MCTSSession) -> str:
     return "".join(parts)
 
 
+def _format_latency_breakdown(session: MCTSSession) -> str:
+    parts: List[str] = []
+    latency = session.final_deliverables.get("latency_breakdown", {}) if session.final_deliverables else {}
+    if not latency:
+        return ""
+
+    parts.append(_md_heading("Phân bổ Thời gian (Latency Breakdown)", 3))
+    parts.append(_md_kv("Wall time", f"{latency.get('wall_time', 0):.1f}s"))
+    parts.append(_md_kv("Số span", latency.get("span_count", 0)))
+    parts.append("\nThời gian của các span chạy song song được cộng dồn.\n\n")
+
+    parts.append("| Category | Số span | Tổng (s) | TB (s) | P95 (s) | Chờ slot (s) | Prompt tokens | Completion tokens | Lỗi |\n")
+    parts.append("|---|---|---|---|---|---|---|---|---|\n")
+    for category, stats in latency.get("by_category", {}).items():
+        parts.append(
+            f"| {category} | {stats.get('count', 0)} | {stats.get('total_time', 0):.2f} | "
+            f"{stats.get('mean_time', 0):.2f} | {stats.get('p95_time', 0):.2f} | {stats.get('queue_time', 0):.2f} | "
+            f"{stats.get('prompt_tokens', 0)} | {stats.get('completion_tokens', 0)} | {stats.get('errors', 0)} |\n"
+        )
+    parts.append("\n")
+
+    slowest = latency.get("slowest_spans", [])
+    if slowest:
+        parts.append(_md_heading("Span chậm nhất", 4))
+        for span in slowest:
+            parts.append(f"- `{span.get('name')}` ({span.get('category')}): {span.get('duration', 0):.2f}s")
+            if span.get("queue_time"):
+                parts.append(f", chờ slot {span['queue_time']:.2f}s")
+            parts.append("\n")
+        parts.append("\n")
+
+    return "".join(parts)
+
+
 def generate_full_report_md(session: MCTSSession, base_output_dir: Optional[str] = None) -> str:
     """Tạo báo cáo Markdown toàn diện cho một session MCTS."""
     parts: List[str] = []
@@ -154,11 +196,16 @@ def generate_full_report_md(session: MCTSSession, base_output_dir: Optional[str]
         parts.append("\n")
         parts.append(_md_kv("File phân tích cuối", f"{base_output_dir}/analysis_results.md"))
         parts.append(_md_kv("File ý tưởng cuối", f"{base_output_dir}/ideas_results.md"))
-        parts.append(_md_kv("Final deliverables (JSON)", f"{base_output_dir}/final_deliverables.json"))
+        if session.config.session_storage == "blobs":
+            parts.append(_md_kv("Session data (JSON + blobs)", f"{base_output_dir}/session.json"))
+        else:
+            parts.append(_md_kv("Final deliverables (JSON)", f"{base_output_dir}/final_deliverables.json"))
+        parts.append(_md_kv("Trace (JSONL / Chrome trace)", f"{base_output_dir}/trace.jsonl, {base_output_dir}/trace.chrome.json"))
 
     # Quality metrics
     parts.append("\n")
     parts.append(_format_quality_metrics(session))
+    parts.append(_format_latency_breakdown(session))
 
     # Iteration details
     parts.append(_md_heading("Chi tiết theo Vòng Lặp", 2))
@@ -447,6 +447,23 @@ class ScoringSystem:
 def create_scores_from_text(text: str, score_type: ScoreType, weights: AgentWeights) -> Dict[str, float]:
     """
     Extract scores từ text output của LLM - hỗ trợ cả format cũ và format bảng mới
+    Tiêu chí không tìm thấy nhận điểm mặc định 5.0
+    """
+    
+    scores = extract_scores_from_text(text, score_type)
+    criteria = EVALUATION_CRITERIA.get(score_type.value, [])
+    
+    # Fill missing criteria với default scores
+    for criterion in criteria:
+        if criterion not in scores:
+            scores[criterion] = 5.0  # Default neutral score
+            logger.warning(f"No score found for {criterion}, using default 5.0")
+    
+    return scores
+
+def extract_scores_from_text(text: str, score_type: ScoreType) -> Dict[str, float]:
+    """
+    Chỉ các điểm thực sự tìm thấy trong text (bảng điểm hoặc dạng "tiêu chí: x/10"), không điền mặc định
     """
     
     import re
@@ -525,12 +542,6 @@ def create_scores_from_text(text: str, score_type: ScoreType, weights: AgentWeig
                         except ValueError:
                             continue
     
-    # Fill missing criteria với default scores
-    for criterion in criteria:
-        if criterion not in scores:
-            scores[criterion] = 5.0  # Default neutral score
-            logger.warning(f"No score found for {criterion}, using default 5.0")
-    
     return scores
 
 def calculate_improvement_rate(previous_score: CompositeScore, current_score: CompositeScore) -> float:
@@ -0,0 +1,121 @@
+"""
+Session Journal - Checkpoint append-only (JSONL) cho MCTSSession
+Mỗi bước agent hoàn thành được ghi ngay xuống đĩa; khi resume, các bước đã ghi
+được replay mà không gọi lại LLM
+"""
+
+import json
+import logging
+import os
+from dataclasses import is_dataclass, asdict
+from datetime import datetime
+from enum import Enum
+from typing import Dict, List, Optional, Any
+
+from backend.agents.base_agent import AgentOutput
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FILENAME = "journal.jsonl"
+
+# Các loại record trong journal
+RECORD_SESSION_START = "session_start"
+RECORD_STEP = "step"
+RECORD_ITERATION = "iteration"
+RECORD_SESSION_COMPLETE = "session_complete"
+
+def to_jsonable(value: Any) -> Any:
+    """Chuyển dataclass/datetime/Enum lồng nhau về kiểu JSON thuần"""
+    if is_dataclass(value) and not isinstance(value, type):
+        return to_jsonable(asdict(value))
+    if isinstance(value, dict):
+        return {str(k): to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [to_jsonable(v) for v in value]
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+def serialize_agent_output(output: AgentOutput) -> Dict[str, Any]:
+    """AgentOutput -> dict JSON"""
+    return to_jsonable(output)
+
+def deserialize_agent_output(data: Dict[str, Any]) -> AgentOutput:
+    """dict JSON -> AgentOutput"""
+    timestamp = data.get("timestamp")
+    return AgentOutput(
+        content=data.get("content", ""),
+        success=data.get("success", False),
+        agent_type=data.get("agent_type", ""),
+        metadata=data.get("metadata") or {},
+        timestamp=datetime.fromisoformat(timestamp) if timestamp else datetime.now(),
+        iteration=data.get("iteration", 1),
+        error=data.get("error")
+    )
+
+def get_journal_path(output_dir: str, session_id: str) -> str:
+    return os.path.join(output_dir, session_id, JOURNAL_FILENAME)
+
+class SessionJournal:
+    """
+    Journal append-only của một session.
+
+    Mỗi record là một dòng JSON có "type"; record step được key theo
+    "<phase>:<iteration>:<step>" và chứa output + state sau bước đó.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        journal_dir = os.path.dirname(path)
+        if journal_dir:
+            os.makedirs(journal_dir, exist_ok=True)
+
+    @classmethod
+    def for_session(cls, output_dir: str, session_id: str) -> "SessionJournal":
+        return cls(get_journal_path(output_dir, session_id))
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def append(self, record_type: str, **data):
+        """Ghi một record và fsync để không mất khi process chết ngay sau đó"""
+        record = {"type": record_type, "timestamp": datetime.now().isoformat()}
+        record.update(to_jsonable(data))
+
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read(self) -> List[Dict[str, Any]]:
+        """Đọc toàn bộ records; bỏ qua dòng cuối bị ghi dở"""
+        records = []
+
+        if not self.exists:
+            return records
+
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping truncated journal record at {self.path}:{line_no}")
+
+        return records
+
+    def get_session_start(self) -> Optional[Dict[str, Any]]:
+        """Record khởi tạo session (inputs + config cần để replay)"""
+        return next((r for r in self.read() if r["type"] == RECORD_SESSION_START), None)
+
+    def get_completed_steps(self) -> Dict[str, Dict[str, Any]]:
+        """Mapping step key -> record của các bước đã hoàn thành"""
+        return {r["key"]: r for r in self.read() if r["type"] == RECORD_STEP}
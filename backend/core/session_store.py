@@ -0,0 +1,379 @@
+"""
+Session Store - Lưu kết quả session dạng content-addressed
+Mỗi text dài (output Primary/CT/AE/SA, phân tích, ý tưởng) được lưu một lần trong output_dir/blobs theo
+SHA-256, nén zstd (nếu có thư viện zstandard) hoặc gzip; metadata có cấu trúc nằm trong session.json nhỏ
+của thư mục session, blob chỉ được đọc khi cần
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Any, Iterator, Tuple
+
+from backend.core.session_journal import to_jsonable
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = "session.json"
+BLOBS_DIRNAME = "blobs"
+FORMAT_VERSION = 1
+
+# File của định dạng cũ (JSON đầy đủ, text lặp lại giữa hai file)
+LEGACY_SUMMARY_FILENAME = "session_summary.json"
+LEGACY_DELIVERABLES_FILENAME = "final_deliverables.json"
+
+BLOB_REF_KEY = "$blob"
+
+try:
+    import zstandard
+except ImportError:  # zstd là tùy chọn, gzip luôn có
+    zstandard = None
+
+def available_codecs() -> List[str]:
+    return ["zst", "gz"] if zstandard else ["gz"]
+
+def resolve_codec(codec: str = "auto") -> str:
+    """"auto" = zstd nếu cài zstandard, ngược lại gzip"""
+    if codec == "auto":
+        return available_codecs()[0]
+    if codec not in available_codecs():
+        raise ValueError(f"Codec không khả dụng: {codec} (có: {', '.join(available_codecs())})")
+    return codec
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == "zst":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    # mtime=0 để cùng nội dung cho cùng bytes
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zst":
+        if zstandard is None:
+            raise RuntimeError("Blob nén zstd nhưng chưa cài zstandard (pip install zstandard)")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+class BlobStore:
+    """
+    Text -> file nén tại blobs/<2 ký tự đầu>/<sha256>.<codec>.
+
+    Hash tính trên text gốc nên blob đã có (kể cả nén bằng codec khác) không được ghi lại;
+    file được ghi qua file tạm + rename nên reader không thấy blob ghi dở.
+    """
+
+    def __init__(self, root: str, codec: str = "auto", max_cached: int = 64):
+        self.root = root
+        self.codec = resolve_codec(codec)
+        self.max_cached = max_cached
+        self._cache: Dict[str, str] = {}
+
+        # Metrics
+        self.writes = 0
+        self.dedup_hits = 0
+        self.reads = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+
+    @staticmethod
+    def digest(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _path(self, digest: str, codec: str) -> str:
+        return os.path.join(self.root, digest[:2], f"{digest}.{codec}")
+
+    def _find(self, digest: str) -> Optional[Tuple[str, str]]:
+        for codec in ("zst", "gz"):
+            path = self._path(digest, codec)
+            if os.path.isfile(path):
+                return path, codec
+        return None
+
+    def put(self, text: str) -> str:
+        """Lưu text (nếu chưa có), trả về digest"""
+        digest = self.digest(text)
+        if self._find(digest):
+            self.dedup_hits += 1
+            return digest
+
+        raw = text.encode("utf-8")
+        data = _compress(raw, self.codec)
+        path = self._path(digest, self.codec)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        self.writes += 1
+        self.raw_bytes += len(raw)
+        self.stored_bytes += len(data)
+        return digest
+
+    def get(self, digest: str) -> str:
+        cached = self._cache.get(digest)
+        if cached is not None:
+            return cached
+
+        found = self._find(digest)
+        if not found:
+            raise FileNotFoundError(f"Không tìm thấy blob {digest} trong {self.root}")
+
+        path, codec = found
+        with open(path, "rb") as f:
+            text = _decompress(f.read(), codec).decode("utf-8")
+        self.reads += 1
+
+        if len(self._cache) >= self.max_cached:
+            self._cache.pop(next(iter(self._cache)))
+        self._cache[digest] = text
+        return text
+
+    def iter_blobs(self) -> Iterator[Tuple[str, str]]:
+        """(digest, path) của mọi blob đã lưu"""
+        if not os.path.isdir(self.root):
+            return
+        for prefix in sorted(os.listdir(self.root)):
+            prefix_dir = os.path.join(self.root, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for filename in sorted(os.listdir(prefix_dir)):
+                digest, _, codec = filename.partition(".")
+                if codec in ("zst", "gz"):
+                    yield digest, os.path.join(prefix_dir, filename)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê ghi/đọc blob"""
+        return {
+            "codec": self.codec,
+            "writes": self.writes,
+            "dedup_hits": self.dedup_hits,
+            "reads": self.reads,
+            "raw_bytes": self.raw_bytes,
+            "stored_bytes": self.stored_bytes
+        }
+
+def pack(value: Any, store: BlobStore, min_chars: int) -> Any:
+    """Giá trị JSON thuần với mọi string dài >= min_chars thay bằng {"$blob": digest, "chars": n}"""
+    if isinstance(value, dict):
+        return {key: pack(item, store, min_chars) for key, item in value.items()}
+    if isinstance(value, list):
+        return [pack(item, store, min_chars) for item in value]
+    if isinstance(value, str) and len(value) >= min_chars:
+        return {BLOB_REF_KEY: store.put(value), "chars": len(value)}
+    return value
+
+def _is_ref(value: Any) -> bool:
+    return isinstance(value, dict) and BLOB_REF_KEY in value
+
+def unpack(value: Any, store: BlobStore) -> Any:
+    """Đọc lại mọi blob trong giá trị đã pack"""
+    if _is_ref(value):
+        return store.get(value[BLOB_REF_KEY])
+    if isinstance(value, dict):
+        return {key: unpack(item, store) for key, item in value.items()}
+    if isinstance(value, list):
+        return [unpack(item, store) for item in value]
+    return value
+
+def iter_refs(value: Any) -> Iterator[str]:
+    if _is_ref(value):
+        yield value[BLOB_REF_KEY]
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from iter_refs(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from iter_refs(item)
+
+class SessionRecord:
+    """
+    session.json đã đọc; blob chỉ được đọc khi truy cập.
+
+    get("session", "iteration_history", 0, "result", "ct_output") chỉ đọc blob của field đó;
+    materialize() trả về toàn bộ dữ liệu như định dạng JSON cũ.
+    """
+
+    def __init__(self, session_dir: str, index: Dict[str, Any], store: BlobStore):
+        self.session_dir = session_dir
+        self.index = index
+        self.store = store
+
+    @property
+    def session(self) -> Dict[str, Any]:
+        return self.index.get("session", {})
+
+    @property
+    def deliverables(self) -> Dict[str, Any]:
+        return self.index.get("deliverables", {})
+
+    def get(self, *path: Any, default: Any = None) -> Any:
+        value: Any = self.index
+        for key in path:
+            try:
+                value = value[key]
+            except (KeyError, IndexError, TypeError):
+                return default
+        return unpack(value, self.store)
+
+    def materialize(self) -> Dict[str, Any]:
+        """{"session": ..., "deliverables": ...} với mọi blob đã được đọc"""
+        return {
+            "session": unpack(self.session, self.store),
+            "deliverables": unpack(self.deliverables, self.store)
+        }
+
+def _write_json_atomic(path: str, data: Any, indent: Optional[int] = None):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+    os.replace(tmp_path, path)
+
+def blob_root(output_dir: str) -> str:
+    return os.path.join(output_dir, BLOBS_DIRNAME)
+
+def save_session(session_dir: str,
+                 session: Dict[str, Any],
+                 deliverables: Dict[str, Any],
+                 store: BlobStore,
+                 min_chars: int = 512) -> Dict[str, Any]:
+    """
+    Ghi session.json: dataclass/Enum/datetime được chuyển về JSON thuần (không còn default=str),
+    string dài nằm trong blob store. Trả về index đã ghi.
+    """
+    os.makedirs(session_dir, exist_ok=True)
+
+    index = {
+        "format": FORMAT_VERSION,
+        "blobs": os.path.relpath(store.root, session_dir),
+        "session": pack(to_jsonable(session), store, min_chars),
+        "deliverables": pack(to_jsonable(deliverables), store, min_chars)
+    }
+    _write_json_atomic(os.path.join(session_dir, INDEX_FILENAME), index, indent=1)
+    return index
+
+def load_session(session_dir: str, store: Optional[BlobStore] = None) -> SessionRecord:
+    """
+    Đọc session đã lưu (định dạng blob hoặc JSON cũ).
+
+    Với định dạng cũ, session_summary.json/final_deliverables.json được đọc nguyên và không có blob.
+    """
+    index_path = os.path.join(session_dir, INDEX_FILENAME)
+
+    if os.path.isfile(index_path):
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if store is None:
+            store = BlobStore(os.path.normpath(os.path.join(session_dir, index.get("blobs", BLOBS_DIRNAME))))
+        return SessionRecord(session_dir, index, store)
+
+    legacy_path = os.path.join(session_dir, LEGACY_SUMMARY_FILENAME)
+    if not os.path.isfile(legacy_path):
+        raise FileNotFoundError(f"Không tìm thấy {INDEX_FILENAME} hoặc {LEGACY_SUMMARY_FILENAME} trong {session_dir}")
+
+    session, deliverables = _read_legacy(session_dir)
+    return SessionRecord(
+        session_dir,
+        {"format": 0, "session": session, "deliverables": deliverables},
+        store or BlobStore(blob_root(os.path.dirname(os.path.abspath(session_dir))))
+    )
+
+def _read_legacy(session_dir: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    with open(os.path.join(session_dir, LEGACY_SUMMARY_FILENAME), "r", encoding="utf-8") as f:
+        session = json.load(f)
+
+    # final_deliverables nằm trong cả session_summary.json lẫn file riêng; chỉ giữ một bản
+    deliverables = session.pop("final_deliverables", None) or {}
+    deliverables_path = os.path.join(session_dir, LEGACY_DELIVERABLES_FILENAME)
+    if os.path.isfile(deliverables_path):
+        with open(deliverables_path, "r", encoding="utf-8") as f:
+            deliverables = json.load(f)
+
+    return session, deliverables
+
+def _dir_bytes(paths: List[str]) -> int:
+    return sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
+
+def migrate_output_dir(output_dir: str,
+                       codec: str = "auto",
+                       min_chars: int = 512,
+                       keep_json: bool = False) -> Dict[str, Any]:
+    """
+    Chuyển các session định dạng JSON cũ trong output_dir sang session.json + blobs.
+
+    Dữ liệu đọc lại từ định dạng mới được so với file gốc trước khi xóa file JSON cũ
+    (keep_json=True giữ lại).
+    """
+    store = BlobStore(blob_root(output_dir), codec)
+    stats = {"migrated": 0, "skipped": 0, "failed": 0, "bytes_before": 0, "bytes_after": 0}
+    stored_before = store.stored_bytes
+
+    for entry in sorted(os.listdir(output_dir)) if os.path.isdir(output_dir) else []:
+        session_dir = os.path.join(output_dir, entry)
+        legacy_files = [os.path.join(session_dir, name)
+                        for name in (LEGACY_SUMMARY_FILENAME, LEGACY_DELIVERABLES_FILENAME)]
+        index_path = os.path.join(session_dir, INDEX_FILENAME)
+
+        if entry == BLOBS_DIRNAME or not os.path.isdir(session_dir):
+            continue
+        if not os.path.isfile(legacy_files[0]) or os.path.isfile(index_path):
+            stats["skipped"] += 1
+            continue
+
+        try:
+            session, deliverables = _read_legacy(session_dir)
+            save_session(session_dir, session, deliverables, store, min_chars)
+
+            restored = load_session(session_dir, store).materialize()
+            if restored != {"session": session, "deliverables": deliverables}:
+                os.remove(index_path)
+                raise ValueError("dữ liệu đọc lại không khớp file gốc")
+
+            stats["bytes_before"] += _dir_bytes(legacy_files)
+            stats["bytes_after"] += os.path.getsize(index_path)
+            if not keep_json:
+                for path in legacy_files:
+                    if os.path.isfile(path):
+                        os.remove(path)
+
+            stats["migrated"] += 1
+            logger.info(f"Migrated session {entry}")
+
+        except (OSError, ValueError) as e:
+            stats["failed"] += 1
+            logger.warning(f"Could not migrate session {entry}: {str(e)}")
+
+    stats["bytes_after"] += store.stored_bytes - stored_before
+    stats["blobs"] = store.get_stats()
+    return stats
+
+def collect_garbage(output_dir: str, min_age: int = 24 * 3600) -> Dict[str, Any]:
+    """
+    Xóa blob không còn session.json nào tham chiếu (vd. sau khi xóa thư mục session).
+
+    Blob mới hơn min_age giây được giữ vì session đang chạy có thể chưa ghi index.
+    """
+    store = BlobStore(blob_root(output_dir))
+    referenced = set()
+
+    for entry in os.listdir(output_dir) if os.path.isdir(output_dir) else []:
+        index_path = os.path.join(output_dir, entry, INDEX_FILENAME)
+        if not os.path.isfile(index_path):
+            continue
+        with open(index_path, "r", encoding="utf-8") as f:
+            referenced.update(iter_refs(json.load(f)))
+
+    removed = 0
+    freed = 0
+    now = time.time()
+    for digest, path in store.iter_blobs():
+        if digest in referenced or now - os.path.getmtime(path) < min_age:
+            continue
+        freed += os.path.getsize(path)
+        os.remove(path)
+        removed += 1
+
+    return {"referenced": len(referenced), "removed": removed, "freed_bytes": freed}
@@ -0,0 +1,95 @@
+"""
+Singleflight - Gộp các request giống hệt nhau đang bay (LLM, ESV) thành một lần gọi upstream
+Các caller đồng thời cùng key chờ chung một task; task chỉ bị hủy khi mọi caller đã hủy
+"""
+
+import asyncio
+import logging
+import weakref
+from typing import Dict, Any, Awaitable, Callable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class _Flight:
+    """Một request đang bay và số caller đang chờ nó"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    Coalescer theo key trong một event loop.
+
+    Caller đầu tiên (leader) tạo task chạy fn(); các caller sau cùng key chỉ await task đó.
+    Mỗi caller await qua asyncio.shield nên việc một caller bị cancel không làm hủy
+    request của các caller khác; khi caller cuối cùng rời đi mà task chưa xong thì task bị hủy.
+    """
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self._flights: Dict[str, _Flight] = {}
+
+        # Counters
+        self.leaders = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    def is_inflight(self, key: str) -> bool:
+        return key in self._flights
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """Chạy fn() hoặc chờ kết quả của lần chạy fn() đang bay với cùng key"""
+        flight = self._flights.get(key)
+
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(fn()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _task, k=key, f=flight: self._forget(k, f))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+        flight.waiters += 1
+
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Không còn ai chờ: hủy request và không cho caller mới nhập vào task đang hủy
+                flight.task.cancel()
+                self._forget(key, flight)
+                self.cancelled += 1
+
+    def _forget(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê coalescing"""
+        total = self.leaders + self.coalesced
+
+        return {
+            "upstream_calls": self.leaders,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+            "inflight": len(self._flights),
+            "coalesce_rate": round(self.coalesced / total, 3) if total else 0.0
+        }
+
+# Registry theo event loop: task/future asyncio gắn với một loop
+_shared_flights: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, SingleFlight]]" = \
+    weakref.WeakKeyDictionary()
+
+def get_shared_singleflight(name: str) -> SingleFlight:
+    """Lấy coalescer dùng chung theo tên (vd. "llm", "esv") trong event loop hiện tại"""
+    loop = asyncio.get_running_loop()
+    flights = _shared_flights.setdefault(loop, {})
+
+    if name not in flights:
+        flights[name] = SingleFlight(name)
+
+    return flights[name]
@@ -0,0 +1,353 @@
+"""
+Structured Output - JSON schema cho output của từng agent, parser có kiểm tra schema và sửa lỗi JSON
+Khi bật structured output, agent yêu cầu LLM trả JSON (response_format) thay vì markdown tự do;
+điểm số và quyết định được đọc trực tiếp từ JSON thay vì regex trên text
+"""
+
+import ast
+import json
+import logging
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Any, Tuple
+
+from backend.config import EVALUATION_CRITERIA, ADVERSARIAL_ROLE_MAPPING
+
+logger = logging.getLogger(__name__)
+
+# Chế độ response_format
+MODE_JSON_SCHEMA = "json_schema"  # OpenAI-style structured outputs (provider kiểm tra schema)
+MODE_JSON_OBJECT = "json_object"  # Chỉ đảm bảo JSON hợp lệ; schema nằm trong prompt
+
+# Trạng thái parse
+STATUS_VALID = "valid"
+STATUS_REPAIRED = "repaired"
+STATUS_FAILED = "failed"
+
+SEVERITY_LEVELS = ["low", "medium", "high", "critical"]
+
+def worst_status(statuses: List[Optional[str]]) -> Optional[str]:
+    """Trạng thái tệ nhất của nhiều lần parse (failed > repaired > valid); None nếu không có lần nào"""
+    ranked = [STATUS_VALID, STATUS_REPAIRED, STATUS_FAILED]
+    present = [status for status in statuses if status in ranked]
+    return max(present, key=ranked.index) if present else None
+
+_STRING = {"type": "string"}
+_STRINGS = {"type": "array", "items": {"type": "string"}}
+
+def _object(properties: Dict[str, Any], required: Optional[List[str]] = None) -> Dict[str, Any]:
+    return {"type": "object", "properties": properties, "required": required or list(properties)}
+
+def _criteria_scores(criteria: List[str], integer: bool, extra: Dict[str, Any]) -> Dict[str, Any]:
+    score = {"type": "integer" if integer else "number", "minimum": 0, "maximum": 10}
+    entry = _object({"score": score, "reasoning": _STRING, **extra}, ["score", "reasoning"])
+    return _object({criterion: entry for criterion in criteria})
+
+def _phase_criteria(phase: str) -> List[str]:
+    return EVALUATION_CRITERIA.get(phase, EVALUATION_CRITERIA["analysis"])
+
+@lru_cache(maxsize=None)
+def get_schema(agent_type: str, phase: str) -> Dict[str, Any]:
+    """JSON schema cho output của agent trong phase ("analysis" hoặc "ideas"); không được sửa dict trả về"""
+    if agent_type == "synthesis":
+        # Điểm đứng đầu để vẫn đọc được khi output bị cắt ở phần văn bản.
+        # Không có trường quyết định: quyết định vòng lặp được tính từ điểm (_determine_loop_decision)
+        return _object({
+            "scores": _criteria_scores(_phase_criteria(phase), integer=False, extra={}),
+            "summary": _STRING,
+            "strengths": _STRINGS,
+            "weaknesses": _STRINGS,
+            "conflicts": _STRINGS,
+            "next_round_instructions": _STRINGS
+        }, ["scores", "summary"])
+
+    if agent_type == "critical_thinking":
+        return _object({
+            "criteria": _criteria_scores(_phase_criteria(phase), integer=True, extra={
+                "strengths": _STRINGS,
+                "weaknesses": _STRINGS,
+                "suggestions": _STRINGS
+            }),
+            "overall_assessment": _STRING,
+            "critical_issues": _STRINGS,
+            "improvement_suggestions": _STRINGS,
+            "questions_raised": _STRINGS
+        }, ["criteria", "overall_assessment", "critical_issues", "improvement_suggestions"])
+
+    if agent_type == "adversarial":
+        vulnerability = _object({
+            "category": _STRING,
+            "severity": {"type": "string", "enum": SEVERITY_LEVELS},
+            "description": _STRING,
+            "evidence": _STRINGS,
+            "potential_impact": _STRING,
+            "mitigation_suggestions": _STRINGS
+        }, ["category", "severity", "description"])
+        role_attack = _object({
+            "role": {"type": "string", "enum": list(ADVERSARIAL_ROLE_MAPPING)},
+            "attacks": _STRINGS
+        })
+        return _object({
+            "role_attacks": {"type": "array", "items": role_attack},
+            "vulnerabilities": {"type": "array", "items": vulnerability},
+            "overall_verdict": _STRING
+        }, ["vulnerabilities", "overall_verdict"])
+
+    if agent_type == "primary":
+        if phase == "ideas":
+            idea = _object({
+                "name": _STRING,
+                "target_audience": _STRING,
+                "problem": _STRING,
+                "solution": _STRING,
+                "business_model": _STRING,
+                "competitive_advantage": _STRING,
+                "competitors": _STRINGS,
+                "initial_investment": _STRING,
+                "timeline": _STRING,
+                "risks": _STRINGS,
+                "roadmap": _STRINGS,
+                "unique_point": _STRING
+            }, ["name", "target_audience", "problem", "solution", "business_model"])
+            return _object({
+                "ideas": {"type": "array", "items": idea},
+                "summary": _STRING
+            }, ["ideas"])
+
+        finding = _object({"title": _STRING, "description": _STRING, "evidence": _STRINGS}, ["title", "description"])
+        return _object({
+            "summary": _STRING,
+            "trends": {"type": "array", "items": finding},
+            "pain_points": {"type": "array", "items": finding},
+            "opportunities": _STRINGS,
+            "contradictions": _STRINGS,
+            "next_focus": _STRINGS
+        }, ["summary", "trends", "pain_points"])
+
+    raise ValueError(f"No structured output schema for agent type: {agent_type}")
+
+def build_response_format(name: str, schema: Dict[str, Any], mode: str = MODE_JSON_SCHEMA) -> Dict[str, Any]:
+    """Giá trị response_format cho payload chat completion"""
+    if mode == MODE_JSON_OBJECT:
+        return {"type": "json_object"}
+
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": f"{name}_output", "schema": schema, "strict": False}
+    }
+
+@lru_cache(maxsize=None)
+def _compact_schema(agent_type: str, phase: str) -> str:
+    return json.dumps(get_schema(agent_type, phase), ensure_ascii=False, separators=(",", ":"))
+
+def format_instructions(agent_type: str, phase: str) -> str:
+    """Hướng dẫn định dạng gắn vào cuối prompt (cần cho json_object, giúp model bám schema với json_schema)"""
+    return f"""
+
+## ĐỊNH DẠNG OUTPUT (STRUCTURED)
+Bỏ qua định dạng markdown được mô tả trong system prompt. Chỉ trả về DUY NHẤT một JSON object hợp lệ
+(không code fence, không văn bản ngoài JSON) theo JSON schema sau:
+{_compact_schema(agent_type, phase)}
+Điểm số là số trong thang 0-10; giữ nguyên nội dung chi tiết trong các trường văn bản."""
+
+# ---------------------------------------------------------------------------
+# Validation + coercion
+# ---------------------------------------------------------------------------
+
+_INVALID = object()
+_NUMBER_PATTERN = re.compile(r"-?\d+(?:[.,]\d+)?")
+
+def _coerce(value: Any, schema: Dict[str, Any], path: str, errors: List[str], array_item: bool = False) -> Any:
+    """
+    Ép value về schema; trả về _INVALID nếu không thể.
+
+    Phần tử mảng không hợp lệ (kể cả object thiếu property bắt buộc) bị bỏ; property không hợp lệ
+    bị bỏ, còn object khác thiếu property bắt buộc chỉ ghi lỗi để caller tự quyết định
+    (output một phần vẫn tốt hơn không có gì).
+    """
+    expected = schema.get("type")
+
+    if expected == "object":
+        if not isinstance(value, dict):
+            errors.append(f"{path}: expected object")
+            return _INVALID
+        properties = schema.get("properties", {})
+        result = {}
+        for key, item in value.items():
+            if key in properties:
+                coerced = _coerce(item, properties[key], f"{path}.{key}", errors)
+                if coerced is not _INVALID:
+                    result[key] = coerced
+            else:
+                result[key] = item
+        missing = [key for key in schema.get("required", []) if key not in result]
+        errors.extend(f"{path}.{key}: missing" for key in missing)
+        return _INVALID if missing and array_item else result
+
+    if expected == "array":
+        # Một phần tử đơn lẻ thay cho mảng một phần tử
+        item_type = schema.get("items", {}).get("type")
+        if (item_type == "string" and isinstance(value, str)) or (item_type == "object" and isinstance(value, dict)):
+            value = [value]
+        if not isinstance(value, list):
+            errors.append(f"{path}: expected array")
+            return _INVALID
+        items_schema = schema.get("items", {})
+        result = []
+        for index, item in enumerate(value):
+            coerced = _coerce(item, items_schema, f"{path}[{index}]", errors, array_item=True)
+            if coerced is not _INVALID:
+                result.append(coerced)
+        return result
+
+    if expected in ("number", "integer"):
+        if isinstance(value, str):
+            match = _NUMBER_PATTERN.search(value)
+            value = float(match.group(0).replace(",", ".")) if match else None
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            errors.append(f"{path}: expected number")
+            return _INVALID
+        if value < schema.get("minimum", float("-inf")) or value > schema.get("maximum", float("inf")):
+            errors.append(f"{path}: {value} out of range")
+            return _INVALID
+        return int(round(value)) if expected == "integer" else float(value)
+
+    if expected == "string":
+        if value is None or isinstance(value, (dict, list)):
+            errors.append(f"{path}: expected string")
+            return _INVALID
+        value = str(value).strip()
+        enum = schema.get("enum")
+        if enum:
+            normalized = value.lower().replace(" ", "_")
+            matched = next((option for option in enum if option.lower() == normalized), None)
+            if matched is None:
+                errors.append(f"{path}: {value!r} not in {enum}")
+                return _INVALID
+            value = matched
+        return value
+
+    if expected == "boolean":
+        if not isinstance(value, bool):
+            errors.append(f"{path}: expected boolean")
+            return _INVALID
+        return value
+
+    return value
+
+def validate(data: Any, schema: Dict[str, Any]) -> Tuple[Any, List[str]]:
+    """Kiểm tra và ép kiểu data theo schema; trả về (data đã ép kiểu hoặc None, danh sách lỗi)"""
+    errors: List[str] = []
+    coerced = _coerce(data, schema, "$", errors)
+    return (None if coerced is _INVALID else coerced), errors
+
+# ---------------------------------------------------------------------------
+# Repair
+# ---------------------------------------------------------------------------
+
+_FENCE_PATTERN = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+_TRAILING_COMMA_PATTERN = re.compile(r",\s*([}\]])")
+_DANGLING_KEY_PATTERN = re.compile(r'[{,]\s*"(?:[^"\\]|\\.)*"\s*$')
+
+def _balance(text: str) -> str:
+    """Cắt phần thừa sau object cân bằng đầu tiên, hoặc đóng các string/ngoặc còn mở (output bị cắt)"""
+    stack: List[str] = []
+    in_string = False
+    escaped = False
+
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if stack and stack[-1] == char:
+                stack.pop()
+            if not stack:
+                return text[:index + 1]
+
+    # Bị cắt giữa chừng (thường do max_tokens)
+    if in_string:
+        text += '"'
+    text = text.rstrip().rstrip(",")
+    if text.endswith(":"):
+        text += "null"
+    elif stack and stack[-1] == "}" and _DANGLING_KEY_PATTERN.search(text):
+        text += ":null"
+
+    return text + "".join(reversed(stack))
+
+def repair_json(text: str) -> Optional[str]:
+    """Sửa các lỗi JSON thường gặp của LLM: code fence, văn bản thừa, dấu phẩy thừa, output bị cắt"""
+    text = text.strip().lstrip("\ufeff")
+
+    fenced = _FENCE_PATTERN.search(text)
+    if fenced:
+        text = fenced.group(1)
+    elif text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+
+    start = text.find("{")
+    if start < 0:
+        return None
+
+    return _TRAILING_COMMA_PATTERN.sub(r"\1", _balance(text[start:]))
+
+def _loads_lenient(text: str) -> Any:
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+
+    # Python literal (nháy đơn, True/False/None) - literal_eval không thực thi code
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+
+@dataclass
+class StructuredResult:
+    """Kết quả parse structured output"""
+    data: Optional[Dict[str, Any]]
+    status: str  # "valid", "repaired", "failed"
+    errors: List[str] = field(default_factory=list)
+
+def parse_structured(text: str, schema: Dict[str, Any]) -> StructuredResult:
+    """
+    Parse output JSON của LLM theo schema.
+
+    Fast path: json.loads + validate. Nếu lỗi, sửa text (repair_json) rồi parse lại;
+    "failed" khi không lấy được object hoặc thiếu trường bắt buộc ở cấp gốc.
+    """
+    repaired = False
+
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = None
+
+    if not isinstance(data, dict):
+        repaired_text = repair_json(text or "")
+        data = _loads_lenient(repaired_text) if repaired_text else None
+        repaired = True
+
+    if not isinstance(data, dict):
+        return StructuredResult(None, STATUS_FAILED, ["$: no JSON object found"])
+
+    data, errors = validate(data, schema)
+    missing_root = [key for key in schema.get("required", []) if key not in (data or {})]
+
+    if data is None or missing_root:
+        return StructuredResult(data, STATUS_FAILED, errors)
+
+    return StructuredResult(data, STATUS_REPAIRED if repaired or errors else STATUS_VALID, errors)
@@ -0,0 +1,175 @@
+"""
+Token Estimator - Ước lượng nhanh số token cục bộ (không cần tokenizer của provider)
+Kèm context window theo model và TokenBudget để chia token cho các segment của prompt
+trước khi request rời khỏi process
+"""
+
+import math
+from typing import Dict, List, Any
+
+# Overhead ước lượng cho mỗi message (role, separators) theo format chat
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Context window (token) theo prefix tên model; prefix dài nhất khớp được dùng
+MODEL_CONTEXT_LIMITS: Dict[str, int] = {
+    "gemini-2.5": 1_048_576,
+    "gemini-2.0": 1_048_576,
+    "gemini-1.5-pro": 2_097_152,
+    "gemini-1.5": 1_048_576,
+    "gemini": 32_768,
+    "gpt-4.1": 1_047_576,
+    "gpt-4o": 128_000,
+    "gpt-4-turbo": 128_000,
+    "gpt-4": 8_192,
+    "gpt-3.5-turbo": 16_385,
+    "gpt-5": 400_000,
+    "o1": 200_000,
+    "o3": 200_000,
+    "o4": 200_000,
+    "claude": 200_000,
+    "llama-3": 131_072,
+    "qwen": 32_768,
+    "mistral": 32_768,
+    "deepseek": 65_536
+}
+DEFAULT_CONTEXT_LIMIT = 32_768
+
+# Ước lượng có sai số: chừa thêm tỉ lệ này của context window khi tính chỗ trống
+SAFETY_MARGIN_RATIO = 0.05
+
+TRUNCATION_MARKER = "\n...[đã rút gọn]"
+
+def _char_cost(ch: str) -> float:
+    return 0.25 if ord(ch) <= 127 else 1 / 1.5
+
+def estimate_tokens(text: str) -> int:
+    """
+    Ước lượng số token của text.
+
+    ASCII (tiếng Anh, code, markdown) ~4 ký tự/token; ký tự có dấu tiếng Việt và
+    emoji bị BPE tách nhỏ hơn nhiều nên tính ~1.5 ký tự/token.
+    """
+    if not text:
+        return 0
+
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    ascii_count = len(text) - non_ascii
+
+    return math.ceil(ascii_count / 4 + non_ascii / 1.5)
+
+def estimate_messages_tokens(messages: List[Any]) -> int:
+    """Ước lượng số token của danh sách LLMMessage (hoặc dict role/content)"""
+    total = 0
+    for message in messages:
+        content = message.get("content", "") if isinstance(message, dict) else message.content
+        total += estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+    return total
+
+def context_limit(model: str, override: int = 0) -> int:
+    """Context window của model (override > 0 được dùng nguyên)"""
+    if override > 0:
+        return override
+
+    # "openai/gpt-4o", "gemini/gemini-2.5-pro" (LiteLLM) -> tên model
+    name = model.lower().rsplit("/", 1)[-1]
+    matches = [prefix for prefix in MODEL_CONTEXT_LIMITS if name.startswith(prefix)]
+    return MODEL_CONTEXT_LIMITS[max(matches, key=len)] if matches else DEFAULT_CONTEXT_LIMIT
+
+def safety_margin(limit: int) -> int:
+    return int(limit * SAFETY_MARGIN_RATIO)
+
+def truncate_to_tokens(text: str, max_tokens: int, marker: str = TRUNCATION_MARKER) -> str:
+    """Cắt text để ước lượng (kể cả marker) không vượt max_tokens; ưu tiên cắt ở cuối dòng/từ"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    room = max_tokens - estimate_tokens(marker)
+    if room <= 0:
+        return ""
+
+    # Một lượt cộng dồn chi phí theo ký tự (cùng tỉ lệ với estimate_tokens)
+    cost = 0.0
+    cut = 0
+    for i, ch in enumerate(text):
+        cost += _char_cost(ch)
+        if cost > room:
+            break
+        cut = i + 1
+
+    head = text[:cut]
+    boundary = max(head.rfind("\n"), head.rfind(" "))
+    if boundary > cut * 0.8:
+        head = head[:boundary]
+
+    return head.rstrip() + marker
+
+def allocate_tokens(sizes: List[int], budget: int) -> List[int]:
+    """
+    Chia budget cho các phần kiểu water-filling: phần nhỏ hơn phần chia đều được giữ nguyên,
+    phần dư được chia lại cho các phần lớn hơn.
+    """
+    allocation = [0] * len(sizes)
+    remaining = max(0, budget)
+    pending = sorted(range(len(sizes)), key=lambda i: sizes[i])
+
+    while pending:
+        share = remaining // len(pending)
+        smallest = pending[0]
+        if sizes[smallest] > share:
+            for i in pending:
+                allocation[i] = share
+            break
+        allocation[smallest] = sizes[smallest]
+        remaining -= sizes[smallest]
+        pending.pop(0)
+
+    return allocation
+
+class TokenBudget:
+    """
+    Token cho các segment của một prompt, dùng theo thứ tự ưu tiên.
+
+    take() tính các phần bắt buộc (hướng dẫn, heading); fit()/fit_many() cắt phần còn lại
+    theo chỗ trống, nên segment được fit trước giữ được nhiều hơn segment fit sau.
+    """
+
+    def __init__(self, total: int):
+        self.total = max(0, total)
+        self.used = 0
+        self.truncated_segments = 0
+        self.trimmed_tokens = 0
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.total - self.used)
+
+    def take(self, *texts: str):
+        self.used += sum(estimate_tokens(text) for text in texts)
+
+    def fit(self, text: str, reserve: int = 0, marker: str = TRUNCATION_MARKER) -> str:
+        """Cắt text vừa chỗ trống sau khi chừa reserve token cho các segment sau"""
+        return self.fit_many([text], reserve, marker)[0]
+
+    def fit_many(self, texts: List[str], reserve: int = 0, marker: str = TRUNCATION_MARKER) -> List[str]:
+        """Chia chỗ trống (trừ reserve) cho nhiều text ngang hàng (vd. các nguồn dữ liệu)"""
+        sizes = [estimate_tokens(text) for text in texts]
+        allocation = allocate_tokens(sizes, self.remaining - max(0, reserve))
+
+        fitted = []
+        for text, size, allowed in zip(texts, sizes, allocation):
+            if size > allowed:
+                text = truncate_to_tokens(text, allowed, marker)
+                self.truncated_segments += 1
+                self.trimmed_tokens += size - estimate_tokens(text)
+            self.used += estimate_tokens(text)
+            fitted.append(text)
+
+        return fitted
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "budget": self.total,
+            "used": self.used,
+            "truncated_segments": self.truncated_segments,
+            "trimmed_tokens": self.trimmed_tokens
+        }
@@ -0,0 +1,254 @@
+"""
+Tracing - Span có cấu trúc cho phase, loop, agent call, HTTP attempt, retry và ESV query
+Ghi wall time, queue time, token và payload bytes; export JSON-lines và Chrome trace
+(mở bằng chrome://tracing hoặc Perfetto) và tổng hợp latency breakdown theo session
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Any, Iterator
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILENAME = "trace.jsonl"
+CHROME_TRACE_FILENAME = "trace.chrome.json"
+
+# Các category span
+CATEGORY_SESSION = "session"
+CATEGORY_PHASE = "phase"
+CATEGORY_LOOP = "loop"
+CATEGORY_AGENT = "agent"
+CATEGORY_LLM = "llm"
+CATEGORY_HTTP = "http"
+CATEGORY_RETRY = "retry"
+CATEGORY_ESV = "esv"
+
+# Các attribute số được cộng dồn trong latency breakdown
+_SUMMED_ATTRIBUTES = ("prompt_tokens", "completion_tokens", "request_bytes", "response_bytes",
+                      "cacheable_prefix_tokens", "cached_prompt_tokens")
+
+@dataclass
+class Span:
+    """Một khoảng thời gian được đo; thời gian tính bằng giây"""
+    span_id: str
+    name: str
+    category: str
+    parent_id: Optional[str] = None
+    start_time: float = 0.0  # epoch
+    duration: float = 0.0
+    queue_time: float = 0.0  # Thời gian chờ slot (rate limiter, semaphore) trước khi thực sự chạy
+    lane: int = 0  # asyncio task chạy span (tid trong Chrome trace)
+    status: str = "ok"
+    error: Optional[str] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    _start_monotonic: float = field(default=0.0, repr=False)
+
+    def set(self, **attributes):
+        """Gán thêm attributes cho span"""
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data.pop("_start_monotonic", None)
+        return data
+
+# Tracer và span hiện tại của task; asyncio.gather/create_task copy context nên các nhánh
+# song song kế thừa tracer và span cha
+_current_tracer: contextvars.ContextVar[Optional["Tracer"]] = contextvars.ContextVar("mcts_tracer", default=None)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("mcts_span", default=None)
+
+class Tracer:
+    """
+    Thu thập span của một session.
+
+    Span đã kết thúc được append ngay vào file JSON-lines (nếu có path) để vẫn xem được
+    trace của session bị dừng giữa chừng. Tracer với enabled=False không ghi gì.
+    """
+
+    def __init__(self, trace_path: Optional[str] = None, enabled: bool = True):
+        self.trace_path = trace_path
+        self.enabled = enabled
+        self.spans: List[Span] = []
+
+        self._started_at = time.time()
+        self._started_monotonic = time.monotonic()
+        self._lanes: Dict[int, int] = {}
+
+        if self.enabled and self.trace_path:
+            trace_dir = os.path.dirname(self.trace_path)
+            if trace_dir:
+                os.makedirs(trace_dir, exist_ok=True)
+
+    def _get_lane(self) -> int:
+        """Đánh số asyncio task hiện tại để các nhánh song song nằm trên các lane riêng"""
+        if not self.enabled:
+            return 0
+
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+
+        key = id(task) if task else 0
+        if key not in self._lanes:
+            self._lanes[key] = len(self._lanes)
+        return self._lanes[key]
+
+    def start_span(self,
+                   name: str,
+                   category: str,
+                   parent: Optional[Span] = None,
+                   **attributes) -> Span:
+        """Mở span mà không đặt làm span hiện tại (dùng trong async generator)"""
+        parent = parent or _current_span.get()
+        return Span(
+            span_id=uuid.uuid4().hex[:16],
+            name=name,
+            category=category,
+            parent_id=parent.span_id if parent else None,
+            start_time=time.time(),
+            lane=self._get_lane(),
+            attributes=attributes,
+            _start_monotonic=time.monotonic()
+        )
+
+    def end_span(self, span: Span, error: Optional[str] = None):
+        """Đóng span và ghi lại"""
+        span.duration = time.monotonic() - span._start_monotonic
+        if error:
+            span.status = "error"
+            span.error = error[:500]
+
+        if not self.enabled:
+            return
+
+        self.spans.append(span)
+
+        if self.trace_path:
+            try:
+                with open(self.trace_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+            except OSError as e:
+                logger.warning(f"Failed to write trace span: {str(e)}")
+
+    @contextmanager
+    def span(self, name: str, category: str, **attributes) -> Iterator[Span]:
+        """Context manager đo một span và đặt nó làm cha của các span mở bên trong"""
+        span = self.start_span(name, category, **attributes)
+        token = _current_span.set(span)
+        error = None
+
+        try:
+            yield span
+        except BaseException as e:
+            error = f"{type(e).__name__}: {str(e)}"
+            raise
+        finally:
+            _current_span.reset(token)
+            self.end_span(span, error=span.error or error)
+
+    def export_chrome_trace(self, path: str):
+        """Ghi trace theo định dạng Chrome Trace Event (complete events, đơn vị micro giây)"""
+        events = [
+            {
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": int((span.start_time - self._started_at) * 1_000_000),
+                "dur": int(span.duration * 1_000_000),
+                "pid": 1,
+                "tid": span.lane,
+                "args": {
+                    **span.attributes,
+                    "queue_time": round(span.queue_time, 4),
+                    "status": span.status,
+                    **({"error": span.error} if span.error else {})
+                }
+            }
+            for span in self.spans
+        ]
+
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False, default=str)
+
+    def get_latency_breakdown(self, top_n: int = 10) -> Dict[str, Any]:
+        """
+        Tổng hợp latency theo category và theo tên span.
+
+        Thời gian của các span chạy song song được cộng dồn nên tổng theo category
+        có thể lớn hơn wall time của session.
+        """
+        wall_time = time.monotonic() - self._started_monotonic
+
+        def summarize(spans: List[Span]) -> Dict[str, Any]:
+            durations = sorted(s.duration for s in spans)
+            summary = {
+                "count": len(spans),
+                "total_time": round(sum(durations), 3),
+                "mean_time": round(sum(durations) / len(durations), 3),
+                "p95_time": round(durations[min(len(durations) - 1, int(len(durations) * 0.95))], 3),
+                "max_time": round(durations[-1], 3),
+                "queue_time": round(sum(s.queue_time for s in spans), 3),
+                "errors": sum(1 for s in spans if s.status == "error")
+            }
+            for key in _SUMMED_ATTRIBUTES:
+                total = sum(s.attributes.get(key, 0) or 0 for s in spans)
+                if total:
+                    summary[key] = total
+            return summary
+
+        by_category: Dict[str, List[Span]] = {}
+        by_name: Dict[str, List[Span]] = {}
+        for span in self.spans:
+            by_category.setdefault(span.category, []).append(span)
+            by_name.setdefault(span.name, []).append(span)
+
+        name_summaries = sorted(
+            ((name, summarize(spans)) for name, spans in by_name.items()),
+            key=lambda item: item[1]["total_time"],
+            reverse=True
+        )
+
+        slowest = sorted(
+            (s for s in self.spans if s.category not in (CATEGORY_SESSION, CATEGORY_PHASE, CATEGORY_LOOP)),
+            key=lambda s: s.duration,
+            reverse=True
+        )[:top_n]
+
+        return {
+            "wall_time": round(wall_time, 3),
+            "span_count": len(self.spans),
+            "by_category": {category: summarize(spans) for category, spans in by_category.items()},
+            "by_name": dict(name_summaries[:top_n * 2]),
+            "slowest_spans": [
+                {
+                    "name": s.name,
+                    "category": s.category,
+                    "duration": round(s.duration, 3),
+                    "queue_time": round(s.queue_time, 3),
+                    "attributes": s.attributes
+                }
+                for s in slowest
+            ]
+        }
+
+# Tracer no-op dùng khi không có session nào đang trace
+_NULL_TRACER = Tracer(enabled=False)
+
+def get_tracer() -> Tracer:
+    """Tracer của context hiện tại (no-op nếu chưa bật tracing)"""
+    return _current_tracer.get() or _NULL_TRACER
+
+def set_tracer(tracer: Optional[Tracer]) -> contextvars.Token:
+    """Gắn tracer vào context hiện tại; trả về token để reset_tracer"""
+    return _current_tracer.set(tracer)
+
+def reset_tracer(token: contextvars.Token):
+    _current_tracer.reset(token)
@@ -248,19 +248,19 @@ def show_results(session_dir):
     """
     
     try:
+        from backend.core.session_store import load_session
+        
         session_path = Path(session_dir)
         
-        # Load session summary
-        summary_file = session_path / "session_summary.json"
-        if not summary_file.exists():
-            console.print(f"❌ Không tìm thấy file session_summary.json trong {session_dir}", style="red")
+        # Load session summary (session.json + blobs hoặc session_summary.json cũ); chỉ đọc metadata
+        try:
+            record = load_session(session_dir)
+        except FileNotFoundError as e:
+            console.print(f"❌ {str(e)}", style="red")
             return
         
-        with open(summary_file, 'r', encoding='utf-8') as f:
-            session_data = json.load(f)
-        
         # Display results
-        display_session_summary(session_data)
+        display_session_summary(record.session)
         
         # Display analysis results if available
         analysis_file = session_path / "analysis_results.md"
@@ -281,6 +281,43 @@ def show_results(session_dir):
     except Exception as e:
         console.print(f"❌ Lỗi đọc kết quả: {str(e)}", style="red")
 
+@cli.command()
+@click.argument('output_dir', type=click.Path(exists=True, file_okay=False))
+@click.option('--codec', type=click.Choice(["auto", "zst", "gz"]), default="auto", help='Codec nén blob')
+@click.option('--keep-json', is_flag=True, help='Giữ lại session_summary.json/final_deliverables.json sau khi chuyển')
+@click.option('--gc', 'run_gc', is_flag=True, help='Xóa blob không còn session nào tham chiếu')
+def migrate_results(output_dir, codec, keep_json, run_gc):
+    """
+    Chuyển các session JSON cũ trong OUTPUT_DIR sang session.json + blob store nén
+    
+    Ví dụ:
+    python main.py migrate-results results --gc
+    """
+    from backend.core.session_store import migrate_output_dir, collect_garbage
+    
+    try:
+        stats = migrate_output_dir(output_dir, codec=codec, min_chars=DEFAULT_CONFIG.session_blob_min_chars,
+                                   keep_json=keep_json)
+    except ValueError as e:
+        console.print(f"❌ {str(e)}", style="red")
+        return
+    
+    table = Table(title="📦 Migrate Results", show_header=True, header_style="bold magenta")
+    table.add_column("Chỉ số", style="cyan")
+    table.add_column("Giá trị", style="green")
+    table.add_row("Đã chuyển", str(stats["migrated"]))
+    table.add_row("Bỏ qua", str(stats["skipped"]))
+    table.add_row("Lỗi", str(stats["failed"]))
+    table.add_row("Dung lượng JSON cũ", f"{stats['bytes_before'] / 1024:.1f} KB")
+    table.add_row("Dung lượng mới (index + blob)", f"{stats['bytes_after'] / 1024:.1f} KB")
+    table.add_row("Codec", stats["blobs"]["codec"])
+    
+    if run_gc:
+        gc_stats = collect_garbage(output_dir)
+        table.add_row("Blob đã xóa (GC)", f"{gc_stats['removed']} ({gc_stats['freed_bytes'] / 1024:.1f} KB)")
+    
+    console.print(table)
+
 @cli.command()
 def create_sample_config():
     """
@@ -326,8 +363,9 @@ def create_sample_config():
     console.print("Bạn có thể chỉnh sửa file này và sử dụng với tùy chọn --config")
 
 @cli.command()
+@click.option('--no-stream', is_flag=True, help='Tắt streaming token (chờ toàn bộ câu trả lời)')
 @coro
-async def chat():
+async def chat(no_stream):
     """
     Bắt đầu interactive chat session với MCTS AI
     
@@ -340,7 +378,7 @@ async def chat():
     
     try:
         from backend.core.dynamic_processor import start_interactive_session
-        await start_interactive_session()
+        await start_interactive_session(stream=not no_stream)
         
     except Exception as e:
         console.print(f"❌ Lỗi khởi tạo chat session: {str(e)}", style="red")
@@ -530,8 +568,13 @@ def create_sample_data():
 @click.option('--config', '-c', help='Đường dẫn đến file config JSON')
 @click.option('--no-esv', is_flag=True, help='Tắt ESV validation')
 @click.option('--output', '-o', help='Thư mục xuất kết quả (ghi đè)')
+@click.option('--stream', is_flag=True, help='Hiển thị token của các agent ngay khi LLM sinh ra')
+@click.option('--llm-cache', is_flag=True, help='Bật cache response LLM trên đĩa (tái sử dụng khi chạy lại)')
+@click.option('--cache-only', is_flag=True, help='Chỉ dùng response đã cache, không gọi LLM API')
+@click.option('--fresh-ideas', is_flag=True, help='Không dùng cache cho các call tạo ý tưởng')
 @coro
-async def pipeline(prompt, analysis_loops, idea_loops, config, no_esv, output):
+async def pipeline(prompt, analysis_loops, idea_loops, config, no_esv, output, stream,
+                   llm_cache, cache_only, fresh_ideas):
     """
     Chạy FULL PIPELINE từ input tự do: phân tích → thử lửa → tổng hợp → lặp → báo cáo.
 
@@ -548,6 +591,11 @@ async def pipeline(prompt, analysis_loops, idea_loops, config, no_esv, output):
         cfg.enable_external_validation = False
     if output:
         cfg.output_dir = output
+    if llm_cache or cache_only:
+        cfg.enable_llm_cache = True
+        cfg.llm_cache_mode = "cache_only" if cache_only else "read_write"
+    if fresh_ideas:
+        cfg.llm_cache_bypass_ideas = True
 
     console.print("\n🚀 Đang chạy FULL PIPELINE...", style="bold green")
     console.print(f"🧪 Vòng phân tích: {cfg.max_analysis_loops} | 💡 Vòng ý tưởng: {cfg.max_idea_loops}")
@@ -567,6 +615,9 @@ async def pipeline(prompt, analysis_loops, idea_loops, config, no_esv, output):
     focus_areas = []  # để orchestrator tự phát hiện
 
     async with MCTSOrchestrator(cfg) as orchestrator:
+        if stream:
+            orchestrator.set_stream_handler(make_stream_printer())
+        
         session = await orchestrator.run_full_analysis(
             data_sources=data_sources,
             timeframe=timeframe,
@@ -590,9 +641,143 @@ async def pipeline(prompt, analysis_loops, idea_loops, config, no_esv, output):
         console.print("\nGồm:")
         console.print("- analysis_results.md (phân tích cuối)")
         console.print("- ideas_results.md (ý tưởng cuối)")
-        console.print("- final_deliverables.json (tổng hợp số liệu)")
+        if cfg.session_storage == "blobs":
+            console.print("- session.json (tổng hợp số liệu, text nén trong blobs/)")
+        else:
+            console.print("- final_deliverables.json (tổng hợp số liệu)")
         console.print("- final_report.md (báo cáo Markdown đầy đủ)")
 
+@cli.command()
+@click.argument('jobs_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--workers', '-w', type=int, default=2, help='Số worker process chạy song song')
+@click.option('--max-inflight', type=int, default=8, help='Tổng số LLM request đang bay tối đa (mọi worker)')
+@click.option('--manifest', '-m', help='File manifest để resume (mặc định: <output>/batch_manifest.jsonl)')
+@click.option('--analysis-loops', type=int, default=3, help='Số vòng lặp phân tích (X)')
+@click.option('--idea-loops', type=int, default=3, help='Số vòng lặp ý tưởng (Y)')
+@click.option('--config', '-c', help='Đường dẫn đến file config JSON')
+@click.option('--no-esv', is_flag=True, help='Tắt ESV validation')
+@click.option('--output', '-o', help='Thư mục xuất kết quả (ghi đè)')
+@click.option('--llm-cache', is_flag=True, help='Bật cache response LLM trên đĩa (dùng chung giữa workers)')
+@coro
+async def batch(jobs_file, workers, max_inflight, manifest, analysis_loops, idea_loops,
+                config, no_esv, output, llm_cache):
+    """
+    Chạy nhiều FULL PIPELINE sessions từ file JSONL trên nhiều process.
+
+    Mỗi dòng: {"id": "...", "prompt": "...", "data_sources": [...], "focus_areas": [...]}
+    data_sources có thể là object inline hoặc đường dẫn file JSON. Chạy lại cùng lệnh
+    sẽ bỏ qua các job đã hoàn thành trong manifest.
+
+    Ví dụ:
+    python main.py batch prompts.jsonl --workers 4 --max-inflight 12
+    """
+    from backend.core.batch_runner import BatchRunner, load_batch_jobs, JOB_COMPLETED
+
+    cfg = load_config(config)
+    cfg.max_analysis_loops = analysis_loops
+    cfg.max_idea_loops = idea_loops
+    if no_esv:
+        cfg.enable_external_validation = False
+    if output:
+        cfg.output_dir = output
+    if llm_cache:
+        cfg.enable_llm_cache = True
+
+    try:
+        jobs = load_batch_jobs(jobs_file)
+    except (OSError, ValueError) as e:
+        console.print(f"❌ Lỗi đọc {jobs_file}: {str(e)}", style="red")
+        return
+
+    manifest_path = manifest or f"{cfg.output_dir}/batch_manifest.jsonl"
+    runner = BatchRunner(cfg, manifest_path, workers=workers, max_inflight_llm=max_inflight)
+
+    console.print(f"\n🚀 Batch: {len(jobs)} job | 👷 {workers} workers | 🔀 tối đa {max_inflight} LLM request đồng thời",
+                  style="bold green")
+
+    def print_result(result):
+        if result.status == JOB_COMPLETED:
+            console.print(f"✅ {result.job_id} → {result.output_dir} ({result.duration:.0f}s, {result.total_tokens} tokens)")
+        else:
+            console.print(f"❌ {result.job_id}: {result.error}", style="red")
+
+    stats = await runner.run(jobs, on_result=print_result)
+
+    table = Table(title="📈 Batch Throughput", show_header=True, header_style="bold magenta")
+    table.add_column("Chỉ số", style="cyan")
+    table.add_column("Giá trị", style="green")
+    table.add_row("Hoàn thành", str(stats["completed"]))
+    table.add_row("Lỗi", str(stats["failed"]))
+    table.add_row("Bỏ qua (đã xong)", str(stats["skipped"]))
+    table.add_row("Thời gian", f"{stats['wall_time']:.1f}s")
+    table.add_row("Sessions/giờ", f"{stats['sessions_per_hour']:.2f}")
+    table.add_row("Tokens/giây", f"{stats['tokens_per_sec']:.2f}")
+    console.print(table)
+    console.print(f"📒 Manifest: {stats['manifest']}")
+
+@cli.command()
+@click.argument('session_id', required=True)
+@click.option('--config', '-c', help='Đường dẫn đến file config JSON')
+@click.option('--output', '-o', help='Thư mục gốc chứa session (mặc định theo config)')
+@click.option('--stream', is_flag=True, help='Hiển thị token của các agent ngay khi LLM sinh ra')
+@coro
+async def resume(session_id, config, output, stream):
+    """
+    Tiếp tục một session bị dừng giữa chừng từ checkpoint journal.
+
+    Các bước đã hoàn thành được replay từ journal, không gọi lại LLM.
+
+    Ví dụ:
+    python main.py resume mcts_20240101_120000
+    """
+    from backend.core.reporting import generate_full_report_md
+    from backend.core.session_journal import SessionJournal
+
+    cfg = load_config(config)
+    if output:
+        cfg.output_dir = output
+
+    journal = SessionJournal.for_session(cfg.output_dir, session_id)
+    start_record = journal.get_session_start()
+    if not start_record:
+        console.print(f"❌ Không tìm thấy checkpoint: {journal.path}", style="red")
+        return
+
+    # Dùng lại cấu hình vòng lặp của lần chạy gốc để replay đúng các bước
+    for key, value in start_record.get("settings", {}).items():
+        setattr(cfg, key, value)
+
+    console.print(f"\n♻️ Tiếp tục session {session_id}...", style="bold green")
+
+    async with MCTSOrchestrator(cfg) as orchestrator:
+        if stream:
+            orchestrator.set_stream_handler(make_stream_printer())
+
+        session = await orchestrator.resume_session(session_id)
+
+        base_output_dir = f"{cfg.output_dir}/{session.session_id}"
+        report_path = f"{base_output_dir}/final_report.md"
+        Path(base_output_dir).mkdir(parents=True, exist_ok=True)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            f.write(generate_full_report_md(session, base_output_dir))
+
+        console.print("\n✅ Hoàn thành session", style="green")
+        console.print(f"📂 Thư mục kết quả: {base_output_dir}")
+        console.print(f"📄 Báo cáo cuối: {report_path}")
+
+def make_stream_printer():
+    """Tạo stream handler in token ra console, đánh dấu mỗi khi call đang stream thay đổi.
+    Các call song song của cùng agent (review từng idea, fan-out vai trò AE) được phân biệt bằng stream_id"""
+    state = {"stream": None}
+    
+    def handler(agent_type: str, delta: str, stream_id: int):
+        if state["stream"] != (agent_type, stream_id):
+            state["stream"] = (agent_type, stream_id)
+            console.print(f"\n\n[{agent_type} #{stream_id}] ", style="bold cyan", end="", markup=False)
+        console.print(delta, end="", markup=False, highlight=False)
+    
+    return handler
+
 def load_config(config_file: str = None, overrides: Dict[str, Any] = None) -> MCTSConfig:
     """Load configuration từ file hoặc sử dụng default"""
     
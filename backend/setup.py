@@ -50,6 +50,9 @@ setup(
             "sphinx-rtd-theme>=1.2.0",
             "myst-parser>=1.0.0",
         ],
+        "zstd": [
+            "zstandard>=0.21.0",
+        ],
     },
     entry_points={
         "console_scripts": [
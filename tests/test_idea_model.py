@@ -0,0 +1,59 @@
+"""
+Tests cho IdeaStreamParser / parse_ideas
+"""
+
+from pathlib import Path
+
+from backend.core.idea_model import IdeaStreamParser, parse_ideas
+
+SAMPLE_IDEAS = Path(__file__).resolve().parent.parent / "results" / "mcts_20250810_090753" / "ideas_results.md"
+
+def test_empty_label_in_preamble_does_not_leak_into_first_idea():
+    ideas = parse_ideas("Intro\n**Giải pháp:**\n## 1. Ý tưởng A\n- bullet one that is long enough\n")
+
+    assert len(ideas) == 1
+    assert ideas[0].name == "Ý tưởng A"
+    assert ideas[0].solution == ""
+
+def test_multiline_field_inside_idea():
+    ideas = parse_ideas(
+        "## 1. Ý tưởng A\n"
+        "**Giải pháp:**\n"
+        "- Nền tảng kết nối nông dân\n"
+        "- Thanh toán qua ví\n"
+        "**Business Model:** phí giao dịch\n"
+    )
+
+    assert ideas[0].solution == "Nền tảng kết nối nông dân; Thanh toán qua ví"
+    assert ideas[0].business_model == "phí giao dịch"
+
+def test_streaming_matches_full_parse():
+    markdown = SAMPLE_IDEAS.read_text(encoding="utf-8")
+    parser = IdeaStreamParser()
+    streamed = []
+    for start in range(0, len(markdown), 37):
+        streamed.extend(parser.feed(markdown[start:start + 37]))
+    streamed.extend(parser.close())
+
+    assert streamed == parse_ideas(markdown)
+
+def test_sample_ideas_results():
+    ideas = parse_ideas(SAMPLE_IDEAS.read_text(encoding="utf-8"))
+
+    assert [idea.name for idea in ideas] == ["Klarity Spend", "Nexus Core"]
+    assert [idea.position for idea in ideas] == [0, 1]
+    assert len({idea.id for idea in ideas}) == 2
+
+    klarity = ideas[0]
+    assert klarity.text.startswith("#### 1. TÊN Ý TƯỞNG: Klarity Spend")
+    assert klarity.audience.startswith("Phân khúc chính")
+    assert klarity.business_model.startswith("B2B SaaS")
+    assert klarity.solution
+
+def test_body_hash_ignores_position():
+    first = parse_ideas("## 1. Alpha\n**Giải pháp:** app cho sinh viên vay\n## 2. Beta\n**Giải pháp:** nền tảng nông nghiệp số\n")
+    swapped = parse_ideas("## 1. Beta\n**Giải pháp:** nền tảng nông nghiệp số\n## 2. Alpha\n**Giải pháp:** app cho sinh viên vay\n")
+
+    assert first[0].body_hash == swapped[1].body_hash
+    assert first[0].text_hash != swapped[1].text_hash
+    assert first[0].body_hash != first[1].body_hash